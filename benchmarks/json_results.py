@@ -0,0 +1,87 @@
+"""
+Compares the JSON encoding of analysis results by ``save_results`` before (``json.dumps`` with indentation,
+then the number array regex of ``compact_json_number_array``) and after (the one-pass ``dumps_json``, with
+and without orjson), on results of long synthetic tracks, and checks that the outputs are identical.
+
+The results have the beats, downbeats and beat positions of a track at a constant tempo and one segment every
+15 s, with times rounded to 10 ms as in ``analyze``.
+
+Usage:
+  python benchmarks/json_results.py --duration 3600 --bpm 140
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from dataclasses import asdict
+from allin1fix import utils
+from allin1fix.typings import AnalysisResult, Segment
+from allin1fix.utils import compact_json_number_array, dumps_json
+
+
+def make_result(duration: float, bpm: float) -> dict:
+  beats = np.arange(0., duration, 60. / bpm).round(2)
+  segment_times = np.arange(0., duration + 15., 15.)
+  result = asdict(AnalysisResult(
+    path='/music/track.wav',
+    bpm=int(bpm),
+    beats=beats.tolist(),
+    downbeats=beats[::4].tolist(),
+    beat_positions=[i % 4 + 1 for i in range(len(beats))],
+    segments=[
+      Segment(start=float(start), end=float(end), label='verse')
+      for start, end in zip(segment_times[:-1], segment_times[1:])
+    ],
+  ))
+  del result['activations'], result['embeddings']
+  return result
+
+
+def timeit(fn, repeats):
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    output = fn()
+    times.append(time.perf_counter() - start)
+  return output, min(times)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--duration', type=float, default=3600., help='Length of the track in seconds')
+  parser.add_argument('--bpm', type=float, default=140., help='Tempo of the track')
+  parser.add_argument('--repeats', type=int, default=5, help='Runs per encoder, the fastest is kept')
+  args = parser.parse_args()
+
+  result = make_result(args.duration, args.bpm)
+  orjson = utils.orjson
+
+  def dumps_json_without_orjson():
+    utils.orjson = None
+    try:
+      return dumps_json(result)
+    finally:
+      utils.orjson = orjson
+
+  cases = [
+    ('json.dumps', lambda: json.dumps(result, indent=2)),
+    ('json.dumps + regex', lambda: compact_json_number_array(json.dumps(result, indent=2))),
+    ('dumps_json', dumps_json_without_orjson),
+  ]
+  if orjson is not None:
+    cases.append(('dumps_json (orjson)', lambda: dumps_json(result)))
+
+  print(f'{len(result["beats"])} beats, {len(result["segments"])} segments ({args.duration:.0f} s at {args.bpm} BPM)')
+  print(f'{"encoder":>20} {"time":>9} {"identical":>10}')
+  expected = None
+  for name, encode in cases:
+    output, elapsed = timeit(encode, args.repeats)
+    if name == 'json.dumps + regex':
+      expected = output
+    identical = '' if expected is None else str(output == expected)
+    print(f'{name:>20} {elapsed * 1000:7.1f}ms {identical:>10}')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,101 @@
+"""
+Compares the postprocessing kernels (running max, running median, window means at the peak candidates) with the
+unfold and sliding window formulations they replaced, on long synthetic activations, and checks that their outputs
+are identical (max abs diff of 0).
+
+The window sizes are those of the packaged configuration at 100 FPS: 25 frames for the beat local maxima, 97 for
+the downbeat and section ones, 401 for the median filter, and 12 s on each side for the boundary peak picking.
+
+Usage:
+  python benchmarks/kernels.py --duration 3600
+"""
+import argparse
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from numpy.lib.stride_tricks import sliding_window_view
+from allin1fix.postprocessing.kernels import local_maxima, median_filter_1d, peak_picking
+
+FPS = 100
+
+
+def unfold_local_maxima(tensor, filter_size):
+  padding = filter_size // 2
+  padded = F.pad(tensor.unsqueeze(0), (padding, padding), mode='constant', value=-torch.inf)
+  windows = padded.unfold(1, filter_size, 1)
+  mask = torch.eq(windows[:, :, padding], windows.max(dim=-1).values)
+  output = torch.zeros_like(tensor.unsqueeze(0))
+  output[mask] = tensor.unsqueeze(0)[mask]
+  return output[0], mask.nonzero()
+
+
+def unfold_median_filter_1d(tensor, filter_size):
+  padding = filter_size // 2
+  padded = F.pad(tensor.unsqueeze(0), (padding, padding), mode='reflect')
+  return padded.unfold(1, filter_size, 1).median(dim=-1).values[0]
+
+
+def sliding_window_peak_picking(activation, window_past, window_future):
+  padded = np.pad(activation, (window_past, window_future), mode='constant')
+  max_filter = sliding_window_view(padded, window_past + window_future + 1)
+  maxima = (activation == np.max(max_filter, axis=-1)) & (activation > 0)
+  past_mean = np.mean(sliding_window_view(padded[:-(window_future + 1)], window_past), axis=-1)
+  future_mean = np.mean(sliding_window_view(padded[window_past + 1:], window_future), axis=-1)
+  strength = activation - ((past_mean + future_mean) / 2)
+  output = np.zeros_like(activation)
+  output[maxima] = strength[maxima]
+  return output
+
+
+def timeit(fn, repeats):
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    output = fn()
+    times.append(time.perf_counter() - start)
+  return output, min(times)
+
+
+def max_diff(a, b):
+  a = a[0] if isinstance(a, tuple) else a
+  b = b[0] if isinstance(b, tuple) else b
+  return float(np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)).max())
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--duration', type=float, default=3600., help='Length of the activations in seconds')
+  parser.add_argument('--repeats', type=int, default=3, help='Runs per kernel, the fastest is kept')
+  args = parser.parse_args()
+
+  num_frames = int(args.duration * FPS)
+  rng = np.random.default_rng(0)
+  activation = rng.uniform(0., 0.1, num_frames).astype(np.float32)
+  activation[rng.choice(num_frames, num_frames // 50, replace=False)] = rng.uniform(0.5, 1., num_frames // 50)
+  tensor = torch.from_numpy(activation)
+  window = 12 * FPS
+
+  cases = [
+    ('local_maxima(25)', lambda: unfold_local_maxima(tensor, 25), lambda: local_maxima(tensor, 25)),
+    ('local_maxima(97)', lambda: unfold_local_maxima(tensor, 97), lambda: local_maxima(tensor, 97)),
+    ('median_filter_1d(401)', lambda: unfold_median_filter_1d(tensor, 401), lambda: median_filter_1d(tensor, 401)),
+    (
+      f'peak_picking({window}, {window})',
+      lambda: sliding_window_peak_picking(activation, window, window),
+      lambda: peak_picking(activation, window, window),
+    ),
+  ]
+
+  print(f'{num_frames} frames ({args.duration:.0f} s at {FPS} FPS)')
+  print(f'{"kernel":>24} {"before":>9} {"after":>9} {"speedup":>8} {"max abs diff":>13}')
+  for name, before, after in cases:
+    expected, before_time = timeit(before, args.repeats)
+    output, after_time = timeit(after, args.repeats)
+    diff = max_diff(output, expected)
+    print(f'{name:>24} {before_time:8.3f}s {after_time:8.3f}s {before_time / after_time:7.1f}x {diff:13.2e}')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,61 @@
+"""
+Measures the peak memory (RSS) of a forward pass of a single AllInOne model,
+with and without retaining the hidden states of every encoder level.
+
+Each mode runs in a fresh process so that the peak RSS of one run does not leak into the other.
+Random weights are used, since the memory footprint does not depend on them.
+
+Usage:
+  python benchmarks/memory.py --duration 300
+"""
+import argparse
+import multiprocessing as mp
+import resource
+import sys
+
+FPS = 100
+
+
+def run(duration: float, output_hidden_states: bool, queue):
+  import torch
+  from omegaconf import OmegaConf
+  from allin1fix.config import Config, HarmonixConfig
+  from allin1fix.models import AllInOne
+
+  cfg = OmegaConf.structured(Config(data=HarmonixConfig()))
+  model = AllInOne(cfg).eval()
+  spec = torch.randn(1, cfg.data.num_instruments, int(duration * FPS), cfg.dim_input)
+
+  baseline = peak_rss_mb()
+  with torch.no_grad():
+    model(spec, output_hidden_states=output_hidden_states)
+  queue.put((baseline, peak_rss_mb()))
+
+
+def peak_rss_mb():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+  return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--duration', type=float, default=300, help='Track duration in seconds (default: 300)')
+  args = parser.parse_args()
+
+  ctx = mp.get_context('spawn')
+  results = {}
+  for name, output_hidden_states in [('all levels', True), ('lean', False)]:
+    queue = ctx.Queue()
+    process = ctx.Process(target=run, args=(args.duration, output_hidden_states, queue))
+    process.start()
+    results[name] = queue.get()
+    process.join()
+
+  print(f'Peak RSS for a {args.duration:.0f}s track:')
+  for name, (baseline, peak) in results.items():
+    print(f'  {name:>10}: {peak:8.1f} MB (+{peak - baseline:.1f} MB during the forward pass)')
+
+
+if __name__ == '__main__':
+  main()
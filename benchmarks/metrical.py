@@ -0,0 +1,108 @@
+"""
+Compares the two metrical postprocessors, madmom's DBN ('dbn') and peak picking ('peaks'), and the DBN narrowed by
+the true tempo and meter of every track as hints ('dbn+hint'), on synthetic beat and downbeat probabilities with
+a known ground truth: postprocessing time per track, and beat and downbeat F-measures (70 ms tolerance,
+as in madmom's BeatEvaluation).
+
+The tracks have random tempi (with a slow drift) and meters of 3 or 4 beats. The probabilities are peaks of random
+heights and slight timing jitter over a noise floor, with some missed and spurious peaks. They are easier than the
+outputs of a real model, so the F-measures are only meaningful relative to each other. Every track has its own
+hint, so the time of 'dbn+hint' includes building its narrowed DBN.
+
+Usage:
+  python benchmarks/metrical.py --num-tracks 20 --duration 180
+"""
+import argparse
+import time
+import numpy as np
+
+from madmom.evaluation.beats import BeatEvaluation
+from omegaconf import OmegaConf
+from allin1fix.config import Config, HarmonixConfig
+from allin1fix.typings import MetricalHint
+from allin1fix.postprocessing.metrical import (
+  combine_dbn_activations,
+  decode_metrical_structure,
+  pick_metrical_structure,
+)
+
+FPS = 100
+
+
+def make_track(rng, duration: float):
+  """
+  Returns synthetic beat and downbeat probabilities of shape (T,), the true beat and downbeat times,
+  and the metrical hint of the track.
+  """
+  num_frames = int(duration * FPS)
+  bpm = rng.uniform(80, 160)
+  num_beats = rng.choice([3, 4])
+  drift = rng.uniform(-0.05, 0.05)
+
+  times, t = [], rng.uniform(0., 60. / bpm)
+  while t < duration - 0.5:
+    times.append(t)
+    t += 60. / (bpm * (1 + drift * t / duration))
+  beat_times = np.array(times)
+  downbeat_times = beat_times[rng.integers(num_beats)::num_beats]
+
+  def peaks(times, miss_rate, height):
+    prob = rng.uniform(0., 0.08, num_frames)
+    kept = times[rng.random(len(times)) > miss_rate]
+    frames = np.round((kept + rng.normal(0, 0.01, len(kept))) * FPS).astype(int).clip(0, num_frames - 1)
+    for offset, scale in [(-2, 0.2), (-1, 0.6), (0, 1.), (1, 0.6), (2, 0.2)]:
+      idx = (frames + offset).clip(0, num_frames - 1)
+      prob[idx] = np.maximum(prob[idx], scale * rng.uniform(*height, len(frames)))
+    # Spurious peaks.
+    spurious = rng.integers(0, num_frames, len(times) // 20)
+    prob[spurious] = np.maximum(prob[spurious], rng.uniform(0.2, 0.5, len(spurious)))
+    return prob.astype(np.float32)
+
+  hint = MetricalHint(bpm=bpm * (1 + drift / 2), beats_per_bar=int(num_beats))
+  return (
+    peaks(beat_times, 0.05, (0.4, 1.)), peaks(downbeat_times, 0.1, (0.3, 0.9)), beat_times, downbeat_times, hint,
+  )
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-tracks', type=int, default=20, help='Number of synthetic tracks')
+  parser.add_argument('--duration', type=float, default=180., help='Length of every track in seconds')
+  args = parser.parse_args()
+
+  import torch
+
+  cfg = OmegaConf.structured(Config(data=HarmonixConfig()))
+  cfg.best_threshold_beat = cfg.best_threshold_downbeat = 0.2
+  rng = np.random.default_rng(0)
+  tracks = [make_track(rng, args.duration) for _ in range(args.num_tracks)]
+
+  methods = {
+    'dbn': lambda beat, downbeat, hint: decode_metrical_structure(
+      combine_dbn_activations(torch.from_numpy(beat), torch.from_numpy(downbeat)).numpy(), cfg,
+    ),
+    'dbn+hint': lambda beat, downbeat, hint: decode_metrical_structure(
+      combine_dbn_activations(torch.from_numpy(beat), torch.from_numpy(downbeat)).numpy(), cfg, hint,
+    ),
+    'peaks': lambda beat, downbeat, hint: pick_metrical_structure(beat, downbeat, cfg),
+  }
+
+  print(f'{args.num_tracks} tracks of {args.duration:.0f} s')
+  print(f'{"method":>8} {"time/track":>11} {"beat F":>7} {"downbeat F":>11}')
+  for name, method in methods.items():
+    # Warm-up, which also builds the DBN processor once, like in analyze().
+    method(*tracks[0][:2], tracks[0][4])
+    elapsed, beat_f, downbeat_f = 0., [], []
+    for prob_beats, prob_downbeats, beat_times, downbeat_times, hint in tracks:
+      start = time.perf_counter()
+      result = method(prob_beats, prob_downbeats, hint)
+      elapsed += time.perf_counter() - start
+      beat_f.append(BeatEvaluation(np.array(result['beats']), beat_times).fmeasure)
+      downbeat_f.append(BeatEvaluation(np.array(result['downbeats']), downbeat_times).fmeasure)
+    print(
+      f'{name:>8} {elapsed / len(tracks) * 1000:9.1f}ms {np.mean(beat_f):7.3f} {np.mean(downbeat_f):11.3f}'
+    )
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,214 @@
+"""
+Runs every inference variant of AllInOne on synthetic spectrograms of several lengths, checks that their outputs
+stay within tolerance of the plain float32 model, and records their latency and peak memory (RSS) to a JSON file.
+Given a baseline recorded earlier on the same machine, it fails on significant regressions.
+
+The models are built from the packaged Config with seeded random weights, so nothing is downloaded.
+Each variant runs in a fresh process so that its peak memory is not polluted by the others.
+
+Usage:
+  python benchmarks/regression.py --output baseline.json
+  python benchmarks/regression.py --baseline baseline.json --output current.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import sys
+import time
+
+FPS = 100
+OUTPUT_KEYS = ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function', 'embeddings']
+
+# Largest absolute difference allowed from the reference outputs, per variant.
+TOLERANCES = {
+  'reference': 0.,
+  'fused': 1e-4,
+  'padded': 1e-4,
+  'chunked': 1e-4,
+  'batched': 1e-4,
+  'all_levels': 0.,
+  'int8': 0.25,
+  'float16': 0.05,
+}
+
+
+def build_variant(name: str, model):
+  """Returns a function running the variant on a spectrogram of shape (1, stems, frames, bins)."""
+  import torch
+  from allin1fix.models import quantize_model
+  from allin1fix.models.dinat import DinatLayer1d
+
+  if name == 'reference':
+    return model
+  elif name == 'fused':
+    return model.to_inference()
+  elif name == 'padded':
+    for module in model.modules():
+      if isinstance(module, DinatLayer1d):
+        module.short_path = False
+    return model
+  elif name == 'chunked':
+    model.embeddings.chunk_size = 256
+    return model
+  elif name == 'batched':
+    # Two copies of the input in one batch, only the first output is compared.
+    def run(spec):
+      output = model(torch.cat([spec, spec]))
+      for key in OUTPUT_KEYS:
+        setattr(output, key, getattr(output, key)[:1])
+      return output
+    return run
+  elif name == 'all_levels':
+    return lambda spec: model(spec, output_hidden_states=True)
+  elif name == 'int8':
+    return quantize_model(model)
+  elif name == 'float16':
+    model = model.cuda().half()
+    return lambda spec: model(spec.cuda().half())
+  raise ValueError(f'Unknown variant: {name} (expected one of {list(TOLERANCES)})')
+
+
+def run_variant(name: str, depth: int, frames_list, repeats: int, queue):
+  import torch
+  from omegaconf import OmegaConf
+  from allin1fix.config import Config, HarmonixConfig
+  from allin1fix.models import AllInOne
+
+  cfg = OmegaConf.structured(Config(data=HarmonixConfig()))
+  cfg.depth = depth
+  torch.manual_seed(0)
+  model = build_variant(name, AllInOne(cfg).eval())
+
+  results = {}
+  for frames in frames_list:
+    generator = torch.Generator().manual_seed(frames)
+    spec = torch.randn(1, cfg.data.num_instruments, frames, cfg.dim_input, generator=generator)
+    with torch.no_grad():
+      # The first pass measures the peak memory, the following ones the latency.
+      baseline = peak_rss_mb()
+      output = model(spec)
+      peak_memory = peak_rss_mb() - baseline
+
+      latencies = []
+      for _ in range(repeats):
+        start = time.perf_counter()
+        model(spec)
+        latencies.append(time.perf_counter() - start)
+
+    results[frames] = {
+      'latency': sorted(latencies)[len(latencies) // 2],
+      'peak_memory_mb': peak_memory,
+      'outputs': {key: getattr(output, key).float().cpu().numpy() for key in OUTPUT_KEYS},
+    }
+  queue.put(results)
+
+
+def peak_rss_mb():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+  return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def find_regressions(results, baseline, max_slowdown: float, max_memory_growth: float, memory_slack_mb: float):
+  """Returns a description of every variant and length that is significantly slower or larger than the baseline."""
+  regressions = []
+  for name, runs in results.items():
+    for frames, current in runs.items():
+      previous = baseline.get(name, {}).get(frames)
+      if previous is None:
+        continue
+      if current['latency'] > previous['latency'] * (1 + max_slowdown):
+        regressions.append(
+          f'{name} @ {frames} frames: latency {current["latency"]:.3f}s vs {previous["latency"]:.3f}s'
+        )
+      if current['peak_memory_mb'] > previous['peak_memory_mb'] * (1 + max_memory_growth) + memory_slack_mb:
+        regressions.append(
+          f'{name} @ {frames} frames: peak memory {current["peak_memory_mb"]:.1f} MB '
+          f'vs {previous["peak_memory_mb"]:.1f} MB'
+        )
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--variants', nargs='+', default=None, help='Variants to run (default: all available)')
+  parser.add_argument('--durations', type=float, nargs='+', default=[5, 30, 60], help='Spectrogram lengths in seconds')
+  parser.add_argument('--depth', type=int, default=11, help='Number of encoder levels (default: 11)')
+  parser.add_argument('--repeats', type=int, default=3, help='Timed passes per length, the median is kept')
+  parser.add_argument('--output', default=None, help='Path of the JSON file to write the results to')
+  parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare against')
+  parser.add_argument('--max-slowdown', type=float, default=0.2, help='Allowed relative latency increase')
+  parser.add_argument('--max-memory-growth', type=float, default=0.2, help='Allowed relative peak memory increase')
+  parser.add_argument('--memory-slack', type=float, default=16., help='Allowed absolute peak memory increase in MB')
+  args = parser.parse_args()
+
+  import numpy as np
+  import torch
+
+  variants = args.variants or [
+    name for name in TOLERANCES
+    if name != 'float16' or torch.cuda.is_available()
+  ]
+  # Peak RSS only grows, so the lengths run from the shortest to the longest.
+  frames_list = sorted(int(duration * FPS) for duration in args.durations)
+
+  ctx = mp.get_context('spawn')
+  raw = {}
+  for name in ['reference'] + [name for name in variants if name != 'reference']:
+    queue = ctx.Queue()
+    process = ctx.Process(target=run_variant, args=(name, args.depth, frames_list, args.repeats, queue))
+    process.start()
+    raw[name] = queue.get()
+    process.join()
+
+  results = {}
+  failures = []
+  print(f'{"variant":>12} {"frames":>7} {"latency":>9} {"peak mem":>10} {"max abs diff":>13}')
+  for name in variants:
+    results[name] = {}
+    for frames in frames_list:
+      run, reference = raw[name][frames], raw['reference'][frames]
+      diff = max(
+        float(np.abs(run['outputs'][key] - reference['outputs'][key]).max())
+        for key in OUTPUT_KEYS
+      )
+      if diff > TOLERANCES[name]:
+        failures.append(f'{name} @ {frames} frames: max abs diff {diff:.2e} exceeds {TOLERANCES[name]:.0e}')
+      results[name][str(frames)] = {
+        'latency': run['latency'],
+        'peak_memory_mb': run['peak_memory_mb'],
+        'max_abs_diff': diff,
+      }
+      print(f'{name:>12} {frames:7d} {run["latency"]:8.3f}s {run["peak_memory_mb"]:7.1f} MB {diff:13.2e}')
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({
+        'version': 1,
+        'machine': platform.platform(),
+        'torch': torch.__version__,
+        'num_threads': torch.get_num_threads(),
+        'depth': args.depth,
+        'results': results,
+      }, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline['depth'] != args.depth:
+      sys.exit(f'The baseline was recorded with depth {baseline["depth"]}, not {args.depth}.')
+    failures += find_regressions(
+      results, baseline['results'], args.max_slowdown, args.max_memory_growth, args.memory_slack,
+    )
+
+  if failures:
+    print('\nFAILED:')
+    for failure in failures:
+      print(f'  {failure}')
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
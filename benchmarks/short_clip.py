@@ -0,0 +1,66 @@
+"""
+Compares the short-clip path of the 1D dilated attention layers with the padded computation on clips shorter
+than the receptive field, reporting the forward time of both and the largest differences of their outputs.
+
+Clips shorter than ``kernel_size * dilation`` (x2 with double attention) frames are zero-padded up to that size
+by the padded computation, which reaches about 10k frames at the deepest layer. The short path only computes
+the real frames. Random weights are used; the accuracy report is about numerical agreement, not model quality.
+
+Usage:
+  python benchmarks/short_clip.py --durations 5 10 20 30
+"""
+import argparse
+import time
+import torch
+
+from omegaconf import OmegaConf
+from allin1fix.config import Config, HarmonixConfig
+from allin1fix.models import AllInOne
+from allin1fix.models.dinat import DinatLayer1d
+
+FPS = 100
+OUTPUT_KEYS = ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function', 'embeddings']
+
+
+def set_short_path(model: torch.nn.Module, enabled: bool):
+  for module in model.modules():
+    if isinstance(module, DinatLayer1d):
+      module.short_path = enabled
+
+
+def run(model, spec, short_path: bool, repeats: int):
+  set_short_path(model, short_path)
+  with torch.no_grad():
+    model(spec)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+      output = model(spec)
+  return output, (time.perf_counter() - start) / repeats
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--durations', type=float, nargs='+', default=[5, 10, 20, 30], help='Clip durations in seconds')
+  parser.add_argument('--repeats', type=int, default=3, help='Number of timed forward passes (default: 3)')
+  args = parser.parse_args()
+
+  cfg = OmegaConf.structured(Config(data=HarmonixConfig()))
+  torch.manual_seed(0)
+  model = AllInOne(cfg).eval()
+  receptive_field = max(m.window_size for m in model.modules() if isinstance(m, DinatLayer1d))
+  print(f'Largest attention window: {receptive_field} frames ({receptive_field / FPS:.1f}s)')
+
+  print(f'{"duration":>9} {"padded":>9} {"short":>9} {"speedup":>8} {"max abs diff":>13}')
+  for duration in args.durations:
+    spec = torch.randn(1, cfg.data.num_instruments, int(duration * FPS), cfg.dim_input)
+    padded, time_padded = run(model, spec, short_path=False, repeats=args.repeats)
+    short, time_short = run(model, spec, short_path=True, repeats=args.repeats)
+    diff = max((getattr(padded, key) - getattr(short, key)).abs().max().item() for key in OUTPUT_KEYS)
+    print(
+      f'{duration:8.0f}s {time_padded:8.3f}s {time_short:8.3f}s '
+      f'{time_padded / time_short:7.2f}x {diff:13.2e}'
+    )
+
+
+if __name__ == '__main__':
+  main()
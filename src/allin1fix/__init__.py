@@ -13,9 +13,12 @@ except ImportError:
     )
 
 from .analyze import analyze
+from .reprocess import reprocess
+from .store import ResultStore
 from .visualize import visualize
 from .sonify import sonify
-from .typings import AnalysisResult
+from .streaming import StreamingAnalyzer
+from .typings import AnalysisResult, MetricalHint
 from .config import HARMONIX_LABELS
 from .utils import load_result
 from .stems import (
@@ -1,23 +1,35 @@
+import logging
 import torch
 
-from typing import List, Union, Optional
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Union, Optional
 from tqdm import tqdm
 from .demix import demix
 from .stems import get_stems, StemProvider, DemucsProvider, PrecomputedStemProvider
 from .stems_input import StemsInput, prepare_stems_for_analysis, validate_stems_input
 from .spectrogram import extract_spectrograms
 from .models import load_pretrained_model
+from .models.ensemble import Ensemble
+from .postprocessing.metrical import METRICAL_POSTPROCESSORS
+from .reprocess import save_cached_activations
+from .store import ResultStore
 from .visualize import visualize as _visualize
 from .sonify import sonify as _sonify
 from .helpers import (
-  run_inference,
+  run_model,
+  postprocess_activations,
+  HostBuffer,
   expand_paths,
   check_paths,
   rmdir_if_empty,
-  save_results,
+  TASK_HEADS,
+  LOGIT_KEYS,
 )
-from .utils import mkpath, load_result
-from .typings import AnalysisResult, PathLike
+from .utils import compute_sha256, mkpath, load_result
+from .typings import AnalysisResult, MetricalHint, PathLike
+
+logger = logging.getLogger(__name__)
 
 
 def analyze(
@@ -25,7 +37,7 @@ def analyze(
   out_dir: PathLike = None,
   visualize: Union[bool, PathLike] = False,
   sonify: Union[bool, PathLike] = False,
-  model: str = 'harmonix-all',
+  model: Union[str, torch.nn.Module] = 'harmonix-all',
   device: str = 'cuda' if torch.cuda.is_available() else 'cpu',
   include_activations: bool = False,
   include_embeddings: bool = False,
@@ -38,6 +50,21 @@ def analyze(
   stems_dict: Optional[dict] = None,
   skip_separation: bool = False,
   stems_input: Union[StemsInput, List[StemsInput], List[dict]] = None,
+  quantize: bool = False,
+  ensemble_tolerance: Optional[float] = None,
+  tasks: Optional[List[str]] = None,
+  fuse: bool = False,
+  model_dir: Optional[PathLike] = None,
+  ensemble_executor: Optional[str] = None,
+  ensemble_workers: Optional[int] = None,
+  postprocess_workers: int = 0,
+  metrical_postprocessor: str = 'dbn',
+  metrical_hints: Optional[Dict[PathLike, Union[MetricalHint, dict]]] = None,
+  activations_dir: Optional[PathLike] = None,
+  store_dir: Optional[PathLike] = None,
+  load_existing: bool = True,
+  load_workers: Optional[int] = None,
+  model_name: Optional[str] = None,
 ) -> Union[AnalysisResult, List[AnalysisResult]]:
   """
   Analyzes the provided audio files and returns the analysis results.
@@ -56,9 +83,10 @@ def analyze(
   sonify : Union[bool, PathLike], optional
       Whether to sonify the analysis results or not. If a path is provided, the sonifications will be saved in that
       directory. Default is False. If True, the sonifications will be saved in './sonif'.
-  model : str, optional
+  model : Union[str, torch.nn.Module], optional
       Name of the pre-trained model to be used for the analysis. Default is 'harmonix-all'. Please refer to the
-      documentation for the available models.
+      documentation for the available models. A model loaded by ``load_pretrained_model`` can also be given,
+      e.g. one with shared-memory weights passed to worker processes; the model loading options are then ignored.
   device : str, optional
       Device to be used for computation. Default is 'cuda' if available, otherwise 'cpu'.
   include_activations : bool, optional
@@ -84,6 +112,63 @@ def analyze(
   stems_input : Union[StemsInput, List[StemsInput], List[dict]], optional
       Direct stems input. Provide pre-separated stem files (bass, drums, other, vocals) directly.
       Alternative to paths parameter for stems-only workflow.
+  quantize : bool, optional
+      Whether to apply int8 dynamic quantization to the linear layers of every model fold. Only supported on CPU.
+      Trades a small accuracy loss for faster inference. Default is False.
+  ensemble_tolerance : float, optional
+      If given, an ensemble model evaluates its folds one by one and stops as soon as the running mean of the beat,
+      downbeat and section probabilities changes by less than this tolerance. Hard tracks still use all folds.
+      The number of folds evaluated for a track is given as ``num_models`` in its result.
+      Default is None, which always evaluates every fold.
+  tasks : List[str], optional
+      Outputs to compute: any of 'beats' (beats, downbeats, beat positions and BPM), 'structure' (segments), and
+      'embeddings'. Heads and postprocessing of the other outputs are skipped, and their fields are left empty.
+      Default is None, which computes beats and structure (and embeddings if ``include_embeddings`` is True).
+  fuse : bool, optional
+      Whether to transform the model for faster inference by fusing its linear layers and removing training-only
+      modules. The results are identical up to floating point error. Default is False.
+  model_dir : PathLike, optional
+      Directory of a local model registry to load the checkpoints from without any network access.
+      Default is None, which uses the ``ALLIN1FIX_MODEL_DIR`` environment variable if set, or the Hugging Face Hub.
+  ensemble_executor : str, optional
+      How to evaluate the folds of an ensemble concurrently: 'threads', or 'processes' for long-lived CPU worker
+      processes. Cannot be combined with ``ensemble_tolerance``. Only applies to a model given by name: build an
+      ``Ensemble`` with ``executor=...`` otherwise. Default is None, which evaluates them sequentially.
+  ensemble_workers : int, optional
+      Number of threads or processes of ``ensemble_executor``. Default is None, which uses one per fold
+      (limited by the number of CPUs for processes).
+  postprocess_workers : int, optional
+      Number of worker processes for the postprocessing (DBN decoding, segmentation) and saving of the results.
+      If positive, each track is handed to them as soon as its model outputs are on the host, and the model
+      moves on to the next track in the meantime. Default is 0, which postprocesses every track inline.
+  metrical_postprocessor : str, optional
+      How to derive the beats, downbeats and beat positions: 'dbn' decodes them with madmom's dynamic Bayesian
+      network, 'peaks' picks the peaks of the beat and downbeat probabilities and numbers the beats from the
+      downbeats, which takes milliseconds instead of seconds but is less robust. Default is 'dbn'.
+  metrical_hints : Dict[PathLike, Union[MetricalHint, dict]], optional
+      Known tempo and meter of some tracks, keyed by their path or file name, e.g.
+      ``{'song.mp3': {'bpm': 120, 'beats_per_bar': 4}}``; ``bpm`` can also be a (min, max) range. The DBN of
+      a hinted track only models those tempi and meters, which makes it faster and avoids tempo octave and meter
+      errors, as long as the hints are right. Default is None, which uses the full model for every track.
+  activations_dir : PathLike, optional
+      Directory where to keep the logits computed by the model for every track, in float32 and keyed by
+      the model name, the settings that change them (``fuse``, ``quantize``, ``ensemble_tolerance`` and ``tasks``)
+      and the hash of the spectrogram, so that ``reprocess`` can regenerate the results with other
+      postprocessing settings without running the separation or the model again. Default is None.
+  store_dir : PathLike, optional
+      Directory of a ``ResultStore`` (requires pyarrow) to append the new results to, keyed by their paths and
+      with the hashes of their spectrograms, in addition to the JSON files of ``out_dir``. Each result is appended
+      as soon as it is ready, and the buffered ones are written even if the run fails. Default is None.
+  load_existing : bool, optional
+      Whether to load and return the results already in ``out_dir``. If False, only the results of the newly
+      analyzed tracks are returned (None instead of a single result that already exists). Default is True.
+  load_workers : int, optional
+      Number of threads loading the existing results. Default is None, which uses the default of
+      ``concurrent.futures.ThreadPoolExecutor``.
+  model_name : str, optional
+      Name of a model given as a module, under which ``activations_dir`` keeps its logits. Required with
+      ``activations_dir`` in that case, so that different modules do not share the same cached logits.
+      Default is None, which uses the name given as ``model``.
 
   Returns
   -------
@@ -91,6 +176,31 @@ def analyze(
       Analysis results for the provided audio files.
   """
 
+  if metrical_postprocessor not in METRICAL_POSTPROCESSORS:
+    raise ValueError(
+      f'Unknown metrical postprocessor: {metrical_postprocessor} (expected one of {METRICAL_POSTPROCESSORS})'
+    )
+
+  metrical_hints = {
+    str(key): hint if isinstance(hint, MetricalHint) else MetricalHint(**hint)
+    for key, hint in (metrical_hints or {}).items()
+  }
+
+  if isinstance(model, str):
+    model_name = model
+  elif activations_dir is not None and model_name is None:
+    raise ValueError('model_name is required to keep the activations of a model given as a module.')
+  if ensemble_executor is not None and not isinstance(model, str):
+    raise ValueError(
+      'ensemble_executor only applies to a model loaded by name. Give the executor to the Ensemble instead.'
+    )
+
+  if tasks is not None:
+    unknown_tasks = set(tasks) - set(TASK_HEADS)
+    if unknown_tasks:
+      raise ValueError(f'Unknown tasks: {sorted(unknown_tasks)} (expected any of {list(TASK_HEADS)})')
+    include_embeddings = include_embeddings or 'embeddings' in tasks
+
   # Handle different input modes
   stems_mode = False
   
@@ -154,17 +264,22 @@ def analyze(
   if exist_paths:
     print(f'=> To re-analyze, please use --overwrite option.')
 
-  # Load the results for the tracks that are already analyzed.
+  # Load the results for the tracks that are already analyzed, in threads as it is mostly file I/O.
   results = []
-  if exist_paths:
-    results += [
-      load_result(
-        exist_path,
-        load_activations=include_activations,
-        load_embeddings=include_embeddings,
+  if exist_paths and load_existing:
+    with ThreadPoolExecutor(max_workers=load_workers) as executor:
+      results += tqdm(
+        executor.map(
+          lambda exist_path: load_result(
+            exist_path,
+            load_activations=include_activations,
+            load_embeddings=include_embeddings,
+          ),
+          exist_paths,
+        ),
+        total=len(exist_paths),
+        desc='Loading existing results',
       )
-      for exist_path in tqdm(exist_paths, desc='Loading existing results')
-    ]
 
   # Initialize demix_paths and spec_paths as empty lists
   demix_paths = []
@@ -201,36 +316,99 @@ def analyze(
     # Extract spectrograms for the tracks that are not analyzed yet.
     spec_paths = extract_spectrograms(demix_paths, spec_dir, multiprocess)
 
-    # Load the model.
-    model = load_pretrained_model(
-      model_name=model,
-      device=device,
-    )
+    # The logits are cached separately for each group of settings that changes them. Those of the model
+    # loading only apply to a model given by name.
+    if isinstance(model, str):
+      cache_settings = dict(fuse=fuse, quantize=quantize, ensemble_tolerance=ensemble_tolerance, tasks=tasks)
+    else:
+      cache_settings = dict(tasks=tasks)
 
-    with torch.no_grad():
-      pbar = tqdm(zip(todo_paths, spec_paths), total=len(todo_paths))
-      for path, spec_path in pbar:
-        pbar.set_description(f'Analyzing {path.name}')
+    # Load the model. The executor of an ensemble loaded here is shut down at the end.
+    owned_ensemble = None
+    if isinstance(model, str):
+      model = load_pretrained_model(
+        model_name=model,
+        device=device,
+        quantize=quantize,
+        ensemble_tolerance=ensemble_tolerance,
+        fuse=fuse,
+        model_dir=model_dir,
+        ensemble_executor=ensemble_executor,
+        ensemble_workers=ensemble_workers,
+      )
+      if isinstance(model, Ensemble):
+        owned_ensemble = model
 
-        result = run_inference(
-          path=path,
-          spec_path=spec_path,
-          model=model,
-          device=device,
-          include_activations=include_activations,
-          include_embeddings=include_embeddings,
-        )
+    # Postprocessing workers are spawned rather than forked, since the parent already runs torch threads.
+    pool = get_context('spawn').Pool(postprocess_workers) if postprocess_workers > 0 else None
+    # The outputs of every track are copied to the host through the same buffer.
+    buffer = HostBuffer()
+    pending = []
+    # Number of models evaluated by an adaptive ensemble for each track.
+    num_models_used = []
+    # Each result goes to the store as soon as it is ready, so an interrupted run keeps what it has done.
+    store = ResultStore(store_dir) if store_dir is not None else None
+    try:
+      with torch.no_grad():
+        pbar = tqdm(zip(todo_paths, spec_paths), total=len(todo_paths))
+        for path, spec_path in pbar:
+          pbar.set_description(f'Analyzing {path.name}')
 
-        # Save the result right after the inference.
-        # Checkpointing is always important for this kind of long-running tasks...
-        # for my mental health...
-        if out_dir is not None:
-          save_results(result, out_dir)
+          activations = run_model(
+            spec_path=spec_path,
+            model=model,
+            device=device,
+            include_embeddings=include_embeddings,
+            tasks=tasks,
+            buffer=buffer,
+            include_logits=activations_dir is not None,
+          )
+          num_models = activations.get('num_models')
+          if activations_dir is not None:
+            logits = {key: activations.pop(key) for key in LOGIT_KEYS if key in activations}
+            save_cached_activations(
+              activations_dir, model_name, model.cfg, path, spec_path, logits, settings=cache_settings,
+            )
+          if ensemble_tolerance is not None and num_models is not None:
+            num_models_used.append(int(num_models))
+            pbar.set_postfix(folds=num_models_used[-1])
 
-        results.append(result)
+          metrical_hint = metrical_hints.get(str(path), metrical_hints.get(path.name))
+          args = (
+            path, activations, model.cfg, include_activations, include_embeddings, tasks, out_dir,
+            metrical_postprocessor, metrical_hint,
+          )
+          content_hash = compute_sha256(spec_path) if store is not None else None
+          if pool is not None:
+            pending.append((pool.apply_async(postprocess_activations, args), content_hash))
+          else:
+            results.append(postprocess_activations(*args))
+            if store is not None:
+              store.append(results[-1], content_hashes=[content_hash])
+
+      # Collect the results of the workers in the order of the tracks.
+      for async_result, content_hash in tqdm(pending, desc='Postprocessing', disable=not pending):
+        results.append(async_result.get())
+        if store is not None:
+          store.append(results[-1], content_hashes=[content_hash])
+    finally:
+      if pool is not None:
+        pool.close()
+        pool.join()
+      if owned_ensemble is not None:
+        owned_ensemble.close()
+      if store is not None:
+        store.flush()
+
+    if num_models_used:
+      logger.info(
+        'Adaptive ensemble used %.2f of %d models on average (min: %d, max: %d).',
+        sum(num_models_used) / len(num_models_used), len(model.models), min(num_models_used), max(num_models_used),
+      )
 
   # Sort the results by the original order of the tracks.
-  results = sorted(results, key=lambda result: paths.index(result.path))
+  order = {path: i for i, path in enumerate(paths)}
+  results = sorted(results, key=lambda result: order[result.path])
 
   if visualize:
     if visualize is True:
@@ -267,5 +445,5 @@ def analyze(
     rmdir_if_empty(spec_dir)
 
   if not return_list:
-    return results[0]
+    return results[0] if results else None
   return results
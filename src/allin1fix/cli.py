@@ -7,10 +7,14 @@ import torch
 import json
 
 from pathlib import Path
+from omegaconf import OmegaConf
 from .analyze import analyze
+from .reprocess import reprocess
 from .stems import PrecomputedStemProvider
 from .stems_input import StemsInput, create_stems_input_from_directory, create_stems_input_from_pattern
 from .helpers import print_cache_info, clear_model_cache
+from .models import convert_to_safetensors, populate_registry, verify_registry
+from .models.registry import get_registry_dir
 
 
 def make_parser():
@@ -46,7 +50,54 @@ def make_parser():
                       help='Overwrite existing files (default: False)')
   parser.add_argument('--no-multiprocess', action='store_true', default=False,
                       help='Disable multiprocessing (default: False)')
+  parser.add_argument('--quantize', action='store_true', default=False,
+                      help='Apply int8 dynamic quantization to the model (CPU only) (default: False)')
+  parser.add_argument('--ensemble-tolerance', type=float, default=None,
+                      help='Stop evaluating ensemble folds once the averaged probabilities change by less than '
+                           'this tolerance (default: evaluate all folds)')
+  parser.add_argument('--ensemble-executor', choices=['threads', 'processes'], default=None,
+                      help='Evaluate the ensemble folds concurrently in threads or CPU worker processes '
+                           '(default: sequentially)')
+  parser.add_argument('--ensemble-workers', type=int, default=None,
+                      help='Number of threads or processes for --ensemble-executor (default: one per fold)')
+  parser.add_argument('--postprocess-workers', type=int, default=0,
+                      help='Number of worker processes that postprocess and save the results while the model runs '
+                           'on the next tracks (default: 0, inline)')
+  parser.add_argument('--metrical-postprocessor', choices=['dbn', 'peaks'], default='dbn',
+                      help='How to derive beats and downbeats: madmom\'s DBN, or fast peak picking without an HMM '
+                           '(default: dbn)')
+  parser.add_argument('--metrical-hints', type=Path, default=None,
+                      help='JSON file mapping track paths or file names to their known tempo and meter, e.g. '
+                           '{"song.mp3": {"bpm": 120, "beats_per_bar": 4}}, to narrow the DBN (default: None)')
+  parser.add_argument('--activations-dir', type=Path, default=None,
+                      help='Directory where to keep the logits of the model for every track, so that '
+                           '--reprocess can regenerate the results from them (default: None)')
+  parser.add_argument('--store-dir', type=Path, default=None,
+                      help='Also append the results to a columnar result store in this directory; requires pyarrow '
+                           '(default: None)')
+  parser.add_argument('--no-load-existing', action='store_true', default=False,
+                      help='Do not load the results already in the output directory, e.g. when resuming a large job '
+                           '(default: False)')
+  parser.add_argument('--load-workers', type=int, default=None,
+                      help='Number of threads loading the existing results (default: Python\'s default)')
+  parser.add_argument('--tasks', nargs='+', choices=['beats', 'structure', 'embeddings'], default=None,
+                      help='Outputs to compute; the others are skipped (default: beats structure)')
+  parser.add_argument('--fuse', action='store_true', default=False,
+                      help='Fuse the linear layers of the model for faster inference (default: False)')
+  parser.add_argument('--model-dir', type=Path, default=None,
+                      help='Local model registry to load the checkpoints from without network access '
+                           '(default: $ALLIN1FIX_MODEL_DIR if set, else the Hugging Face Hub)')
   
+  # Reprocessing options
+  reprocess_group = parser.add_argument_group('Reprocessing from the outputs kept with --activations-dir')
+  reprocess_group.add_argument('--reprocess', action='store_true',
+                               help='Regenerate the results of the tracks in --activations-dir (or only the given '
+                                    'paths) without running the separation or the model, then exit. Reads the '
+                                    'outputs kept with the same --fuse, --quantize, --ensemble-tolerance and --tasks')
+  reprocess_group.add_argument('--override', nargs='+', default=None, metavar='KEY=VALUE',
+                               help='Postprocessing settings of the model config to change when reprocessing, '
+                                    'e.g. best_threshold_downbeat=0.3')
+
   # Source separation options
   parser.add_argument('--stems-dict', type=Path, default=None,
                       help='JSON file mapping audio paths to stem directories')
@@ -82,6 +133,13 @@ def make_parser():
                           help='Clear all cached separation models and exit')
   cache_group.add_argument('--clear-cache-dry-run', action='store_true',
                           help='Show what would be deleted without actually deleting')
+  cache_group.add_argument('--convert-safetensors', action='store_true',
+                          help='Convert the checkpoints of --model to safetensors for faster loading and exit')
+  cache_group.add_argument('--populate-registry', action='store_true',
+                          help='Copy the checkpoints of --model from the Hugging Face cache into the local model '
+                               'registry (--model-dir or $ALLIN1FIX_MODEL_DIR) and exit')
+  cache_group.add_argument('--verify-registry', action='store_true',
+                          help='Verify the checksums of the local model registry and exit')
 
   return parser
 
@@ -113,6 +171,53 @@ def main():
         print(f"\nSuccessfully removed {count} model file(s)")
     return
 
+  if args.populate_registry:
+    model_dir = get_registry_dir(args.model_dir)
+    if model_dir is None:
+      raise ValueError('Specify the registry directory with --model-dir or $ALLIN1FIX_MODEL_DIR')
+    paths = populate_registry(model_dir, args.model)
+    print(f'=> Registered {len(paths)} checkpoint(s) in {model_dir}')
+    return
+
+  if args.verify_registry:
+    status = verify_registry(args.model_dir)
+    for name, state in status.items():
+      print(f'  {name:<20} {state}')
+    if any(state != 'ok' for state in status.values()):
+      raise SystemExit(1)
+    print(f'=> {len(status)} checkpoint(s) verified')
+    return
+
+  if args.convert_safetensors:
+    paths = convert_to_safetensors(args.model, model_dir=args.model_dir)
+    print(f'=> Converted {len(paths)} checkpoint(s) to {paths[0].parent}')
+    return
+
+  if args.reprocess:
+    if args.activations_dir is None:
+      raise ValueError('Specify the directory of the kept outputs with --activations-dir')
+    metrical_hints = None
+    if args.metrical_hints:
+      with open(args.metrical_hints, 'r') as f:
+        metrical_hints = json.load(f)
+    results = reprocess(
+      args.activations_dir,
+      out_dir=args.out_dir,
+      model=args.model,
+      paths=args.paths or None,
+      include_activations=args.activ,
+      tasks=[task for task in args.tasks if task != 'embeddings'] if args.tasks else None,
+      metrical_postprocessor=args.metrical_postprocessor,
+      metrical_hints=metrical_hints,
+      cfg_overrides=OmegaConf.to_container(OmegaConf.from_dotlist(args.override)) if args.override else None,
+      num_workers=args.postprocess_workers or None,
+      settings=dict(
+        fuse=args.fuse, quantize=args.quantize, ensemble_tolerance=args.ensemble_tolerance, tasks=args.tasks,
+      ),
+    )
+    print(f'=> Reprocessed {len(results)} track(s) into {args.out_dir}')
+    return
+
   # Determine input mode: single track or stems
   stems_mode = any([
     args.stems_bass,
@@ -165,6 +270,12 @@ def main():
     with open(args.stems_dict, 'r') as f:
       stems_dict = json.load(f)
 
+  # Handle tempo and meter hints
+  metrical_hints = None
+  if args.metrical_hints:
+    with open(args.metrical_hints, 'r') as f:
+      metrical_hints = json.load(f)
+
   analyze(
     paths=args.paths if not stems_mode else None,
     stems_input=stems_input,
@@ -182,6 +293,20 @@ def main():
     multiprocess=not args.no_multiprocess,
     stems_dict=stems_dict,
     skip_separation=args.skip_separation,
+    quantize=args.quantize,
+    ensemble_tolerance=args.ensemble_tolerance,
+    tasks=args.tasks,
+    metrical_postprocessor=args.metrical_postprocessor,
+    metrical_hints=metrical_hints,
+    activations_dir=args.activations_dir,
+    store_dir=args.store_dir,
+    load_existing=not args.no_load_existing,
+    load_workers=args.load_workers,
+    fuse=args.fuse,
+    model_dir=args.model_dir,
+    ensemble_executor=args.ensemble_executor,
+    ensemble_workers=args.ensemble_workers,
+    postprocess_workers=args.postprocess_workers,
   )
 
   print(f'=> Analysis results are successfully saved to {args.out_dir}')
@@ -35,6 +35,7 @@ class DataConfig:
   duration_max: float
 
   demucs_model: str = 'htdemucs'
+  path_teacher_dir: Optional[str] = None
 
 
 @dataclass
@@ -51,6 +52,7 @@ class HarmonixConfig(DataConfig):
   path_feature_dir: str = './data/harmonix/features/'
   path_no_demixed_feature_dir: str = './data/harmonix/features_no_demixed/'
   path_metadata: str = './data/harmonix/metadata.csv'
+  path_teacher_dir: str = './data/harmonix/teacher/'
 
   duration_min: int = 76
   duration_max: int = 660
@@ -158,6 +160,13 @@ class Config:
   loss_weight_section: float = 15.
   loss_weight_function: float = 0.1
 
+  # Distillation configurations -------------------------------------------
+  # If enabled, the model also learns from the soft predictions of a teacher model (cached by allin1fix-distill).
+  distill: bool = False
+  teacher_model: str = 'harmonix-all'
+  distill_temperature: float = 1.
+  loss_weight_distill: float = 1.
+
   # Misc ------------------------------------------------------------------
   seed: int = 1234
   fold: int = 2
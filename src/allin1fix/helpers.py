@@ -2,21 +2,37 @@
 # Copyright (c) 2025 Bo-Yu Chen (Cache management additions)
 # SPDX-License-Identifier: MIT
 
+import os
 import numpy as np
-import json
 import torch
 
 from dataclasses import asdict
 from pathlib import Path
 from glob import glob
-from typing import List, Union
-from .utils import mkpath, compact_json_number_array
-from .typings import AllInOneOutput, AnalysisResult, PathLike
-from .postprocessing import (
-  postprocess_metrical_structure,
-  postprocess_functional_structure,
-  estimate_tempo_from_beats,
+from typing import Dict, List, Union, Optional, Sequence
+from .utils import mkpath, dumps_json
+from .typings import AllInOneOutput, AnalysisResult, MetricalHint, PathLike
+from .postprocessing import estimate_tempo_from_beats
+from .postprocessing.metrical import (
+  decode_metrical_structure,
+  pick_metrical_structure,
+  combine_dbn_activations,
+  hint_to_dbn_kwargs,
 )
+from .postprocessing.functional import decode_functional_structure
+
+# Model heads required by each analysis task.
+TASK_HEADS = {
+  'beats': ['beat', 'downbeat'],
+  'structure': ['section', 'function'],
+  'embeddings': [],
+}
+
+
+# Probabilities saved with include_activations, out of those computed by compute_probabilities.
+ACTIVATION_KEYS = ['beat', 'downbeat', 'segment', 'label']
+# Outputs of the model returned by run_model with include_logits, named after the fields of AllInOneOutput.
+LOGIT_KEYS = ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function']
 
 
 def run_inference(
@@ -26,44 +42,169 @@ def run_inference(
   device: str,
   include_activations: bool,
   include_embeddings: bool,
+  tasks: Optional[Sequence[str]] = None,
 ) -> AnalysisResult:
+  activations = run_model(spec_path, model, device, include_embeddings, tasks)
+  return postprocess_activations(path, activations, model.cfg, include_activations, include_embeddings, tasks)
+
+
+def run_model(
+  spec_path: Path,
+  model: torch.nn.Module,
+  device: str,
+  include_embeddings: bool,
+  tasks: Optional[Sequence[str]] = None,
+  buffer: Optional['HostBuffer'] = None,
+  include_logits: bool = False,
+) -> Dict[str, np.ndarray]:
+  """
+  Runs the model on a spectrogram and returns every probability needed to postprocess it on the host,
+  ready to be postprocessed elsewhere. They are computed on the device and copied back in a single transfer,
+  through ``buffer`` if given. For an ensemble, the number of models it evaluated is returned as 'num_models'.
+  With ``include_logits``, the outputs of the heads are returned as well, under ``LOGIT_KEYS``.
+  """
+  tasks = ['beats', 'structure'] if tasks is None else tasks
+  heads = [head for task in tasks for head in TASK_HEADS[task]]
+
   spec = np.load(spec_path)
   spec = torch.from_numpy(spec).unsqueeze(0).to(device)
 
-  logits = model(spec)
+  logits = model(spec, heads=heads, output_embeddings=include_embeddings)
+  probabilities = compute_probabilities(logits)
+  if include_embeddings and logits.embeddings is not None:
+    probabilities['embeddings'] = logits.embeddings[0]
+  if include_logits:
+    for key in LOGIT_KEYS:
+      if getattr(logits, key) is not None:
+        probabilities[key] = getattr(logits, key)[0]
+  arrays = transfer_to_host(probabilities, buffer)
+  if logits.num_models is not None:
+    arrays['num_models'] = np.array(logits.num_models)
+  return arrays
+
+
+def compute_probabilities(logits: AllInOneOutput) -> Dict[str, torch.Tensor]:
+  """Derives the probabilities of a track from the outputs of the model for the heads that were run, on their device."""
+  probabilities = {}
+  if logits.logits_beat is not None:
+    probabilities['beat'] = torch.sigmoid(logits.logits_beat[0])
+  if logits.logits_downbeat is not None:
+    probabilities['downbeat'] = torch.sigmoid(logits.logits_downbeat[0])
+  if logits.logits_section is not None:
+    probabilities['segment'] = torch.sigmoid(logits.logits_section[0])
+  if logits.logits_function is not None:
+    probabilities['label'] = torch.softmax(logits.logits_function[0], dim=0)
+  if 'beat' in probabilities and 'downbeat' in probabilities:
+    probabilities['dbn'] = combine_dbn_activations(probabilities['beat'], probabilities['downbeat'])
+  return probabilities
+
+
+def transfer_to_host(
+  tensors: Dict[str, torch.Tensor],
+  buffer: Optional['HostBuffer'] = None,
+) -> Dict[str, np.ndarray]:
+  """
+  Copies tensors of the same device to the host in one transfer: they are packed into a single contiguous float32
+  tensor on their device, copied at once (through ``buffer`` if given), and unpacked into host arrays.
+  Tensors already on the CPU are not copied: the arrays are views of their float32 data.
+  """
+  if not tensors:
+    return {}
+  if all(tensor.device.type == 'cpu' for tensor in tensors.values()):
+    return {key: tensor.detach().float().numpy() for key, tensor in tensors.items()}
+
+  flat = torch.cat([tensor.detach().reshape(-1).float() for tensor in tensors.values()])
+  if buffer is not None:
+    flat = buffer.copy_from(flat)
+  else:
+    flat = flat.cpu().numpy()
+
+  arrays = {}
+  offset = 0
+  for key, tensor in tensors.items():
+    arrays[key] = flat[offset:offset + tensor.numel()].reshape(tensor.shape)
+    offset += tensor.numel()
+  return arrays
+
+
+class HostBuffer:
+  """
+  A host buffer reused by the device-to-host transfers of every track. It is pinned on CUDA, so that the copy is
+  a single DMA transfer that does not go through a pageable staging buffer, and pinned memory is costly to
+  allocate, hence the reuse. It only grows when a longer track comes.
+  """
+
+  def __init__(self, pin_memory: Optional[bool] = None):
+    self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+    self.tensor = None
+
+  def copy_from(self, tensor: torch.Tensor) -> np.ndarray:
+    """Copies a 1D float32 device tensor to the host and returns it as an array that the caller owns."""
+    if self.tensor is None or len(self.tensor) < len(tensor):
+      self.tensor = torch.empty(len(tensor), dtype=torch.float32, pin_memory=self.pin_memory)
+    host = self.tensor[:len(tensor)]
+    host.copy_(tensor, non_blocking=self.pin_memory)
+    if self.pin_memory and tensor.device.type == 'cuda':
+      torch.cuda.current_stream(tensor.device).synchronize()
+    # The buffer is overwritten by the next track, so the results get their own copy.
+    return host.numpy().copy()
+
 
-  metrical_structure = postprocess_metrical_structure(logits, model.cfg)
-  functional_structure = postprocess_functional_structure(logits, model.cfg)
-  bpm = estimate_tempo_from_beats(metrical_structure['beats'])
+def postprocess_activations(
+  path: Path,
+  activations: Dict[str, np.ndarray],
+  cfg,
+  include_activations: bool,
+  include_embeddings: bool,
+  tasks: Optional[Sequence[str]] = None,
+  out_dir: Optional[PathLike] = None,
+  metrical_postprocessor: str = 'dbn',
+  metrical_hint: Optional[MetricalHint] = None,
+) -> AnalysisResult:
+  """
+  Decodes the probabilities of a track returned by ``run_model`` into an analysis result, and saves it
+  to ``out_dir`` if given. Only needs host arrays and the model config, so it can run in a worker process
+  while the model moves on.
+  """
+  tasks = ['beats', 'structure'] if tasks is None else tasks
 
   result = AnalysisResult(
     path=path,
-    bpm=bpm,
-    segments=functional_structure,
-    **metrical_structure,
+    bpm=None,
+    beats=[],
+    downbeats=[],
+    beat_positions=[],
+    segments=[],
+    num_models=int(activations['num_models']) if 'num_models' in activations else None,
   )
 
+  if 'beats' in tasks:
+    if metrical_postprocessor == 'peaks':
+      beats_per_bar = hint_to_dbn_kwargs(metrical_hint, cfg.fps)['beats_per_bar']
+      metrical_structure = pick_metrical_structure(activations['beat'], activations['downbeat'], cfg, beats_per_bar)
+    else:
+      metrical_structure = decode_metrical_structure(activations['dbn'], cfg, metrical_hint)
+    result.beats = metrical_structure['beats']
+    result.downbeats = metrical_structure['downbeats']
+    result.beat_positions = metrical_structure['beat_positions']
+    result.bpm = estimate_tempo_from_beats(metrical_structure['beats'])
+
+  if 'structure' in tasks:
+    result.segments = decode_functional_structure(activations['segment'], activations['label'], cfg)
+
   if include_activations:
-    activations = compute_activations(logits)
-    result.activations = activations
+    result.activations = {key: activations[key] for key in ACTIVATION_KEYS if key in activations}
 
   if include_embeddings:
-    result.embeddings = logits.embeddings[0].cpu().numpy()
-
-  return result
+    result.embeddings = activations['embeddings']
 
+  # Save the result right after the inference.
+  # Checkpointing is always important for this kind of long-running tasks...
+  # for my mental health...
+  if out_dir is not None:
+    save_results(result, out_dir)
 
-def compute_activations(logits: AllInOneOutput):
-  activations_beat = torch.sigmoid(logits.logits_beat[0]).cpu().numpy()
-  activations_downbeat = torch.sigmoid(logits.logits_downbeat[0]).cpu().numpy()
-  activations_segment = torch.sigmoid(logits.logits_section[0]).cpu().numpy()
-  activations_label = torch.softmax(logits.logits_function[0], dim=0).cpu().numpy()
-  return {
-    'beat': activations_beat,
-    'downbeat': activations_downbeat,
-    'segment': activations_segment,
-    'label': activations_label,
-  }
+  return result
 
 
 def expand_paths(paths: List[Path]):
@@ -116,11 +257,14 @@ def save_results(
 
     embeddings = result.pop('embeddings')
     if embeddings is not None:
-      np.save(str(out_path.with_suffix('.embed.npy')), embeddings)
-
-    json_str = json.dumps(result, indent=2)
-    json_str = compact_json_number_array(json_str)
-    out_path.with_suffix('.json').write_text(json_str)
+      # Replace the file rather than overwriting it, as the embeddings may be memory-mapped from it.
+      embed_path = out_path.with_suffix('.embed.npy')
+      tmp_path = embed_path.with_name(f'.{embed_path.name}.{os.getpid()}.tmp')
+      with open(tmp_path, 'wb') as f:
+        np.save(f, embeddings)
+      os.replace(tmp_path, embed_path)
+
+    out_path.with_suffix('.json').write_text(dumps_json(result))
 
 
 def get_model_cache_dir() -> Path:
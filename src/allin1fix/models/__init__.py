@@ -1,2 +1,4 @@
 from .allinone import AllInOne
-from .loaders import load_pretrained_model
+from .loaders import load_pretrained_model, convert_to_safetensors, share_model_memory
+from .quantization import quantize_model, compute_quantization_report
+from .registry import populate_registry, verify_registry
@@ -1,12 +1,15 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
-from typing import Optional
-from .dinat import DinatLayer1d, DinatLayer2d
+from typing import Optional, Sequence
+from .dinat import DinatLayer1d, DinatLayer2d, DinatDropPath, _NeighborhoodAttentionNd
 from .utils import get_activation_function
 from ..config import Config
 from ..typings import AllInOneOutput
 
+HEADS = ('beat', 'downbeat', 'section', 'function')
+
 
 class AllInOne(nn.Module):
   def __init__(self, cfg: Config):
@@ -32,11 +35,19 @@ class AllInOne(nn.Module):
 
     self.dropout = nn.Dropout(cfg.drop_last)
 
+    # All heads merged into a single linear layer, only set by to_inference().
+    self.classifier = None
+
   def forward(
     self,
     inputs: torch.FloatTensor,
     output_attentions: Optional[bool] = None,
+    heads: Optional[Sequence[str]] = None,
+    output_embeddings: bool = True,
+    output_hidden_states: bool = False,
   ):
+    # heads: names of the heads to compute (see HEADS). The logits of the other heads are None.
+    # output_hidden_states: whether to return the outputs of every encoder level, which is memory-hungry.
     # N: batch size
     # K: instrument
     # C: channel
@@ -51,33 +62,87 @@ class AllInOne(nn.Module):
     encoder_outputs = self.encoder(
       frame_embed,
       output_attentions=output_attentions,
+      output_hidden_states=output_hidden_states,
     )
     hidden_state_levels = encoder_outputs[0]
+    del encoder_outputs
 
     hidden_states = hidden_state_levels[-1].reshape(N, K, T, -1)  # N, K, T, C=16
     hidden_states = self.norm(hidden_states)
     hidden_states = self.dropout(hidden_states)
 
-    logits_beat = self.beat_classifier(hidden_states)
-    logits_downbeat = self.downbeat_classifier(hidden_states)
-    logits_section = self.section_classifier(hidden_states)
-    logits_function = self.function_classifier(hidden_states)
+    heads = HEADS if heads is None else heads
+    if self.classifier is not None:
+      # One matmul for the requested heads only, then split the classes: beat, downbeat, section, functions...
+      head_classes = dict(zip(HEADS, [[0], [1], [2], list(range(3, self.classifier.num_classes))]))
+      requested = [head for head in HEADS if head in heads]
+      classes = [c for head in requested for c in head_classes[head]]
+      logits = self.classifier(hidden_states, classes if len(requested) < len(HEADS) else None)
+      if logits.dim() == 2:
+        logits = logits.unsqueeze(1)
+      split_logits, offset = {}, 0
+      for head in requested:
+        num_classes = len(head_classes[head])
+        split_logits[head] = logits[:, offset] if head != 'function' else logits[:, offset:offset + num_classes]
+        offset += num_classes
+      logits_beat = split_logits.get('beat')
+      logits_downbeat = split_logits.get('downbeat')
+      logits_section = split_logits.get('section')
+      logits_function = split_logits.get('function')
+    else:
+      logits_beat = self.beat_classifier(hidden_states) if 'beat' in heads else None
+      logits_downbeat = self.downbeat_classifier(hidden_states) if 'downbeat' in heads else None
+      logits_section = self.section_classifier(hidden_states) if 'section' in heads else None
+      logits_function = self.function_classifier(hidden_states) if 'function' in heads else None
 
     return AllInOneOutput(
       logits_beat=logits_beat,
       logits_downbeat=logits_downbeat,
       logits_section=logits_section,
       logits_function=logits_function,
-      embeddings=hidden_states,
+      embeddings=hidden_states if output_embeddings else None,
+      hidden_states=hidden_state_levels if output_hidden_states else None,
     )
 
+  @torch.no_grad()
+  def to_inference(self):
+    """
+    Transforms the model for faster inference. Must be called after loading the weights.
+    Fuses the query/key/value projections of every attention layer and the four heads into single linear layers,
+    and removes dropout and drop path modules, which are no-ops in evaluation mode.
+    The outputs are identical up to floating point error, but the model can no longer be trained.
+    """
+    for module in self.modules():
+      if isinstance(module, _NeighborhoodAttentionNd):
+        module.fuse_qkv()
+
+    if self.classifier is None:
+      heads = [self.beat_classifier, self.downbeat_classifier, self.section_classifier, self.function_classifier]
+      self.classifier = Head(num_classes=sum(head.num_classes for head in heads), cfg=self.cfg)
+      self.classifier.to(self.beat_classifier.classifier.weight.device)
+      self.classifier.classifier.weight.copy_(torch.cat([head.classifier.weight for head in heads]))
+      self.classifier.classifier.bias.copy_(torch.cat([head.classifier.bias for head in heads]))
+      del self.beat_classifier, self.downbeat_classifier, self.section_classifier, self.function_classifier
+
+    strip_training_modules(self)
+    return self.eval()
+
+
+def strip_training_modules(module: nn.Module):
+  """Replaces dropout and drop path modules, which do nothing at inference, with identities in place."""
+  for name, child in module.named_children():
+    if isinstance(child, (nn.Dropout, DinatDropPath)):
+      setattr(module, name, nn.Identity())
+    else:
+      strip_training_modules(child)
+
 
 class AllInOneEncoder(nn.Module):
   def __init__(self, cfg: Config, depth: int):
     super().__init__()
     self.cfg = cfg
 
-    drop_path_rates = [x.item() for x in torch.linspace(0, cfg.drop_path, depth)]
+    drop_path_rates = [x.item() for x in torch.linspace(0, cfg.drop_path, depth, device='cpu')]
     dilations = [
       min(cfg.dilation_factor ** i, cfg.dilation_max)
       for i in range(depth)
@@ -97,6 +162,7 @@ class AllInOneEncoder(nn.Module):
     self,
     frame_embed: torch.FloatTensor,
     output_attentions: Optional[bool] = None,
+    output_hidden_states: bool = False,
   ):
     # N: batch size
     # K: instrument
@@ -104,11 +170,17 @@ class AllInOneEncoder(nn.Module):
     # C: channel
     # x has shape of: NK, T, C=16
 
+    # Unless all levels are requested, only the current hidden state is kept alive,
+    # so the output of each level can be freed as soon as the next one is computed.
     hidden_state_levels = []
     hidden_states = frame_embed
     for i, layer in enumerate(self.layers):
       layer_outputs = layer(hidden_states, output_attentions)
       hidden_states = layer_outputs[0]
+      if output_hidden_states:
+        hidden_state_levels.append(hidden_states)
+
+    if not output_hidden_states:
       hidden_state_levels.append(hidden_states)
 
     outputs = (hidden_state_levels,)
@@ -210,12 +282,31 @@ class AllInOneEmbeddings(nn.Module):
     self.norm = nn.LayerNorm(cfg.dim_embed)
     self.dropout = nn.Dropout(cfg.drop_conv)
 
+    # Number of frames processed at once at inference, which bounds the memory of the convolutional feature maps.
+    self.chunk_size = 2048
+
   def forward(self, x: torch.FloatTensor):
     # NK: batch x inst
     # C: channel
     # T: time
     # F: frequency
     # x has shape of: NK, C=1, T, F
+    T = x.shape[2]
+    if self.training or T <= self.chunk_size:
+      return self.forward_chunk(x)
+
+    # The convolutions see 2 frames on each side, so chunks with that much context give exactly the same output
+    # while the large intermediate feature maps only exist for one chunk at a time.
+    context = 2
+    chunks = []
+    for start in range(0, T, self.chunk_size):
+      end = min(start + self.chunk_size, T)
+      chunk_start, chunk_end = max(0, start - context), min(T, end + context)
+      chunk = self.forward_chunk(x[:, :, chunk_start:chunk_end])
+      chunks.append(chunk[:, start - chunk_start:end - chunk_start])
+    return torch.cat(chunks, dim=1)
+
+  def forward_chunk(self, x: torch.FloatTensor):
     # x = x.unsqueeze(1)  # NK, C=1, T, F=81
     x = self.conv0(x)  # NK, C=16, T, F=79
     x = self.pool0(x)  # NK, C=16, T, F=26
@@ -242,6 +333,7 @@ class AllInOneEmbeddings(nn.Module):
 class Head(nn.Module):
   def __init__(self, num_classes: int, cfg: Config, init_confidence: float = None):
     super().__init__()
+    self.num_classes = num_classes
     self.classifier = nn.Linear(cfg.data.num_instruments * cfg.dim_embed, num_classes)
 
     if init_confidence is not None:
@@ -254,12 +346,19 @@ class Head(nn.Module):
     """
     self.classifier.bias.data.fill_(-torch.log(torch.tensor(1 / confidence - 1)))
 
-  def forward(self, x: torch.FloatTensor):
+  def forward(self, x: torch.FloatTensor, classes: Optional[Sequence[int]] = None):
     # x shape: N, K, T, C=24
+    # classes: indices of the classes to compute, e.g. some of the heads fused by AllInOne.to_inference().
     batch, inst, frame, embed = x.shape
     x = x.permute(0, 2, 1, 3)  # batch, frame, inst, embed
     x = x.reshape(batch, frame, inst * embed)  # batch, frame, inst x embed
-    logits = self.classifier(x)  # batch, frame, class
+    if classes is None:
+      logits = self.classifier(x)  # batch, frame, class
+    elif isinstance(self.classifier, nn.Linear):
+      logits = F.linear(x, self.classifier.weight[classes], self.classifier.bias[classes])
+    else:
+      # Quantized layers have packed weights that cannot be sliced.
+      logits = self.classifier(x)[..., classes]
     logits = logits.permute(0, 2, 1)  # batch, class, frame
     if logits.shape[1] == 1:
       logits = logits.squeeze(1)
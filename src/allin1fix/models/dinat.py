@@ -93,6 +93,8 @@ class _NeighborhoodAttentionNd(ABC, nn.Module):
     self.query = nn.Linear(self.all_head_size, self.all_head_size, bias=cfg.qkv_bias)
     self.key = nn.Linear(self.all_head_size, self.all_head_size, bias=cfg.qkv_bias)
     self.value = nn.Linear(self.all_head_size, self.all_head_size, bias=cfg.qkv_bias)
+    # Fused query/key/value projection, only set by fuse_qkv() for inference.
+    self.qkv = None
     
     self.dropout = nn.Dropout(cfg.drop_attention)
   
@@ -101,14 +103,18 @@ class _NeighborhoodAttentionNd(ABC, nn.Module):
     hidden_states: torch.Tensor,
     output_attentions: Optional[bool] = False,
   ) -> Tuple[torch.Tensor]:
-    query_layer = self.transpose_for_scores(self.query(hidden_states))
-    key_layer = self.transpose_for_scores(self.key(hidden_states))
-    value_layer = self.transpose_for_scores(self.value(hidden_states))
-    
-    # Apply the scale factor before computing attention weights. It's usually more efficient because
-    # attention weights are typically a bigger tensor compared to query.
-    # It gives identical results because scalars are commutable in matrix multiplication.
-    query_layer = query_layer / math.sqrt(self.attention_head_size)
+    if self.qkv is not None:
+      # The scale factor is already folded into the query projection.
+      query_layer, key_layer, value_layer = self.transpose_for_scores(self.qkv(hidden_states)).unbind(0)
+    else:
+      query_layer = self.transpose_for_scores(self.query(hidden_states))
+      key_layer = self.transpose_for_scores(self.key(hidden_states))
+      value_layer = self.transpose_for_scores(self.value(hidden_states))
+      
+      # Apply the scale factor before computing attention weights. It's usually more efficient because
+      # attention weights are typically a bigger tensor compared to query.
+      # It gives identical results because scalars are commutable in matrix multiplication.
+      query_layer = query_layer / math.sqrt(self.attention_head_size)
     
     # Compute NA between "query" and "key" to get the raw attention scores, and add relative positional biases.
     # attention_scores = natten2dqkrpb(query_layer, key_layer, self.rpb, self.dilation)
@@ -136,12 +142,41 @@ class _NeighborhoodAttentionNd(ABC, nn.Module):
     return outputs
   
   def transpose_for_scores(self, x):
+    if self.qkv is not None:
+      # x: (..., 3 x C) -> (3, batch, heads, [height,] width, head_size)
+      new_x_shape = x.size()[:-1] + (3, self.num_attention_heads, self.attention_head_size)
+      x = x.view(new_x_shape)
+      if len(x.shape) > 5:  # 2D
+        return x.permute(3, 0, 4, 1, 2, 5)
+      else:  # 1D
+        return x.permute(2, 0, 3, 1, 4)
+    
     new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
     x = x.view(new_x_shape)
     if len(x.shape) > 4:  # 2D
       return x.permute(0, 3, 1, 2, 4)
     else:  # 1D
       return x.permute(0, 2, 1, 3)
+  
+  @torch.no_grad()
+  def fuse_qkv(self):
+    """
+    Fuses the query, key and value projections into a single linear layer for inference.
+    The attention scale factor is folded into the query weights.
+    """
+    if self.qkv is not None:
+      return
+    
+    scale = 1 / math.sqrt(self.attention_head_size)
+    has_bias = self.query.bias is not None
+    qkv = nn.Linear(self.all_head_size, 3 * self.all_head_size, bias=has_bias)
+    qkv = qkv.to(device=self.query.weight.device, dtype=self.query.weight.dtype)
+    qkv.weight.copy_(torch.cat([self.query.weight * scale, self.key.weight, self.value.weight]))
+    if has_bias:
+      qkv.bias.copy_(torch.cat([self.query.bias * scale, self.key.bias, self.value.bias]))
+    
+    self.qkv = qkv
+    del self.query, self.key, self.value
 
 
 class NeighborhoodAttention1d(_NeighborhoodAttentionNd):
@@ -162,6 +197,62 @@ class NeighborhoodAttention1d(_NeighborhoodAttentionNd):
     self.nattendav = na1d_av
     # self.nattendqkrpb = natten1dqkrpb
     # self.nattendav = natten1dav
+  
+  def forward_short(self, hidden_states: torch.Tensor, padded_length: int) -> Tuple[torch.Tensor]:
+    """
+    Computes the outputs of ``forward`` for the real frames of ``hidden_states`` as if they were zero-padded
+    to ``padded_length`` frames, without materializing the padding.
+    The padded frames all project to the same key and value (the projection biases),
+    so each query gathers its neighbors from the real frames plus one zero frame.
+    """
+    N, T, C = hidden_states.shape
+    # The extra zero frame stands for every padded frame.
+    hidden_states = nn.functional.pad(hidden_states, (0, 0, 0, 1))
+    if self.qkv is not None:
+      query_layer, key_layer, value_layer = self.transpose_for_scores(self.qkv(hidden_states)).unbind(0)
+    else:
+      query_layer = self.transpose_for_scores(self.query(hidden_states))
+      key_layer = self.transpose_for_scores(self.key(hidden_states))
+      value_layer = self.transpose_for_scores(self.value(hidden_states))
+      query_layer = query_layer / math.sqrt(self.attention_head_size)
+    query_layer = query_layer[:, :, :T]
+    
+    key_index, rpb_index = short_neighborhood(T, padded_length, self.kernel_size, self.dilation, self.rpb.device)
+    # batch, heads, frames, kernel_size
+    attention_scores = (query_layer.unsqueeze(-2) * key_layer[:, :, key_index]).sum(-1)
+    attention_scores = attention_scores + self.rpb[:, rpb_index]
+    attention_probs = nn.functional.softmax(attention_scores, dim=-1)
+    attention_probs = self.dropout(attention_probs)
+    
+    context_layer = (attention_probs.unsqueeze(-1) * value_layer[:, :, key_index]).sum(-2)
+    context_layer = context_layer.permute(0, 2, 1, 3).reshape(N, T, self.all_head_size)
+    return (context_layer,)
+
+
+def short_neighborhood(
+  frames: int,
+  padded_length: int,
+  kernel_size: int,
+  dilation: int,
+  device=None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+  """
+  Returns the key indices and relative positional bias indices, both of shape (frames, kernel_size),
+  of the first ``frames`` queries of a 1D dilated neighborhood attention over ``padded_length`` frames,
+  following the window placement of NATTEN. Keys beyond the real frames are mapped to index ``frames``.
+  """
+  i = torch.arange(frames, device=device)
+  # Dilated attention is a plain neighborhood attention within each group of frames i % dilation.
+  group = i % dilation
+  group_index = i // dilation
+  group_length = (padded_length - group + dilation - 1) // dilation
+  start = (group_index - kernel_size // 2).clamp(min=0)
+  start = torch.minimum(start, group_length - kernel_size)
+  neighbors = start.unsqueeze(1) + torch.arange(kernel_size, device=device)
+  
+  key_index = (neighbors * dilation + group.unsqueeze(1)).clamp(max=frames)
+  rpb_index = neighbors - group_index.unsqueeze(1) + kernel_size - 1
+  return key_index, rpb_index
 
 
 class NeighborhoodAttention2d(_NeighborhoodAttentionNd):
@@ -210,8 +301,12 @@ class _NeighborhoodAttentionModuleNd(ABC, nn.Module):
     self,
     hidden_states: torch.Tensor,
     output_attentions: Optional[bool] = False,
+    padded_length: Optional[int] = None,
   ) -> Tuple[torch.Tensor]:
-    self_outputs = self.self(hidden_states, output_attentions)
+    if padded_length is not None:
+      self_outputs = self.self.forward_short(hidden_states, padded_length)
+    else:
+      self_outputs = self.self(hidden_states, output_attentions)
     attention_output = self.output(self_outputs[0])
     outputs = (attention_output,) + self_outputs[1:]  # add attentions if we output them
     return outputs
@@ -304,9 +399,14 @@ class _DinatLayerNd(ABC, nn.Module):
     
     hidden_states = self.layernorm_before(hidden_states)
     # pad hidden_states if they are smaller than kernel size x dilation
+    padded_length = None
     if is_2d:
       hidden_states, pad_values = self.maybe_pad(hidden_states, K, T)
       _, height_pad, width_pad, _ = hidden_states.shape
+    elif self.short_path and T < self.window_size and not self.training and not output_attentions:
+      # Short inputs attend to the padding without materializing it.
+      pad_values = (0, 0, 0, 0)
+      padded_length = self.window_size
     else:
       hidden_states, pad_values = self.maybe_pad(hidden_states, T)
     
@@ -316,28 +416,38 @@ class _DinatLayerNd(ABC, nn.Module):
       if attention is None:
         continue
       
-      attention_output = attention(attention_inputs, output_attentions=output_attentions)
+      attention_output = attention(
+        attention_inputs,
+        output_attentions=output_attentions,
+        padded_length=padded_length,
+      )
       attention_output = attention_output[0]
       
+      # No need to make the cropped outputs contiguous; the residual sum below creates a new tensor anyway.
       if is_2d:
         was_padded = pad_values[3] > 0 or pad_values[5] > 0
         if was_padded:
-          attention_output = attention_output[:, :K, :T, :].contiguous()
+          attention_output = attention_output[:, :K, :T, :]
       else:
         was_padded = pad_values[3] > 0
         if was_padded:
-          attention_output = attention_output[:, :T, :].contiguous()
+          attention_output = attention_output[:, :T, :]
       
       hidden_states = shortcut + self.drop_path(attention_output)
       hidden_states_list.append(hidden_states)
     
+    # Free the padded inputs and the per-attention outputs as early as possible.
+    del attention_inputs, attention_output
     if self.double_attention:
       hidden_states = torch.cat(hidden_states_list, dim=-1)
-      shortcut = torch.stack(hidden_states_list).sum(dim=0) / 2.
+      shortcut = (hidden_states_list[0] + hidden_states_list[1]) / 2.
     else:
       shortcut = hidden_states
+    del hidden_states_list
     layer_output = self.layernorm_after(hidden_states)
-    layer_output = self.output(self.intermediate(layer_output))
+    del hidden_states
+    layer_output = self.intermediate(layer_output)
+    layer_output = self.output(layer_output)
     
     layer_output = shortcut + self.drop_path(layer_output)
     
@@ -358,6 +468,8 @@ class DinatLayer1d(_DinatLayerNd):
     double_attention: bool,
   ):
     super().__init__(cfg, dim, kernel_size, dilation, drop_path_rate, double_attention)
+    # Whether inputs shorter than the window are computed without padding them (in evaluation mode).
+    self.short_path = True
     self.attention = NeighborhoodAttentionModule1d(cfg, dim, num_heads, kernel_size, dilation)
     if double_attention:
       self.attention2 = NeighborhoodAttentionModule1d(cfg, dim, num_heads, kernel_size, dilation * 2)
@@ -386,6 +498,7 @@ class DinatLayer2d(_DinatLayerNd):
     drop_path_rate: float
   ):
     super().__init__(cfg, dim, kernel_size, dilation, drop_path_rate, double_attention=False)
+    self.short_path = False
     self.attention = NeighborhoodAttentionModule2d(cfg, dim, num_heads, kernel_size, dilation)
     self.attention2 = None
   
@@ -1,14 +1,37 @@
 import torch
 import torch.nn as nn
 
-from typing import List
+from typing import List, Optional, Sequence
 from .allinone import AllInOne
+from .executor import make_ensemble_executor
 from ..typings import AllInOneOutput
 
+LOGIT_KEYS = ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function']
+
 
 class Ensemble(nn.Module):
-  def __init__(self, models: List[AllInOne]):
+  def __init__(
+    self,
+    models: List[AllInOne],
+    tolerance: Optional[float] = None,
+    min_models: int = 2,
+    executor: Optional[str] = None,
+    num_workers: Optional[int] = None,
+  ):
+    """
+    Averages the logits of the given models.
+
+    If ``tolerance`` is given, the ensemble becomes adaptive: the models are evaluated one by one in a fixed order,
+    and the evaluation stops as soon as adding a model changes the running mean of the beat, downbeat and section
+    probabilities by less than ``tolerance`` (after at least ``min_models`` models).
+
+    If ``executor`` is 'threads' or 'processes', the models are evaluated concurrently by ``num_workers`` threads
+    or long-lived CPU worker processes (see ``executor.py``). This cannot be combined with the adaptive mode.
+    The models must not be modified afterwards, since the worker processes hold their own copies.
+    """
     super().__init__()
+    if executor is not None and tolerance is not None:
+      raise ValueError('The adaptive ensemble evaluates the models sequentially and cannot use an executor.')
 
     cfg = models[0].cfg.copy()
     cfg.best_threshold_beat = sum([model.cfg.best_threshold_beat for model in models]) / len(models)
@@ -16,15 +39,83 @@ class Ensemble(nn.Module):
 
     self.cfg = cfg
     self.models = models
+    self.tolerance = tolerance
+    self.min_models = min_models
+    self.executor = make_ensemble_executor(executor, models, num_workers) if executor is not None else None
 
-  def forward(self, x):
-    outputs: List[AllInOneOutput] = [model(x) for model in self.models]
-    avg = AllInOneOutput(
-      logits_beat=torch.stack([output.logits_beat for output in outputs], dim=0).mean(dim=0),
-      logits_downbeat=torch.stack([output.logits_downbeat for output in outputs], dim=0).mean(dim=0),
-      logits_section=torch.stack([output.logits_section for output in outputs], dim=0).mean(dim=0),
-      logits_function=torch.stack([output.logits_function for output in outputs], dim=0).mean(dim=0),
-      embeddings=torch.stack([output.embeddings for output in outputs], dim=-1),
-    )
+  def forward(
+    self,
+    x,
+    heads: Optional[Sequence[str]] = None,
+    output_embeddings: bool = True,
+  ):
+    if self.executor is not None:
+      outputs = self.executor(x, heads=heads, output_embeddings=output_embeddings)
+    elif self.tolerance is None:
+      outputs: List[AllInOneOutput] = [
+        model(x, heads=heads, output_embeddings=output_embeddings)
+        for model in self.models
+      ]
+    else:
+      outputs = self.forward_adaptive(x, heads, output_embeddings)
+
+    # The number of evaluated models is reported with the output.
+    avg = AllInOneOutput(num_models=len(outputs))
+    for key in LOGIT_KEYS:
+      logits = [getattr(output, key) for output in outputs]
+      if logits[0] is not None:
+        setattr(avg, key, torch.stack(logits, dim=0).mean(dim=0))
+    if output_embeddings:
+      avg.embeddings = torch.stack([output.embeddings for output in outputs], dim=-1)
 
     return avg
+
+  def share_memory(self):
+    """Moves the weights of every model to shared memory (the models are a list, not submodules)."""
+    from .loaders import share_model_memory
+    return share_model_memory(self)
+
+  def close(self):
+    """Stops the workers of the executor, if any."""
+    if self.executor is not None:
+      self.executor.close()
+      self.executor = None
+
+  def to_inference(self):
+    """Transforms every model for faster inference. See ``AllInOne.to_inference``."""
+    for model in self.models:
+      model.to_inference()
+    return self.eval()
+
+  def forward_adaptive(
+    self,
+    x,
+    heads: Optional[Sequence[str]] = None,
+    output_embeddings: bool = True,
+  ) -> List[AllInOneOutput]:
+    outputs: List[AllInOneOutput] = []
+    sum_logits = None
+    prev_probs = None
+    for model in self.models:
+      output = model(x, heads=heads, output_embeddings=output_embeddings)
+      outputs.append(output)
+
+      logits = [
+        logits for logits in [output.logits_beat, output.logits_downbeat, output.logits_section]
+        if logits is not None
+      ]
+      if not logits:
+        # Nothing to track the agreement of, e.g. when only embeddings are requested.
+        continue
+
+      logits = torch.stack(logits)
+      sum_logits = logits if sum_logits is None else sum_logits + logits
+      probs = torch.sigmoid(sum_logits / len(outputs))
+
+      if prev_probs is not None and len(outputs) >= self.min_models:
+        max_change = (probs - prev_probs).abs().max().item()
+        if max_change < self.tolerance:
+          break
+      prev_probs = probs
+
+    return outputs
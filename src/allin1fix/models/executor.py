@@ -0,0 +1,182 @@
+import os
+import weakref
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Sequence
+from .allinone import AllInOne
+from ..typings import AllInOneOutput
+
+OUTPUT_KEYS = ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function', 'embeddings']
+
+
+class EnsembleExecutor(ABC):
+  """Evaluates every model of an ensemble on the same input and returns their outputs in the order of the models."""
+
+  @abstractmethod
+  def __call__(
+    self,
+    x: torch.FloatTensor,
+    heads: Optional[Sequence[str]] = None,
+    output_embeddings: bool = True,
+  ) -> List[AllInOneOutput]:
+    raise NotImplementedError
+
+  def close(self):
+    pass
+
+
+class ThreadEnsembleExecutor(EnsembleExecutor):
+  """
+  Runs the models concurrently in a pool of threads. PyTorch releases the GIL inside its kernels, so the models
+  overlap as long as they spend most of their time there. The models stay in the current process and device.
+  """
+
+  def __init__(self, models: List[AllInOne], num_workers: Optional[int] = None):
+    self.models = models
+    self.pool = ThreadPoolExecutor(max_workers=num_workers or len(models))
+
+  def __call__(self, x, heads=None, output_embeddings=True):
+    # Threads do not inherit the grad mode of the caller.
+    grad_enabled = torch.is_grad_enabled()
+
+    def run(model):
+      with torch.set_grad_enabled(grad_enabled):
+        return model(x, heads=heads, output_embeddings=output_embeddings)
+
+    return list(self.pool.map(run, self.models))
+
+  def close(self):
+    self.pool.shutdown()
+
+
+class ProcessEnsembleExecutor(EnsembleExecutor):
+  """
+  Runs the models in long-lived worker processes on CPU. Each worker holds its share of the models and
+  ``torch.get_num_threads() // num_workers`` intra-op threads. The input is passed through shared memory
+  and only the outputs are sent back.
+  """
+
+  def __init__(self, models: List[AllInOne], num_workers: Optional[int] = None):
+    if any(param.device.type != 'cpu' for model in models for param in model.parameters()):
+      raise ValueError('The process ensemble executor only supports models on CPU.')
+
+    num_workers = num_workers or min(len(models), os.cpu_count() or 1)
+    num_threads = max(1, torch.get_num_threads() // num_workers)
+    ctx = mp.get_context('spawn')
+
+    self.num_models = len(models)
+    self.shm = None
+    self.connections = []
+    self.processes = []
+    for rank in range(num_workers):
+      indices = list(range(rank, len(models), num_workers))
+      parent_conn, child_conn = ctx.Pipe()
+      process = ctx.Process(
+        target=_worker_main,
+        args=(child_conn, {i: models[i] for i in indices}, num_threads),
+        daemon=True,
+      )
+      process.start()
+      child_conn.close()
+      self.connections.append(parent_conn)
+      self.processes.append(process)
+
+    # Stop the workers even if close() is never called.
+    self._finalizer = weakref.finalize(self, _shutdown, self.connections, self.processes)
+
+  def __call__(self, x, heads=None, output_embeddings=True):
+    x = x.detach().cpu().contiguous().numpy()
+    if self.shm is None or self.shm.size < x.nbytes:
+      self._release_shm()
+      self.shm = SharedMemory(create=True, size=x.nbytes)
+    np.ndarray(x.shape, dtype=x.dtype, buffer=self.shm.buf)[...] = x
+
+    request = (self.shm.name, x.shape, x.dtype.str, heads, output_embeddings)
+    for conn in self.connections:
+      conn.send(request)
+
+    # Every worker replies to every request: read all the replies before raising an error, so that none is left
+    # in a pipe to be taken for the reply to the next request.
+    responses = [conn.recv() for conn in self.connections]
+    for response in responses:
+      if isinstance(response, Exception):
+        raise response
+
+    outputs = [None] * self.num_models
+    for response in responses:
+      for i, output in response.items():
+        outputs[i] = AllInOneOutput(**{
+          key: torch.from_numpy(value) if value is not None else None
+          for key, value in output.items()
+        })
+    return outputs
+
+  def close(self):
+    self._release_shm()
+    self._finalizer()
+
+  def _release_shm(self):
+    if self.shm is not None:
+      self.shm.close()
+      self.shm.unlink()
+      self.shm = None
+
+
+def make_ensemble_executor(
+  kind: str,
+  models: List[AllInOne],
+  num_workers: Optional[int] = None,
+) -> EnsembleExecutor:
+  if kind == 'threads':
+    return ThreadEnsembleExecutor(models, num_workers)
+  elif kind == 'processes':
+    return ProcessEnsembleExecutor(models, num_workers)
+  raise ValueError(f'Unknown ensemble executor: {kind} (expected one of threads, processes)')
+
+
+def _worker_main(conn, models, num_threads: int):
+  torch.set_num_threads(num_threads)
+  for model in models.values():
+    model.eval()
+
+  while True:
+    request = conn.recv()
+    if request is None:
+      break
+
+    shm_name, shape, dtype, heads, output_embeddings = request
+    try:
+      shm = SharedMemory(name=shm_name)
+      try:
+        x = torch.from_numpy(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+        with torch.no_grad():
+          response = {}
+          for i, model in models.items():
+            output = model(x, heads=heads, output_embeddings=output_embeddings)
+            response[i] = {
+              key: getattr(output, key).numpy() if getattr(output, key) is not None else None
+              for key in OUTPUT_KEYS
+            }
+        del x
+      finally:
+        shm.close()
+    except Exception as e:
+      response = e
+    conn.send(response)
+
+
+def _shutdown(connections, processes):
+  for conn in connections:
+    try:
+      conn.send(None)
+    except (BrokenPipeError, OSError):
+      pass
+  for process in processes:
+    process.join(timeout=10)
+    if process.is_alive():
+      process.terminate()
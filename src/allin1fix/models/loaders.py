@@ -1,10 +1,15 @@
+import json
 import torch
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
 from omegaconf import OmegaConf
 from huggingface_hub import hf_hub_download
 from .allinone import AllInOne
 from .ensemble import Ensemble
+from .quantization import quantize_model
+from .registry import resolve_checkpoint
 from ..typings import PathLike
 
 NAME_TO_FILE = {
@@ -18,6 +23,9 @@ NAME_TO_FILE = {
   'harmonix-fold7': 'harmonix-fold7-qwwskhg6.pth',
 }
 
+HF_REPO_ID = 'taejunkim/allinone'
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'allin1fix'
+
 ENSEMBLE_MODELS = {
   'harmonix-all': [
     'harmonix-fold0',
@@ -36,9 +44,26 @@ def load_pretrained_model(
   model_name: Optional[str] = None,
   cache_dir: Optional[PathLike] = None,
   device=None,
+  quantize: bool = False,
+  ensemble_tolerance: Optional[float] = None,
+  fuse: bool = False,
+  model_dir: Optional[PathLike] = None,
+  ensemble_executor: Optional[str] = None,
+  ensemble_workers: Optional[int] = None,
+  share_memory: bool = False,
 ):
+  """
+  Loads a pre-trained model, or an ensemble of them.
+
+  With ``share_memory=True``, the weights of a CPU model are moved to shared memory. Worker processes that receive
+  the model, e.g. through the arguments of a ``torch.multiprocessing`` process or pool initializer, then attach to
+  the same weights instead of holding a copy. Forked workers share them anyway as long as nothing writes to them.
+  """
   if model_name in ENSEMBLE_MODELS:
-    return load_ensemble_model(model_name, cache_dir, device)
+    return load_ensemble_model(
+      model_name, cache_dir, device, quantize, ensemble_tolerance, fuse, model_dir,
+      ensemble_executor, ensemble_workers, share_memory,
+    )
 
   model_name = model_name or list(NAME_TO_FILE.keys())[0]
   assert model_name in NAME_TO_FILE, f'Unknown model name: {model_name} (expected one of {list(NAME_TO_FILE.keys())})'
@@ -49,15 +74,26 @@ def load_pretrained_model(
     else:
       device = 'cpu'
 
-  filename = NAME_TO_FILE[model_name]
-  checkpoint_path = hf_hub_download(repo_id='taejunkim/allinone', filename=filename, cache_dir=cache_dir)
+  safetensors_path = get_safetensors_path(model_name, cache_dir)
+  if safetensors_path.is_file():
+    model = load_safetensors_model(safetensors_path, device)
+  else:
+    checkpoint_path = get_checkpoint_path(model_name, cache_dir, model_dir)
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    config = OmegaConf.create(checkpoint['config'])
 
-  checkpoint = torch.load(checkpoint_path, map_location=device)
-  config = OmegaConf.create(checkpoint['config'])
+    model = AllInOne(config).to(device)
+    model.load_state_dict(checkpoint['state_dict'])
+    model.eval()
 
-  model = AllInOne(config).to(device)
-  model.load_state_dict(checkpoint['state_dict'])
-  model.eval()
+  if fuse:
+    model = model.to_inference()
+
+  if quantize:
+    model = quantize_model(model)
+
+  if share_memory:
+    share_model_memory(model)
 
   return model
 
@@ -66,13 +102,113 @@ def load_ensemble_model(
   model_name: Optional[str] = None,
   cache_dir: Optional[PathLike] = None,
   device=None,
+  quantize: bool = False,
+  ensemble_tolerance: Optional[float] = None,
+  fuse: bool = False,
+  model_dir: Optional[PathLike] = None,
+  ensemble_executor: Optional[str] = None,
+  ensemble_workers: Optional[int] = None,
+  share_memory: bool = False,
 ):
-  models = []
-  for model_name in ENSEMBLE_MODELS[model_name]:
-    model = load_pretrained_model(model_name, cache_dir, device)
-    models.append(model)
+  # Load the folds in parallel, most of the time is spent in I/O and torch ops that release the GIL.
+  model_names = ENSEMBLE_MODELS[model_name]
+  with ThreadPoolExecutor(max_workers=len(model_names)) as executor:
+    models = list(executor.map(
+      lambda name: load_pretrained_model(
+        name, cache_dir, device, quantize, fuse=fuse, model_dir=model_dir, share_memory=share_memory,
+      ),
+      model_names,
+    ))
 
-  ensemble = Ensemble(models).to(device)
+  ensemble = Ensemble(
+    models,
+    tolerance=ensemble_tolerance,
+    executor=ensemble_executor,
+    num_workers=ensemble_workers,
+  ).to(device)
   ensemble.eval()
 
   return ensemble
+
+
+def get_checkpoint_path(
+  model_name: str,
+  cache_dir: Optional[PathLike] = None,
+  model_dir: Optional[PathLike] = None,
+) -> Path:
+  """
+  Returns the local path of a checkpoint. The local model registry (see ``registry.py``) is used if configured,
+  without any network access. Otherwise, the checkpoint is fetched through the Hugging Face Hub cache.
+  """
+  checkpoint_path = resolve_checkpoint(model_name, model_dir)
+  if checkpoint_path is None:
+    checkpoint_path = hf_hub_download(repo_id=HF_REPO_ID, filename=NAME_TO_FILE[model_name], cache_dir=cache_dir)
+  return Path(checkpoint_path)
+
+
+def get_safetensors_path(model_name: str, cache_dir: Optional[PathLike] = None) -> Path:
+  """Returns the path of the safetensors file of a single model converted by ``convert_to_safetensors``."""
+  cache_dir = Path(cache_dir) if cache_dir is not None else DEFAULT_CACHE_DIR
+  return cache_dir / 'safetensors' / f'{model_name}.safetensors'
+
+
+def convert_to_safetensors(
+  model_name: str = 'harmonix-all',
+  cache_dir: Optional[PathLike] = None,
+  overwrite: bool = False,
+  model_dir: Optional[PathLike] = None,
+) -> List[Path]:
+  """
+  Converts the checkpoints of a pre-trained model (every fold for an ensemble) to safetensors files,
+  with the model config stored as JSON metadata. ``load_pretrained_model`` uses them from then on,
+  which skips unpickling the checkpoints and checking the Hugging Face Hub.
+  """
+  from safetensors.torch import save_file
+
+  model_names = ENSEMBLE_MODELS.get(model_name, [model_name])
+  paths = []
+  for name in model_names:
+    assert name in NAME_TO_FILE, f'Unknown model name: {name} (expected one of {list(NAME_TO_FILE.keys())})'
+    dst = get_safetensors_path(name, cache_dir)
+    paths.append(dst)
+    if dst.is_file() and not overwrite:
+      continue
+
+    checkpoint = torch.load(get_checkpoint_path(name, cache_dir, model_dir), map_location='cpu')
+    config = OmegaConf.to_container(OmegaConf.create(checkpoint['config']), resolve=True)
+    state_dict = {key: value.contiguous() for key, value in checkpoint['state_dict'].items()}
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    save_file(state_dict, str(dst), metadata={'config': json.dumps(config), 'checkpoint': NAME_TO_FILE[name]})
+
+  return paths
+
+
+def load_safetensors_model(path: PathLike, device=None) -> AllInOne:
+  """Loads a model converted by ``convert_to_safetensors``, memory-mapping the weights into the model."""
+  from safetensors import safe_open
+
+  device = device or 'cpu'
+  with safe_open(str(path), framework='pt', device=str(device)) as f:
+    config = OmegaConf.create(json.loads(f.metadata()['config']))
+    state_dict = {key: f.get_tensor(key) for key in f.keys()}
+
+  # The weights are replaced right away, so there is no need to allocate and initialize them.
+  with torch.device('meta'):
+    model = AllInOne(config)
+  model.load_state_dict(state_dict, assign=True)
+  model.eval()
+  return model
+
+
+def share_model_memory(model: torch.nn.Module) -> torch.nn.Module:
+  """
+  Moves the weights of a CPU model to shared memory in place, so that worker processes attach to them
+  instead of copying them. Weights on GPU are left as they are, since CUDA tensors are always shared through IPC.
+  Note that the packed weights of quantized linear layers are not regular tensors and cannot be shared.
+  """
+  for module in model.models if isinstance(model, Ensemble) else [model]:
+    for tensor in list(module.parameters()) + list(module.buffers()):
+      if tensor.device.type == 'cpu':
+        tensor.share_memory_()
+  return model
@@ -0,0 +1,110 @@
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+from typing import List, Dict, Optional
+from madmom.evaluation.beats import FMEASURE_WINDOW
+from madmom.evaluation.onsets import OnsetEvaluation
+from .ensemble import Ensemble
+from ..typings import PathLike
+
+
+def quantize_model(model: nn.Module) -> nn.Module:
+  """
+  Applies int8 dynamic quantization to every ``nn.Linear`` of the model in place.
+  For an ensemble, every fold is quantized. Dynamic quantization only runs on CPU.
+  """
+  if isinstance(model, Ensemble):
+    model.models = [quantize_model(m) for m in model.models]
+    return model
+
+  device = next(model.parameters()).device
+  if device.type != 'cpu':
+    raise ValueError(f'Dynamic int8 quantization is only supported on CPU, but the model is on {device}.')
+
+  model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+  model.eval()
+  return model
+
+
+def compute_quantization_report(
+  spec_paths: List[PathLike],
+  model_name: str = 'harmonix-all',
+  cache_dir: Optional[PathLike] = None,
+) -> Dict[str, float]:
+  """
+  Runs the float32 and the int8 model on the given spectrograms and reports how much the quantized model drifts.
+  The float32 predictions are used as the reference, so F-measures of 1.0 mean no drift at all.
+
+  Parameters
+  ----------
+  spec_paths : List[PathLike]
+      Paths to spectrograms (.npy) extracted by ``extract_spectrograms``.
+  model_name : str, optional
+      Name of the pre-trained model to be evaluated. Default is 'harmonix-all'.
+  cache_dir : PathLike, optional
+      Cache directory for the model checkpoints.
+
+  Returns
+  -------
+  Dict[str, float]
+      Averaged beat, downbeat and segment boundary F-measures and frame-wise function label agreement against the
+      float32 model, the maximum absolute logit difference, and the mean inference time of both models.
+  """
+  from .loaders import load_pretrained_model
+  from ..postprocessing import postprocess_metrical_structure, postprocess_functional_structure
+
+  model_fp32 = load_pretrained_model(model_name, cache_dir, device='cpu')
+  model_int8 = load_pretrained_model(model_name, cache_dir, device='cpu', quantize=True)
+
+  scores = []
+  for spec_path in spec_paths:
+    spec = torch.from_numpy(np.load(spec_path)).unsqueeze(0)
+
+    with torch.no_grad():
+      tic = time.perf_counter()
+      logits_fp32 = model_fp32(spec)
+      time_fp32 = time.perf_counter() - tic
+
+      tic = time.perf_counter()
+      logits_int8 = model_int8(spec)
+      time_int8 = time.perf_counter() - tic
+
+    metrical_fp32 = postprocess_metrical_structure(logits_fp32, model_fp32.cfg)
+    metrical_int8 = postprocess_metrical_structure(logits_int8, model_int8.cfg)
+    segments_fp32 = postprocess_functional_structure(logits_fp32, model_fp32.cfg)
+    segments_int8 = postprocess_functional_structure(logits_int8, model_int8.cfg)
+
+    # The F-measure of BeatEvaluation, without its other scores that fail on a single beat or boundary.
+    eval_beat = OnsetEvaluation(metrical_int8['beats'], metrical_fp32['beats'], window=FMEASURE_WINDOW)
+    eval_downbeat = OnsetEvaluation(metrical_int8['downbeats'], metrical_fp32['downbeats'], window=FMEASURE_WINDOW)
+    eval_section = OnsetEvaluation(
+      [s.start for s in segments_int8[1:]],
+      [s.start for s in segments_fp32[1:]],
+      window=0.5,
+    )
+    max_logit_diff = max(
+      (getattr(logits_fp32, key) - getattr(logits_int8, key)).abs().max().item()
+      for key in ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function']
+    )
+
+    scores.append({
+      'beat_f1': eval_beat.fmeasure,
+      'downbeat_f1': eval_downbeat.fmeasure,
+      'section_f1': eval_section.fmeasure,
+      'function_agreement': (
+        logits_fp32.logits_function.argmax(dim=1) == logits_int8.logits_function.argmax(dim=1)
+      ).float().mean().item(),
+      'max_logit_diff': max_logit_diff,
+      'time_fp32': time_fp32,
+      'time_int8': time_int8,
+    })
+
+  report = {
+    key: float(np.mean([s[key] for s in scores]))
+    for key in scores[0].keys()
+  }
+  report['max_logit_diff'] = max(s['max_logit_diff'] for s in scores)
+  report['speedup'] = report['time_fp32'] / report['time_int8']
+  return report
@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+
+from pathlib import Path
+from typing import Dict, List, Optional
+from ..typings import PathLike
+from ..utils import compute_sha256
+
+MODEL_DIR_ENV = 'ALLIN1FIX_MODEL_DIR'
+MANIFEST_NAME = 'manifest.json'
+
+
+def get_registry_dir(model_dir: Optional[PathLike] = None) -> Optional[Path]:
+  """
+  Returns the directory of the local model registry: ``model_dir`` if given, otherwise the ``ALLIN1FIX_MODEL_DIR``
+  environment variable, or None if no registry is configured.
+  """
+  model_dir = model_dir or os.environ.get(MODEL_DIR_ENV)
+  return Path(model_dir) if model_dir else None
+
+
+def load_manifest(model_dir: Path) -> Dict[str, dict]:
+  """Returns the registered models as a dict from model names to their file name, size and SHA-256 checksum."""
+  manifest_path = model_dir / MANIFEST_NAME
+  if not manifest_path.is_file():
+    return {}
+  with open(manifest_path) as f:
+    return json.load(f)['models']
+
+
+def resolve_checkpoint(model_name: str, model_dir: Optional[PathLike] = None) -> Optional[Path]:
+  """
+  Returns the path of a checkpoint in the local registry without any network access,
+  or None if no registry is configured.
+
+  Raises
+  ------
+  FileNotFoundError
+      If a registry is configured but does not contain the model.
+  """
+  registry_dir = get_registry_dir(model_dir)
+  if registry_dir is None:
+    return None
+
+  entry = load_manifest(registry_dir).get(model_name)
+  path = registry_dir / entry['file'] if entry else None
+  if path is None or not path.is_file():
+    raise FileNotFoundError(
+      f'Model {model_name} is not in the local model registry {registry_dir}. '
+      f'Populate it with: allin1fix --populate-registry --model-dir {registry_dir}'
+    )
+  return path
+
+
+def populate_registry(
+  model_dir: PathLike,
+  model_name: str = 'harmonix-all',
+  cache_dir: Optional[PathLike] = None,
+) -> List[Path]:
+  """
+  Copies the checkpoints of a pre-trained model (every fold for an ensemble) from the Hugging Face cache
+  into the local registry and records their checksums in its manifest. Nothing is downloaded.
+  """
+  from huggingface_hub import try_to_load_from_cache
+  from .loaders import NAME_TO_FILE, ENSEMBLE_MODELS, HF_REPO_ID
+
+  model_dir = Path(model_dir)
+  model_dir.mkdir(parents=True, exist_ok=True)
+  manifest = load_manifest(model_dir)
+
+  paths = []
+  for name in ENSEMBLE_MODELS.get(model_name, [model_name]):
+    assert name in NAME_TO_FILE, f'Unknown model name: {name} (expected one of {list(NAME_TO_FILE.keys())})'
+    src = try_to_load_from_cache(HF_REPO_ID, NAME_TO_FILE[name], cache_dir=cache_dir)
+    if not isinstance(src, str):
+      raise FileNotFoundError(f'{NAME_TO_FILE[name]} is not in the Hugging Face cache. Download it first.')
+
+    dst = model_dir / NAME_TO_FILE[name]
+    shutil.copyfile(src, dst)
+    manifest[name] = {
+      'file': dst.name,
+      'size': dst.stat().st_size,
+      'sha256': compute_sha256(dst),
+    }
+    paths.append(dst)
+
+  # Write the manifest atomically, so that a concurrent reader never sees a partial file.
+  tmp_path = model_dir / f'{MANIFEST_NAME}.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump({'version': 1, 'models': manifest}, f, indent=2)
+  os.replace(tmp_path, model_dir / MANIFEST_NAME)
+
+  return paths
+
+
+def verify_registry(model_dir: Optional[PathLike] = None) -> Dict[str, str]:
+  """
+  Checks every checkpoint of the local registry against the size and checksum in its manifest.
+  Returns a dict from model names to 'ok', 'missing', or 'corrupted'.
+  """
+  registry_dir = get_registry_dir(model_dir)
+  if registry_dir is None:
+    raise ValueError(f'No model registry configured. Pass a directory or set {MODEL_DIR_ENV}.')
+
+  status = {}
+  for name, entry in load_manifest(registry_dir).items():
+    path = registry_dir / entry['file']
+    if not path.is_file():
+      status[name] = 'missing'
+    elif path.stat().st_size != entry['size'] or compute_sha256(path) != entry['sha256']:
+      status[name] = 'corrupted'
+    else:
+      status[name] = 'ok'
+  return status
@@ -1,3 +1,3 @@
-from .metrical import postprocess_metrical_structure
+from .metrical import postprocess_metrical_structure, get_downbeat_processor, IncrementalDBNDecoder
 from .functional import postprocess_functional_structure
 from .tempo import estimate_tempo_from_beats
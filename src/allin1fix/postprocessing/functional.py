@@ -9,11 +9,23 @@ def postprocess_functional_structure(
   logits: AllInOneOutput,
   cfg: Config,
 ):
-  raw_prob_sections = torch.sigmoid(logits.logits_section[0])
-  raw_prob_functions = torch.softmax(logits.logits_function[0], dim=0)
-  prob_sections, _ = local_maxima(raw_prob_sections, filter_size=4 * cfg.min_hops_per_beat + 1)
-  prob_sections = prob_sections.cpu().numpy()
-  prob_functions = raw_prob_functions.cpu().numpy()
+  raw_prob_sections = torch.sigmoid(logits.logits_section[0]).cpu().numpy()
+  raw_prob_functions = torch.softmax(logits.logits_function[0], dim=0).cpu().numpy()
+  return decode_functional_structure(raw_prob_sections, raw_prob_functions, cfg)
+
+
+def decode_functional_structure(
+  raw_prob_sections: np.ndarray,
+  raw_prob_functions: np.ndarray,
+  cfg: Config,
+):
+  """
+  Decodes the segments of a track from its section boundary probabilities of shape (T,)
+  and function probabilities of shape (labels, T), on the host.
+  """
+  prob_sections, _ = local_maxima(torch.from_numpy(raw_prob_sections), filter_size=4 * cfg.min_hops_per_beat + 1)
+  prob_sections = prob_sections.numpy()
+  prob_functions = raw_prob_functions
 
   boundary_candidates = peak_picking(
     boundary_activation=prob_sections,
@@ -0,0 +1,109 @@
+"""
+Sliding-window kernels of the postprocessing, computed without materializing the (frames, window) views of every
+frame: running maxima with ``max_pool1d`` or ``maximum_filter1d``, and running medians with scipy's 1D median
+filter (on the device for tensors that are not on the CPU). The window means of ``peak_picking`` are only computed
+at its candidate frames. The outputs are bit-identical to those of the unfold/sliding-window formulations they
+replace, in the dtype of the input.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import maximum_filter1d, median_filter
+
+
+def local_maxima(tensor, filter_size=41):
+  """
+  Keeps the values of ``tensor`` (frames) or (batch, frames) that are the maximum of the ``filter_size`` window
+  centered on them, and zeros the others. Returns the filtered tensor and the (batch, frame) indices of the maxima.
+  """
+  assert len(tensor.shape) in (1, 2), 'Input tensor should have 1 or 2 dimensions'
+  assert filter_size % 2 == 1, 'Filter size should be an odd number'
+
+  original_shape = tensor.shape
+  if len(original_shape) == 1:
+    tensor = tensor.unsqueeze(0)
+
+  # max_pool1d pads with -inf, so the windows at the edges only see the real frames.
+  padding = filter_size // 2
+  max_filter = F.max_pool1d(tensor.unsqueeze(1), filter_size, stride=1, padding=padding).squeeze(1)
+
+  local_maxima_mask = torch.eq(tensor, max_filter)
+  local_maxima_indices = local_maxima_mask.nonzero()
+  output_arr = torch.where(local_maxima_mask, tensor, torch.zeros_like(tensor))
+  output_arr = output_arr.reshape(original_shape)
+
+  return output_arr, local_maxima_indices
+
+
+def median_filter_1d(tensor, filter_size=401):
+  """
+  Running median of ``tensor`` (frames) or (batch, frames) over ``filter_size`` frames, with the input reflected
+  at the edges (without repeating the edge frames). The output has the dtype and device of the input.
+  Tensors on a GPU are filtered there, without a copy to the host that would wait for the device.
+  """
+  assert len(tensor.shape) in (1, 2), 'Input tensor should have 1 or 2 dimensions'
+  assert filter_size % 2 == 1, 'Filter size should be an odd number'
+
+  original_shape = tensor.shape
+  if len(original_shape) == 1:
+    tensor = tensor.unsqueeze(0)
+
+  if tensor.device.type != 'cpu':
+    output_arr = _unfold_median_filter_1d(tensor, filter_size)
+  else:
+    # scipy's 'mirror' mode is torch's 'reflect' padding. Its running median is only fast on 1D inputs,
+    # so the rows are filtered one by one. Other dtypes than float32 and float64 go through float32.
+    arr = tensor.detach()
+    if arr.dtype not in (torch.float32, torch.float64):
+      arr = arr.float()
+    output_arr = np.stack([median_filter(row, size=filter_size, mode='mirror') for row in arr.numpy()])
+    output_arr = torch.from_numpy(output_arr).to(dtype=tensor.dtype)
+
+  return output_arr.reshape(original_shape)
+
+
+def _unfold_median_filter_1d(tensor, filter_size):
+  # The (batch, frames, filter_size) windows are a view, and the median over them runs on the device.
+  padding = filter_size // 2
+  padded = F.pad(tensor.unsqueeze(1), (padding, padding), mode='reflect').squeeze(1)
+  return padded.unfold(1, filter_size, 1).median(dim=-1).values
+
+
+def window_means(arr: np.ndarray, window_past: int, window_future: int, frames: np.ndarray):
+  """
+  Returns, for the given ``frames`` of ``arr``, the means of the ``window_past`` frames before them
+  and of the ``window_future`` frames after them, counting the frames outside ``arr`` as zeros.
+  The means are taken over the same windows with ``np.mean`` as for every frame, so they are identical.
+  """
+  padded = np.pad(arr, (window_past, window_future), mode='constant')
+  past_windows = sliding_window_view(padded[:-(window_future + 1)], window_past)
+  future_windows = sliding_window_view(padded[window_past + 1:], window_future)
+  return np.mean(past_windows[frames], axis=-1), np.mean(future_windows[frames], axis=-1)
+
+
+def peak_picking(boundary_activation, window_past=12, window_future=6):
+  """
+  Keeps the positive frames of ``boundary_activation`` that are the maximum of the window from ``window_past``
+  frames before them to ``window_future`` frames after them, and sets them to their strength: their value minus
+  the average of the mean activations of the past and future windows. The other frames are zeros.
+  """
+  window_size = window_past + window_future
+  assert window_size % 2 == 0, 'window_past + window_future must be even'
+  window_size += 1
+
+  # The window is shifted by the origin so that it spans [i - window_past, i + window_future].
+  max_filter = maximum_filter1d(
+    boundary_activation, window_size, mode='constant', cval=0., origin=(window_past - window_future) // 2,
+  )
+  local_maxima = (boundary_activation == max_filter) & (boundary_activation > 0)
+  boundary_candidates = np.flatnonzero(local_maxima)
+
+  past_mean, future_mean = window_means(boundary_activation, window_past, window_future, boundary_candidates)
+  strength_values = boundary_activation[boundary_candidates] - ((past_mean + future_mean) / 2)
+
+  strength_activations = np.zeros_like(boundary_activation)
+  strength_activations[boundary_candidates] = strength_values
+
+  return strength_activations
@@ -1,23 +1,207 @@
+import numpy as np
 import torch
 
+from collections import deque
+from functools import lru_cache
+from typing import Optional, Sequence
 from madmom.features.downbeats import DBNDownBeatTrackingProcessor
-from ..typings import AllInOneOutput
+from ..typings import AllInOneOutput, MetricalHint
 from ..config import Config
+from .kernels import local_maxima
+
+
+# Methods to derive the beats, downbeats and beat positions from the beat and downbeat probabilities.
+METRICAL_POSTPROCESSORS = ['dbn', 'peaks']
+
+
+# Relative tolerance around an exact tempo hint.
+BPM_HINT_TOLERANCE = 0.05
 
 
 def postprocess_metrical_structure(
   logits: AllInOneOutput,
   cfg: Config,
+  metrical_postprocessor: str = 'dbn',
+  hint: Optional[MetricalHint] = None,
+):
+  if metrical_postprocessor == 'peaks':
+    raw_prob_beats = torch.sigmoid(logits.logits_beat[0]).cpu().numpy()
+    raw_prob_downbeats = torch.sigmoid(logits.logits_downbeat[0]).cpu().numpy()
+    beats_per_bar = hint_to_dbn_kwargs(hint, cfg.fps)['beats_per_bar']
+    return pick_metrical_structure(raw_prob_beats, raw_prob_downbeats, cfg, beats_per_bar)
+  elif metrical_postprocessor == 'dbn':
+    activations = compute_dbn_activations(logits.logits_beat[0], logits.logits_downbeat[0])
+    return decode_metrical_structure(activations, cfg, hint)
+  raise ValueError(
+    f'Unknown metrical postprocessor: {metrical_postprocessor} (expected one of {METRICAL_POSTPROCESSORS})'
+  )
+
+
+def decode_metrical_structure(
+  activations: np.ndarray,
+  cfg: Config,
+  hint: Optional[MetricalHint] = None,
 ):
-  postprocessor_downbeat = DBNDownBeatTrackingProcessor(
-    beats_per_bar=[3, 4],
+  """
+  Decodes the beats, downbeats and beat positions from the (T, 2) DBN activations of a track on the host.
+  With a ``hint``, the DBN only models the hinted tempi and meters.
+  """
+  postprocessor_downbeat = get_downbeat_processor(
     threshold=cfg.best_threshold_downbeat,
     fps=cfg.fps,
+    **hint_to_dbn_kwargs(hint, cfg.fps),
+  )
+
+  pred_downbeat_times = postprocessor_downbeat(activations)
+
+  beats = pred_downbeat_times[:, 0]
+  beat_positions = pred_downbeat_times[:, 1]
+  downbeats = pred_downbeat_times[beat_positions == 1., 0]
+
+  beats = beats.tolist()
+  downbeats = downbeats.tolist()
+  beat_positions = beat_positions.astype('int').tolist()
+
+  return {
+    'beats': beats,
+    'downbeats': downbeats,
+    'beat_positions': beat_positions,
+  }
+
+
+def pick_metrical_structure(
+  raw_prob_beats: np.ndarray,
+  raw_prob_downbeats: np.ndarray,
+  cfg: Config,
+  beats_per_bar: Sequence[int] = (3, 4),
+):
+  """
+  Derives the beats, downbeats and beat positions of a track from its beat and downbeat probabilities of shape (T,)
+  without any HMM, as a fast alternative to ``decode_metrical_structure``.
+
+  Beats and downbeats are the local maxima above the thresholds of the model, as in training. Each downbeat is
+  snapped to the nearest beat, or becomes a beat itself if there is none within half the minimum beat interval.
+  The bar length is the one of ``beats_per_bar`` that the intervals between downbeats agree with the most (the
+  longest one on ties). The beats are numbered from the previous downbeat, or counted back from the first one,
+  wrapping around after a bar so that missed downbeats do not derail the count.
+  """
+  threshold_beat = cfg.best_threshold_beat if cfg.best_threshold_beat is not None else cfg.threshold_beat
+  threshold_downbeat = (
+    cfg.best_threshold_downbeat if cfg.best_threshold_downbeat is not None else cfg.threshold_downbeat
+  )
+  prob_beats, _ = local_maxima(torch.from_numpy(raw_prob_beats), filter_size=cfg.min_hops_per_beat + 1)
+  prob_downbeats, _ = local_maxima(torch.from_numpy(raw_prob_downbeats), filter_size=4 * cfg.min_hops_per_beat + 1)
+  beat_frames = np.flatnonzero(prob_beats.numpy() > threshold_beat)
+  downbeat_frames = np.flatnonzero(prob_downbeats.numpy() > threshold_downbeat)
+
+  # Snap the downbeats to the nearest beats, and add those that are too far from any beat.
+  if len(beat_frames) > 0 and len(downbeat_frames) > 0:
+    right = np.clip(np.searchsorted(beat_frames, downbeat_frames), 1, len(beat_frames) - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(
+      np.abs(beat_frames[left] - downbeat_frames) <= np.abs(beat_frames[right] - downbeat_frames), left, right,
+    )
+    is_near = np.abs(beat_frames[nearest] - downbeat_frames) <= cfg.min_hops_per_beat // 2
+    downbeat_frames = np.union1d(beat_frames[nearest[is_near]], downbeat_frames[~is_near])
+    beat_frames = np.union1d(beat_frames, downbeat_frames)
+  elif len(beat_frames) == 0:
+    beat_frames = downbeat_frames
+  is_downbeat = np.isin(beat_frames, downbeat_frames)
+
+  downbeat_indices = np.flatnonzero(is_downbeat)
+  bar_lengths = np.diff(downbeat_indices)
+  num_beats = max(beats_per_bar, key=lambda n: (np.sum(bar_lengths == n), n))
+
+  # Number the beats from the last downbeat before them, or from the first one for the beats before it.
+  indices = np.arange(len(beat_frames))
+  if len(downbeat_indices) > 0:
+    reference = np.maximum.accumulate(np.where(is_downbeat, indices, downbeat_indices[0]))
+  else:
+    reference = np.zeros_like(indices)
+  beat_positions = (indices - reference) % num_beats + 1
+
+  beats = beat_frames / float(cfg.fps)
+  downbeats = beats[beat_positions == 1]
+
+  return {
+    'beats': beats.tolist(),
+    'downbeats': downbeats.tolist(),
+    'beat_positions': beat_positions.astype('int').tolist(),
+  }
+
+
+def hint_to_dbn_kwargs(hint: Optional[MetricalHint], fps: float = 100) -> dict:
+  """
+  Returns the ``beats_per_bar``, ``min_bpm`` and ``max_bpm`` of the DBN for a track with the given hint,
+  or the defaults without one. An exact tempo is widened by ``BPM_HINT_TOLERANCE`` on each side.
+
+  The DBN models the beat intervals from ``round(60 * fps / max_bpm)`` to ``round(60 * fps / min_bpm)`` frames,
+  so the tempo range is snapped to those, which lets the tracks whose hints cover the same intervals share
+  a processor.
+  """
+  kwargs = dict(beats_per_bar=(3, 4), min_bpm=55., max_bpm=215.)
+  if hint is None:
+    return kwargs
+
+  if hint.beats_per_bar is not None:
+    kwargs['beats_per_bar'] = tuple(int(n) for n in np.atleast_1d(hint.beats_per_bar))
+  if hint.bpm is not None:
+    if np.ndim(hint.bpm) == 0:
+      min_bpm, max_bpm = hint.bpm * (1 - BPM_HINT_TOLERANCE), hint.bpm * (1 + BPM_HINT_TOLERANCE)
+    else:
+      min_bpm, max_bpm = hint.bpm
+    if not 0 < min_bpm <= max_bpm:
+      raise ValueError(f'Invalid tempo hint: {hint.bpm} (expected a positive BPM or a (min, max) range)')
+    min_interval = max(1, round(60. * fps / max_bpm))
+    max_interval = max(min_interval, round(60. * fps / min_bpm))
+    kwargs['min_bpm'] = 60. * fps / max_interval
+    kwargs['max_bpm'] = 60. * fps / min_interval
+  return kwargs
+
+
+def get_downbeat_processor(
+  beats_per_bar: Sequence[int] = (3, 4),
+  threshold: Optional[float] = None,
+  fps: float = 100,
+  min_bpm: float = 55.,
+  max_bpm: float = 215.,
+  **kwargs,
+) -> DBNDownBeatTrackingProcessor:
+  """
+  Returns a ``DBNDownBeatTrackingProcessor`` that is built once per set of arguments and then reused,
+  since building the state spaces, transition and observation models of every meter is costly compared to decoding
+  a short track. The processor holds no state between calls, so it can be shared by tracks and threads.
+  Each worker process builds its own on first use.
+  """
+  return _build_downbeat_processor(tuple(beats_per_bar), threshold, fps, min_bpm, max_bpm, **kwargs)
+
+
+@lru_cache(maxsize=128)
+def _build_downbeat_processor(beats_per_bar, threshold, fps, min_bpm, max_bpm, **kwargs):
+  return DBNDownBeatTrackingProcessor(
+    beats_per_bar=list(beats_per_bar),
+    threshold=threshold,
+    fps=fps,
+    min_bpm=min_bpm,
+    max_bpm=max_bpm,
+    **kwargs,
   )
 
-  raw_prob_beats = torch.sigmoid(logits.logits_beat[0])
-  raw_prob_downbeats = torch.sigmoid(logits.logits_downbeat[0])
 
+def compute_dbn_activations(
+  logits_beat: torch.FloatTensor,
+  logits_downbeat: torch.FloatTensor,
+) -> np.ndarray:
+  """Converts the beat and downbeat logits of shape (T,) to the (T, 2) activations of madmom's DBN."""
+  activations = combine_dbn_activations(torch.sigmoid(logits_beat), torch.sigmoid(logits_downbeat))
+  return activations.cpu().numpy()
+
+
+def combine_dbn_activations(
+  raw_prob_beats: torch.FloatTensor,
+  raw_prob_downbeats: torch.FloatTensor,
+) -> torch.FloatTensor:
+  """Combines the beat and downbeat probabilities of shape (T,) into the (T, 2) activations, on their device."""
   # Transform the raw probabilities into activations indicating:
   # 1. beat but not downbeat
   # 2. downbeat
@@ -31,20 +215,161 @@ def postprocess_metrical_structure(
   activations_xbeat = torch.maximum(torch.tensor(1e-8), activations_beat - activations_downbeat)
   activations_combined = torch.stack([activations_xbeat, activations_downbeat, activations_no], dim=-1)
   activations_combined /= activations_combined.sum(dim=-1, keepdim=True)
-  activations_combined = activations_combined.cpu().numpy()
 
-  pred_downbeat_times = postprocessor_downbeat(activations_combined[:, :2])
+  return activations_combined[:, :2]
 
-  beats = pred_downbeat_times[:, 0]
-  beat_positions = pred_downbeat_times[:, 1]
-  downbeats = pred_downbeat_times[beat_positions == 1., 0]
 
-  beats = beats.tolist()
-  downbeats = downbeats.tolist()
-  beat_positions = beat_positions.astype('int').tolist()
+class IncrementalDBNDecoder:
+  """
+  Incremental version of the DBN decoding of ``postprocess_metrical_structure``.
 
-  return {
-    'beats': beats,
-    'downbeats': downbeats,
-    'beat_positions': beat_positions,
-  }
+  Activations are fed in chunks of any size. The forward pass of the Viterbi algorithm advances frame by frame over
+  the HMMs of madmom's ``DBNDownBeatTrackingProcessor``, and a beat is committed once the best path has moved ``lag``
+  frames past it, which bounds the latency. Only the backtracking pointers needed for that are kept.
+  When ``lag`` covers the whole sequence, the output is identical to the offline processor.
+
+  Parameters
+  ----------
+  beats_per_bar : Sequence[int]
+      Bar lengths to model, as in madmom.
+  threshold : float, optional
+      Activation threshold; frames before the first and after the last activation above it are ignored, as in madmom.
+  fps : int
+      Frame rate of the activations.
+  lag : int
+      Number of frames after which a beat is committed.
+  **kwargs
+      Other arguments of ``DBNDownBeatTrackingProcessor`` (min_bpm, max_bpm, num_tempi, ...).
+  """
+
+  def __init__(
+    self,
+    beats_per_bar: Sequence[int] = (3, 4),
+    threshold: Optional[float] = None,
+    fps: int = 100,
+    lag: int = 100,
+    **kwargs,
+  ):
+    processor = get_downbeat_processor(beats_per_bar, threshold, fps, **kwargs)
+    self.hmms = processor.hmms
+    self.threshold = threshold
+    self.fps = fps
+    self.lag = lag
+
+    # A beat lasts at most the longest beat interval, which is all we need to look back beyond the lag.
+    max_interval = max(hmm.transition_model.state_space.state_intervals.max() for hmm in self.hmms)
+    self.history = lag + int(max_interval) + 1
+
+    self.incoming = []
+    for hmm in self.hmms:
+      tm = hmm.transition_model
+      # Destination state of every transition in madmom's CSR layout.
+      self.incoming.append(np.repeat(np.arange(tm.num_states), np.diff(tm.pointers)))
+    self.reset()
+
+  def reset(self):
+    self.deltas = [np.log(hmm.initial_distribution) for hmm in self.hmms]
+    self.backpointers = [deque() for _ in self.hmms]
+    self.activations = deque()
+    self.num_frames = 0  # frames fed so far
+    self.start = None  # first decoded frame, i.e. the first one above the threshold
+    self.end = None  # frame after the last one above the threshold
+    self.end_deltas = None  # Viterbi variables at self.end - 1
+    self.committed = 0  # frame where the last committed beat range ends
+
+  def process(self, activations: np.ndarray) -> np.ndarray:
+    """
+    Feeds activations of shape (frames, 2) and returns the newly committed beats
+    as an array of shape (beats, 2) with times in seconds and beat numbers, like madmom.
+    """
+    for activation in activations:
+      self._step(activation)
+
+    # The frames after the last activation above the threshold are dropped by madmom, which we can only do
+    # once they have been silent for long enough.
+    final = self.end is not None and self.num_frames - self.end >= self.lag
+    return self._commit(final=final)
+
+  def finalize(self) -> np.ndarray:
+    """Returns all the remaining beats, as if the sequence ended here."""
+    beats = self._commit(final=True)
+    self.reset()
+    return beats
+
+  def _step(self, activation: np.ndarray):
+    frame = self.num_frames
+    self.num_frames += 1
+    above = self.threshold is None or (activation >= self.threshold).any()
+    if self.start is None:
+      if not above:
+        return
+      self.start = frame
+
+    for i, hmm in enumerate(self.hmms):
+      tm = hmm.transition_model
+      incoming = self.incoming[i]
+      densities = hmm.observation_model.log_densities(activation[np.newaxis])[0]
+      densities = densities[hmm.observation_model.pointers]
+
+      # Same arithmetic and tie-breaking (first best previous state) as madmom's viterbi.
+      scores = self.deltas[i][tm.states] + tm.log_probabilities
+      scores += densities[incoming]
+      best = np.maximum.reduceat(scores, tm.pointers[:-1])
+      candidates = np.flatnonzero(scores == best[incoming])
+      first = np.r_[True, incoming[candidates[1:]] != incoming[candidates[:-1]]]
+
+      self.deltas[i] = best
+      self.backpointers[i].append(tm.states[candidates[first]])
+      if len(self.backpointers[i]) > self.history:
+        self.backpointers[i].popleft()
+
+    self.activations.append(activation)
+    if len(self.activations) > self.history:
+      self.activations.popleft()
+
+    if above:
+      self.end = frame + 1
+      self.end_deltas = list(self.deltas)
+
+  def _commit(self, final: bool) -> np.ndarray:
+    if self.end is None or self.end - self.num_frames + len(self.activations) <= 0:
+      return np.empty((0, 2))
+
+    # Backtrack from the best state at the last frame above the threshold, through the frames still in memory.
+    best = int(np.argmax([delta.max() for delta in self.end_deltas]))
+    delta = self.end_deltas[best]
+    if np.isinf(delta.max()):
+      return np.empty((0, 2))
+    num_history = len(self.activations)
+    history_start = self.num_frames - num_history
+    length = self.end - history_start
+    backpointers = list(self.backpointers[best])
+    path = np.empty(length, dtype=np.uint32)
+    path[-1] = delta.argmax()
+    for t in range(length - 1, 0, -1):
+      path[t - 1] = backpointers[t][path[t]]
+
+    hmm = self.hmms[best]
+    positions = hmm.transition_model.state_space.state_positions[path]
+    beat_range = hmm.observation_model.pointers[path] >= 1
+    idx = np.nonzero(np.diff(beat_range.astype(np.int_)))[0] + 1
+    if beat_range[0]:
+      idx = np.r_[0, idx]
+    if beat_range[-1]:
+      idx = np.r_[idx, beat_range.size]
+
+    activations = np.array(list(self.activations)[:length])
+    beats = []
+    for left, right in idx.reshape((-1, 2)):
+      # Skip ranges that were cut by the history, are already committed, or may still change.
+      if left == 0 and history_start > self.start:
+        continue
+      if left + history_start < self.committed:
+        continue
+      if not final and right + history_start > self.end - self.lag:
+        break
+      peak = np.argmax(activations[left:right]) // 2 + left
+      beats.append(((peak + history_start) / float(self.fps), int(positions[peak]) + 1))
+      self.committed = right + history_start
+
+    return np.array(beats).reshape(-1, 2)
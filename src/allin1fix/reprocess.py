@@ -0,0 +1,249 @@
+import os
+import numpy as np
+import torch
+
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from omegaconf import OmegaConf
+from tqdm import tqdm
+from .helpers import compute_probabilities, postprocess_activations, LOGIT_KEYS, TASK_HEADS
+from .postprocessing.metrical import METRICAL_POSTPROCESSORS
+from .typings import AllInOneOutput, AnalysisResult, MetricalHint, PathLike
+from .utils import compute_sha256, mkpath
+
+CONFIG_NAME = 'config.yaml'
+SETTINGS_NAME = 'settings.yaml'
+# Settings of analyze that change the logits of the model, with their defaults.
+CACHE_SETTINGS = {
+  'fuse': False,
+  'quantize': False,
+  'ensemble_tolerance': None,
+  'tasks': None,
+}
+
+# Probabilities needed by each task, among those computed from the cached logits.
+TASK_ACTIVATIONS = {
+  'beats': ['beat', 'downbeat'],
+  'structure': ['segment', 'label'],
+}
+
+
+def cache_settings(settings: Optional[dict] = None) -> Dict:
+  """
+  Returns the settings of ``analyze`` that change the cached logits (any of 'fuse', 'quantize',
+  'ensemble_tolerance' and 'tasks'), completed with their defaults. The tasks are reduced to those computed
+  by a head of the model, and to None if that is all of them.
+  """
+  settings = dict(settings or {})
+  unknown_settings = set(settings) - set(CACHE_SETTINGS)
+  if unknown_settings:
+    raise ValueError(f'Unknown settings: {sorted(unknown_settings)} (expected any of {list(CACHE_SETTINGS)})')
+  settings = {**CACHE_SETTINGS, **settings}
+  if settings['tasks'] is not None:
+    head_tasks = sorted(task for task in set(settings['tasks']) if TASK_HEADS[task])
+    all_head_tasks = sorted(task for task, heads in TASK_HEADS.items() if heads)
+    settings['tasks'] = None if head_tasks == all_head_tasks else head_tasks
+  settings['fuse'] = bool(settings['fuse'])
+  settings['quantize'] = bool(settings['quantize'])
+  if settings['ensemble_tolerance'] is not None:
+    settings['ensemble_tolerance'] = float(settings['ensemble_tolerance'])
+  return settings
+
+
+def cache_settings_name(settings: Optional[dict] = None) -> str:
+  """
+  Returns the name of the subdirectory of ``activations_dir/model_name`` keeping the logits computed with
+  the given settings of ``analyze``, e.g. 'default' or 'fuse-quantize-tolerance0.01-tasks-beats'.
+  """
+  settings = cache_settings(settings)
+  parts = [name for name in ['fuse', 'quantize'] if settings[name]]
+  if settings['ensemble_tolerance'] is not None:
+    parts.append(f'tolerance{settings["ensemble_tolerance"]:g}')
+  if settings['tasks'] is not None:
+    parts.append('tasks-' + ('+'.join(settings['tasks']) or 'none'))
+  return '-'.join(parts) or 'default'
+
+
+def save_cached_activations(
+  activations_dir: PathLike,
+  model_name: str,
+  cfg,
+  path: Path,
+  spec_path: Path,
+  logits: Dict[str, np.ndarray],
+  settings: Optional[dict] = None,
+) -> Path:
+  """
+  Persists the logits of a track returned by ``run_model(include_logits=True)`` in
+  ``activations_dir/model_name/<settings name>``, in float32, keyed by the SHA-256 of its spectrogram so that
+  the same audio is only stored once per model and settings of ``analyze`` (see ``cache_settings``).
+  The model config, which holds the thresholds of the postprocessing, and the settings are saved next to them.
+  """
+  settings = cache_settings(settings)
+  model_dir = mkpath(activations_dir) / model_name / cache_settings_name(settings)
+  model_dir.mkdir(parents=True, exist_ok=True)
+  config_path = model_dir / CONFIG_NAME
+  if not config_path.is_file():
+    _write_atomically(config_path, lambda f: f.write(OmegaConf.to_yaml(cfg).encode()))
+  settings_path = model_dir / SETTINGS_NAME
+  if not settings_path.is_file():
+    _write_atomically(settings_path, lambda f: f.write(OmegaConf.to_yaml(settings).encode()))
+
+  # The probabilities are recomputed from the exact logits, so the postprocessing sees the same inputs as in
+  # analyze: on nearly flat activations, even the rounding of float16 logits can move the beats of the DBN.
+  arrays = {key: logits[key].astype(np.float32) for key in LOGIT_KEYS if key in logits}
+  out_path = model_dir / f'{compute_sha256(spec_path)}.npz'
+  _write_atomically(out_path, lambda f: np.savez_compressed(f, path=np.array(str(path)), **arrays))
+  return out_path
+
+
+def load_cached_activations(cache_path: PathLike):
+  """
+  Returns the track path and the probabilities of a cached track, computed from its logits in float32
+  as in ``run_model``, with the DBN activations.
+  """
+  with np.load(cache_path) as data:
+    path = Path(str(data['path']))
+    logits = AllInOneOutput(**{
+      key: torch.from_numpy(data[key].astype(np.float32)).unsqueeze(0) for key in LOGIT_KEYS if key in data.files
+    })
+  activations = {key: value.numpy() for key, value in compute_probabilities(logits).items()}
+  return path, activations
+
+
+def reprocess(
+  activations_dir: PathLike,
+  out_dir: Optional[PathLike] = None,
+  model: str = 'harmonix-all',
+  paths: Optional[List[PathLike]] = None,
+  include_activations: bool = False,
+  tasks: Optional[List[str]] = None,
+  metrical_postprocessor: str = 'dbn',
+  metrical_hints: Optional[Dict[PathLike, Union[MetricalHint, dict]]] = None,
+  cfg_overrides: Optional[dict] = None,
+  num_workers: Optional[int] = None,
+  settings: Optional[dict] = None,
+) -> List[AnalysisResult]:
+  """
+  Regenerates the analysis results of the tracks cached by ``analyze(activations_dir=...)`` from their
+  logits, without running the source separation or the model, e.g. to try other postprocessing settings.
+
+  Parameters
+  ----------
+  activations_dir : PathLike
+      Directory given as ``activations_dir`` to ``analyze``.
+  out_dir : PathLike, optional
+      Path to the directory where the analysis results will be saved. By default, the results will not be saved.
+  model : str, optional
+      Name of the model whose outputs to reprocess. Default is 'harmonix-all'.
+  paths : List[PathLike], optional
+      Tracks to reprocess, by path or file name. Default is None, which reprocesses every cached track.
+  include_activations : bool, optional
+      Whether to include activations in the analysis results or not.
+  tasks : List[str], optional
+      Outputs to compute: any of 'beats' and 'structure'. Default is None, which computes those whose
+      logits were cached for each track.
+  metrical_postprocessor : str, optional
+      How to derive the beats, downbeats and beat positions, as in ``analyze``. Default is 'dbn'.
+  metrical_hints : Dict[PathLike, Union[MetricalHint, dict]], optional
+      Known tempo and meter of some tracks, as in ``analyze``.
+  cfg_overrides : dict, optional
+      Values replacing those of the model config, e.g. ``{'best_threshold_downbeat': 0.3}``.
+  num_workers : int, optional
+      Number of worker processes. Default is None, which uses one per CPU. 0 reprocesses the tracks inline.
+  settings : dict, optional
+      Settings of ``analyze`` the logits were cached with: any of 'fuse', 'quantize', 'ensemble_tolerance' and
+      'tasks'. Default is None, which selects the logits cached with the defaults of ``analyze``.
+
+  Returns
+  -------
+  List[AnalysisResult]
+      Analysis results of the reprocessed tracks, sorted by path.
+  """
+  if metrical_postprocessor not in METRICAL_POSTPROCESSORS:
+    raise ValueError(
+      f'Unknown metrical postprocessor: {metrical_postprocessor} (expected one of {METRICAL_POSTPROCESSORS})'
+    )
+  if tasks is not None:
+    unknown_tasks = set(tasks) - set(TASK_ACTIVATIONS)
+    if unknown_tasks:
+      raise ValueError(f'Unknown tasks: {sorted(unknown_tasks)} (expected any of {list(TASK_ACTIVATIONS)})')
+
+  settings_name = cache_settings_name(settings)
+  model_dir = mkpath(activations_dir) / model / settings_name
+  config_path = model_dir / CONFIG_NAME
+  if not config_path.is_file():
+    cached_settings = sorted(path.parent.name for path in model_dir.parent.glob(f'*/{SETTINGS_NAME}'))
+    raise FileNotFoundError(
+      f'No cached outputs of {model} with the settings {settings_name} in {activations_dir} '
+      f'(cached settings: {cached_settings}).'
+    )
+  cfg = OmegaConf.load(config_path)
+  if cfg_overrides:
+    cfg = OmegaConf.merge(cfg, cfg_overrides)
+
+  metrical_hints = {
+    str(key): hint if isinstance(hint, MetricalHint) else MetricalHint(**hint)
+    for key, hint in (metrical_hints or {}).items()
+  }
+  options = dict(
+    cfg=cfg,
+    out_dir=out_dir,
+    paths={str(path) for path in paths} if paths is not None else None,
+    include_activations=include_activations,
+    tasks=tasks,
+    metrical_postprocessor=metrical_postprocessor,
+    metrical_hints=metrical_hints,
+  )
+  cache_paths = sorted(model_dir.glob('*.npz'))
+
+  num_workers = os.cpu_count() if num_workers is None else num_workers
+  results = []
+  if num_workers > 0:
+    with get_context('spawn').Pool(num_workers, initializer=_init_worker, initargs=(options,)) as pool:
+      chunksize = max(1, len(cache_paths) // (num_workers * 16))
+      iterator = pool.imap_unordered(_reprocess_track, cache_paths, chunksize=chunksize)
+      results = list(tqdm(iterator, total=len(cache_paths), desc='Reprocessing'))
+  else:
+    _init_worker(options)
+    results = [_reprocess_track(cache_path) for cache_path in tqdm(cache_paths, desc='Reprocessing')]
+
+  return sorted([result for result in results if result is not None], key=lambda result: str(result.path))
+
+
+_options = None
+
+
+def _init_worker(options: dict):
+  global _options
+  _options = options
+
+
+def _reprocess_track(cache_path: Path) -> Optional[AnalysisResult]:
+  path, activations = load_cached_activations(cache_path)
+  options = _options
+  if options['paths'] is not None and str(path) not in options['paths'] and path.name not in options['paths']:
+    return None
+
+  tasks = options['tasks']
+  if tasks is None:
+    tasks = [task for task, keys in TASK_ACTIVATIONS.items() if all(key in activations for key in keys)]
+  for task in tasks:
+    missing = [key for key in TASK_ACTIVATIONS[task] if key not in activations]
+    if missing:
+      raise ValueError(f'The cached outputs of {path} do not have the {missing} probabilities needed by {task}.')
+
+  hints = options['metrical_hints']
+  return postprocess_activations(
+    path, activations, options['cfg'], options['include_activations'], False, tasks, options['out_dir'],
+    options['metrical_postprocessor'], hints.get(str(path), hints.get(path.name)),
+  )
+
+
+def _write_atomically(path: Path, write):
+  # Concurrent readers never see a partial file.
+  tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+  with open(tmp_path, 'wb') as f:
+    write(f)
+  os.replace(tmp_path, path)
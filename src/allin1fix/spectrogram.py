@@ -9,6 +9,29 @@ from madmom.processors import SequentialProcessor
 from madmom.audio.spectrogram import FilteredSpectrogramProcessor, LogarithmicSpectrogramProcessor
 
 
+SAMPLE_RATE = 44100
+FRAME_SIZE = 2048
+HOP_SIZE = 441
+STEM_NAMES = ['bass', 'drums', 'other', 'vocals']
+
+
+def make_spectrogram_processor() -> SequentialProcessor:
+  # Define a pre-processing chain, which is copied from madmom.
+  frames = FramedSignalProcessor(
+    frame_size=FRAME_SIZE,
+    fps=int(SAMPLE_RATE / HOP_SIZE)
+  )
+  stft = ShortTimeFourierTransformProcessor()  # caching FFT window
+  filt = FilteredSpectrogramProcessor(
+    num_bands=12,
+    fmin=30,
+    fmax=17000,
+    norm_filters=True
+  )
+  spec = LogarithmicSpectrogramProcessor(mul=1, add=1)
+  return SequentialProcessor([frames, stft, filt, spec])
+
+
 def extract_spectrograms(demix_paths: List[Path], spec_dir: Path, multiprocess: bool = True):
   todos = []
   spec_paths = []
@@ -23,20 +46,7 @@ def extract_spectrograms(demix_paths: List[Path], spec_dir: Path, multiprocess:
   print(f'=> Found {existing} spectrograms already extracted, {len(todos)} to extract.')
 
   if todos:
-    # Define a pre-processing chain, which is copied from madmom.
-    frames = FramedSignalProcessor(
-      frame_size=2048,
-      fps=int(44100 / 441)
-    )
-    stft = ShortTimeFourierTransformProcessor()  # caching FFT window
-    filt = FilteredSpectrogramProcessor(
-      num_bands=12,
-      fmin=30,
-      fmax=17000,
-      norm_filters=True
-    )
-    spec = LogarithmicSpectrogramProcessor(mul=1, add=1)
-    processor = SequentialProcessor([frames, stft, filt, spec])
+    processor = make_spectrogram_processor()
 
     # Process all tracks using multiprocessing.
     if multiprocess:
@@ -72,22 +72,41 @@ class StemProvider(ABC):
 
 
 class DemucsProvider(StemProvider):
-    """Default stem provider using integrated separation module with model caching."""
+    """
+    Default stem provider using integrated separation module with model caching.
+
+    With ``share_memory=True``, the model is loaded right away and its weights are moved to shared memory (on CPU),
+    so that worker processes receiving this provider, e.g. through ``torch.multiprocessing``, attach to the same
+    weights instead of loading their own copy.
+    """
 
-    def __init__(self, model_name: str = 'htdemucs', device: Union[str, torch.device] = 'cuda'):
+    def __init__(
+        self,
+        model_name: str = 'htdemucs',
+        device: Union[str, torch.device] = 'cuda',
+        share_memory: bool = False,
+    ):
         self.model_name = model_name
         self.device = device
+        self.share_memory = share_memory
         self._model = None  # Cache for loaded model
+        if share_memory:
+            self._load_model()
 
     @property
     def model(self):
         """Lazy-load and cache the separation model."""
         if self._model is None:
-            self._model = get_model(self.model_name)
-            self._model = self._model.to(self.device)
-            self._model.eval()  # Freeze batch norm, dropout for inference
+            self._load_model()
         return self._model
 
+    def _load_model(self):
+        self._model = get_model(self.model_name)
+        self._model = self._model.to(self.device)
+        self._model.eval()  # Freeze batch norm, dropout for inference
+        if self.share_memory:
+            self._model.share_memory()
+
     def clear_model_cache(self):
         """Clear cached model to free memory."""
         if self._model is not None:
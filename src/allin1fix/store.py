@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+from itertools import count
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+from .helpers import save_results
+from .typings import AnalysisResult, PathLike, Segment
+from .utils import mkpath
+
+PARTITION_KEY = 'part'
+# Settings of the store, ignored by Parquet readers thanks to the leading underscore.
+METADATA_NAME = '_store.json'
+
+
+def _import_pyarrow():
+  try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+  except ImportError:
+    raise ImportError(
+      'The result store requires pyarrow. Please install it with: pip install allin1fix[store]'
+    )
+  return pyarrow
+
+
+def result_schema():
+  """Arrow schema of the result store: one row per appended result."""
+  pa = _import_pyarrow()
+  return pa.schema([
+    ('key', pa.string()),
+    ('path', pa.string()),
+    ('content_hash', pa.string()),
+    ('bpm', pa.int64()),
+    ('beats', pa.list_(pa.float64())),
+    ('downbeats', pa.list_(pa.float64())),
+    ('beat_positions', pa.list_(pa.int64())),
+    ('segments', pa.list_(pa.struct([('start', pa.float64()), ('end', pa.float64()), ('label', pa.string())]))),
+    ('written_at', pa.int64()),
+  ])
+
+
+class ResultStore:
+  """
+  Corpus-level store of analysis results in a columnar Parquet dataset, as an alternative to one JSON file per
+  track for corpora of millions of tracks.
+
+  Results are buffered and written in batches, one file per partition and batch, under ``root/part=<n>/``.
+  Each result goes to a partition chosen by a hash of its key (its path by default), so that loading a result
+  only reads the files of its partition, and the rows of every file are sorted by key, so that Parquet statistics
+  skip most of their row groups. Beats, downbeats, beat positions and segments are list columns that can be
+  processed without building any Python object, e.g. with ``pyarrow.compute``. Activations and embeddings
+  are not stored.
+
+  A result appended again under the same key is kept next to the previous one; ``load_result`` returns the latest
+  and ``compact`` removes the others.
+
+  Parameters
+  ----------
+  root : PathLike
+      Directory of the dataset.
+  num_partitions : int, optional
+      Number of partitions of a new dataset. Default is 16. An existing dataset keeps its own.
+  batch_size : int, optional
+      Number of buffered results that triggers a write. Default is 4096.
+  """
+
+  def __init__(self, root: PathLike, num_partitions: int = 16, batch_size: int = 4096):
+    _import_pyarrow()
+    self.root = mkpath(root)
+    metadata_path = self.root / METADATA_NAME
+    if metadata_path.is_file():
+      num_partitions = json.loads(metadata_path.read_text())['num_partitions']
+    else:
+      self.root.mkdir(parents=True, exist_ok=True)
+      tmp_path = self.root / f'.{METADATA_NAME}.{os.getpid()}.tmp'
+      tmp_path.write_text(json.dumps({'version': 1, 'num_partitions': num_partitions}, indent=2))
+      os.replace(tmp_path, metadata_path)
+    self.num_partitions = num_partitions
+    self.batch_size = batch_size
+    self._buffer = []
+    self._counter = count()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.flush()
+
+  def append(
+    self,
+    results: Union[AnalysisResult, List[AnalysisResult]],
+    keys: Optional[List[str]] = None,
+    content_hashes: Optional[List[Optional[str]]] = None,
+  ):
+    """
+    Buffers results under the given keys (their paths by default), with the hashes of their contents if known,
+    and writes them once ``batch_size`` results are buffered.
+    """
+    if not isinstance(results, list):
+      results = [results]
+    keys = keys or [str(result.path) for result in results]
+    content_hashes = content_hashes or [None] * len(results)
+    written_at = time.time_ns()
+    for result, key, content_hash in zip(results, keys, content_hashes):
+      self._buffer.append({
+        'key': key,
+        'path': str(result.path),
+        'content_hash': content_hash,
+        'bpm': result.bpm,
+        'beats': list(result.beats),
+        'downbeats': list(result.downbeats),
+        'beat_positions': list(result.beat_positions),
+        'segments': [{'start': s.start, 'end': s.end, 'label': s.label} for s in result.segments],
+        'written_at': written_at,
+      })
+    if len(self._buffer) >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    """Writes the buffered results."""
+    if not self._buffer:
+      return
+    pa = _import_pyarrow()
+    rows_by_partition = {}
+    for row in self._buffer:
+      rows_by_partition.setdefault(self.partition(row['key']), []).append(row)
+
+    schema = result_schema()
+    for partition, rows in rows_by_partition.items():
+      rows.sort(key=lambda row: row['key'])
+      table = pa.Table.from_pylist(rows, schema=schema)
+      partition_dir = self.root / f'{PARTITION_KEY}={partition}'
+      partition_dir.mkdir(parents=True, exist_ok=True)
+      # Write atomically, so that a concurrent reader never sees a partial file.
+      name = f'{time.time_ns()}-{os.getpid()}-{next(self._counter)}.parquet'
+      tmp_path = partition_dir / f'.{name}.tmp'
+      pa.parquet.write_table(table, tmp_path)
+      os.replace(tmp_path, partition_dir / name)
+    self._buffer = []
+
+  def partition(self, key: str) -> int:
+    digest = hashlib.sha1(key.encode()).digest()
+    return int.from_bytes(digest[:4], 'little') % self.num_partitions
+
+  def dataset(self, partition: Optional[int] = None):
+    """Returns the ``pyarrow.dataset.Dataset`` of the store, or of one of its partitions."""
+    pa = _import_pyarrow()
+    root = self.root if partition is None else self.root / f'{PARTITION_KEY}={partition}'
+    if not root.is_dir():
+      return pa.dataset.dataset(result_schema().empty_table())
+    return pa.dataset.dataset(root, format='parquet', schema=result_schema())
+
+  def scan(self, columns: Optional[List[str]] = None, filter=None):
+    """
+    Returns a ``pyarrow.Table`` of the stored results, optionally restricted to some columns
+    and to the rows matching a ``pyarrow.dataset`` expression, e.g. ``pyarrow.dataset.field('bpm') > 120``.
+    """
+    self.flush()
+    return self.dataset().to_table(columns=columns, filter=filter)
+
+  def keys(self) -> List[str]:
+    return sorted(set(self.scan(columns=['key'])['key'].to_pylist()))
+
+  def load_result(self, key: str) -> AnalysisResult:
+    """Returns the latest result stored under ``key``."""
+    pa = _import_pyarrow()
+    self.flush()
+    table = self.dataset(self.partition(key)).to_table(filter=pa.dataset.field('key') == key)
+    if table.num_rows == 0:
+      raise KeyError(key)
+    return _row_to_result(_latest(table).to_pylist()[0])
+
+  def compact(self):
+    """Rewrites every partition into a single file, keeping only the latest result of every key."""
+    pa = _import_pyarrow()
+    self.flush()
+    for partition in range(self.num_partitions):
+      partition_dir = self.root / f'{PARTITION_KEY}={partition}'
+      old_files = sorted(partition_dir.glob('*.parquet'))
+      if len(old_files) <= 1:
+        continue
+      table = _latest(self.dataset(partition).to_table())
+      name = f'{time.time_ns()}-{os.getpid()}-{next(self._counter)}.parquet'
+      tmp_path = partition_dir / f'.{name}.tmp'
+      pa.parquet.write_table(table, tmp_path)
+      os.replace(tmp_path, partition_dir / name)
+      for old_file in old_files:
+        old_file.unlink()
+
+  def export_json(self, out_dir: PathLike, keys: Optional[Iterable[str]] = None) -> List[Path]:
+    """Writes the latest result of every key (or of the given keys) as the per-track JSON files of ``analyze``."""
+    if keys is None:
+      results = [_row_to_result(row) for row in _latest(self.scan()).to_pylist()]
+    else:
+      results = [self.load_result(key) for key in keys]
+    save_results(results, out_dir)
+    return [mkpath(out_dir) / result.path.with_suffix('.json').name for result in results]
+
+
+def _latest(table):
+  # The latest row of every key, sorted by key.
+  table = table.sort_by([('key', 'ascending'), ('written_at', 'descending')])
+  keys = table['key'].to_numpy(zero_copy_only=False)
+  return table.filter(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else table
+
+
+def _row_to_result(row: dict) -> AnalysisResult:
+  return AnalysisResult(
+    path=Path(row['path']),
+    bpm=row['bpm'],
+    beats=row['beats'],
+    downbeats=row['downbeats'],
+    beat_positions=row['beat_positions'],
+    segments=[Segment(**segment) for segment in row['segments']],
+  )
@@ -0,0 +1,269 @@
+import time
+import numpy as np
+import soundfile as sf
+import torch
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, Optional, Union
+from madmom.audio.signal import FramedSignal, Signal
+from madmom.processors import SequentialProcessor
+from .models import load_pretrained_model
+from .postprocessing.metrical import IncrementalDBNDecoder, compute_dbn_activations
+from .spectrogram import SAMPLE_RATE, FRAME_SIZE, HOP_SIZE, STEM_NAMES, make_spectrogram_processor
+from .typings import PathLike
+
+StemsChunk = Union[np.ndarray, Mapping[str, np.ndarray]]
+
+
+class StreamingSpectrogram:
+  """
+  Computes the spectrograms of stems that arrive in chunks, with the same frames as ``extract_spectrograms``:
+  frame k is centered at sample k * HOP_SIZE and is computed as soon as its whole window has been received.
+  """
+
+  def __init__(self):
+    self.processor = SequentialProcessor(make_spectrogram_processor().processors[1:])
+    self.reset()
+
+  def reset(self):
+    self.buffer = None  # received samples that are still needed, shape of (stems, samples)
+    self.buffer_start = -(FRAME_SIZE // 2)  # sample index of the first buffered sample (the first frame is padded)
+    self.num_samples = 0
+    self.num_frames = 0
+
+  def push(self, stems: StemsChunk) -> np.ndarray:
+    """Adds samples of each stem and returns the spectrograms of the new complete frames (stems, frames, bins)."""
+    stems = to_mono(stems)
+    if self.buffer is None:
+      self.buffer = np.zeros((len(stems), FRAME_SIZE // 2), dtype=stems.dtype)
+    self.buffer = np.concatenate([self.buffer, stems], axis=1)
+    self.num_samples += stems.shape[1]
+
+    num_frames = (self.num_samples - FRAME_SIZE // 2) // HOP_SIZE + 1 if self.num_samples >= FRAME_SIZE // 2 else 0
+    return self._compute(num_frames - self.num_frames)
+
+  def finish(self) -> np.ndarray:
+    """Returns the spectrograms of the last frames, padded with zeros like madmom does at the end of a signal."""
+    num_frames = int(np.ceil(self.num_samples / HOP_SIZE))
+    return self._compute(num_frames - self.num_frames)
+
+  def _compute(self, num_frames: int) -> np.ndarray:
+    if self.buffer is None or num_frames <= 0:
+      return np.zeros((len(STEM_NAMES), 0, 81), dtype=np.float32)
+
+    offset = self.num_frames * HOP_SIZE - FRAME_SIZE // 2 - self.buffer_start
+    specs = []
+    for stem in self.buffer:
+      signal = Signal(stem[offset:], sample_rate=SAMPLE_RATE)
+      frames = FramedSignal(signal, frame_size=FRAME_SIZE, hop_size=HOP_SIZE, origin='stream', num_frames=num_frames)
+      specs.append(np.asarray(self.processor(frames)))
+    self.num_frames += num_frames
+
+    # Drop the samples that no future frame needs.
+    start = self.num_frames * HOP_SIZE - FRAME_SIZE // 2 - self.buffer_start
+    self.buffer = self.buffer[:, start:]
+    self.buffer_start += start
+
+    return np.stack(specs)  # stems, frames, bins
+
+
+class StreamingAnalyzer:
+  """
+  Tracks beats and downbeats of stems that arrive incrementally, e.g. during a recording session.
+
+  The model runs on the last ``window`` seconds of the spectrogram every ``hop`` seconds. The activations of a frame
+  are final once the model has seen ``lookahead`` seconds after it, and are then decoded by an incremental DBN
+  that commits beats ``dbn_lag`` seconds later. A beat is therefore emitted at most
+  ``hop + lookahead + dbn_lag`` seconds after it was played (plus the processing time).
+
+  Parameters
+  ----------
+  model : str or torch.nn.Module, optional
+      Name of the pre-trained model or a loaded model. Default is 'harmonix-all'.
+  device : str, optional
+      Device to run the model on. Default is 'cuda' if available, otherwise 'cpu'.
+  window : float, optional
+      Length of the model input in seconds. Default is 30.
+  hop : float, optional
+      Interval between two model runs in seconds. Default is 1.
+  lookahead : float, optional
+      Future context the model needs before the activations of a frame are final, in seconds. Default is 2.
+  dbn_lag : float, optional
+      Delay of the incremental DBN before a beat is committed, in seconds. Default is 1.
+  cache_dir : PathLike, optional
+      Cache directory for the model checkpoints.
+  fuse : bool, optional
+      Whether to fuse the model for faster inference (see ``analyze``). Default is False.
+  """
+
+  def __init__(
+    self,
+    model: Union[str, torch.nn.Module] = 'harmonix-all',
+    device: Optional[str] = None,
+    window: float = 30.,
+    hop: float = 1.,
+    lookahead: float = 2.,
+    dbn_lag: float = 1.,
+    cache_dir: Optional[PathLike] = None,
+    fuse: bool = False,
+  ):
+    if isinstance(model, str):
+      model = load_pretrained_model(model, cache_dir, device, fuse=fuse)
+    self.model = model.eval()
+    self.device = next(self.model.parameters()).device
+    self.cfg = self.model.cfg
+
+    fps = self.cfg.fps
+    self.window = int(round(window * fps))
+    self.hop = int(round(hop * fps))
+    self.lookahead = int(round(lookahead * fps))
+    if self.hop < 1 or self.hop + 2 * self.lookahead > self.window:
+      raise ValueError(f'hop + 2 * lookahead ({hop + 2 * lookahead}s) must not exceed the window ({window}s).')
+
+    self.spectrogram = StreamingSpectrogram()
+    self.decoder = IncrementalDBNDecoder(
+      beats_per_bar=[3, 4],
+      threshold=self.cfg.best_threshold_downbeat,
+      fps=fps,
+      lag=int(round(dbn_lag * fps)),
+    )
+    self.reset()
+
+  def reset(self):
+    self.spectrogram.reset()
+    self.decoder.reset()
+    self.spec = np.zeros((len(STEM_NAMES), 0, self.cfg.dim_input), dtype=np.float32)
+    self.spec_start = 0  # frame index of self.spec[:, 0]
+    self.num_frames = 0  # spectrogram frames received so far
+    self.num_final = 0  # frames whose activations are final and were fed to the DBN
+    self.last_run = 0  # number of frames at the last model run
+    self.beats = []
+    self.downbeats = []
+    self.beat_positions = []
+
+  def push(self, stems: StemsChunk) -> Dict[str, List]:
+    """
+    Adds the next samples of the stems at 44.1kHz, either as an array of shape (stems, samples[, channels])
+    in the order bass, drums, other, vocals, or as a mapping from stem names to arrays.
+    Returns the newly committed beats, downbeats and beat positions.
+    """
+    self._append(self.spectrogram.push(stems))
+    if self.num_frames - self.last_run < self.hop:
+      return self._result(np.empty((0, 2)))
+    return self._result(self._process(final=False))
+
+  def finish(self) -> Dict[str, List]:
+    """
+    Processes the end of the stream and returns the remaining beats.
+    All the beats of the stream are then in ``beats``, ``downbeats`` and ``beat_positions``.
+    Call ``reset`` before analyzing another stream.
+    """
+    self._append(self.spectrogram.finish())
+    beats = self._process(final=True)
+    return self._result(np.concatenate([beats, self.decoder.finalize()]))
+
+  def follow(
+    self,
+    stems_dir: PathLike,
+    poll_interval: float = 0.5,
+    idle_timeout: float = 10.,
+  ) -> Iterator[Dict[str, List]]:
+    """
+    Follows the stem files (bass.wav, drums.wav, other.wav, vocals.wav) of a recording that is still being written,
+    only reading the samples appended since the last poll. Yields the newly committed beats after each poll, and
+    finishes the stream once the files have not grown for ``idle_timeout`` seconds.
+    """
+    tail = StemFileTail(stems_dir)
+    idle_since = time.monotonic()
+    while True:
+      stems = tail.read()
+      if stems is not None:
+        idle_since = time.monotonic()
+        yield self.push(stems)
+      elif time.monotonic() - idle_since >= idle_timeout:
+        break
+      else:
+        time.sleep(poll_interval)
+    yield self.finish()
+
+  def _append(self, spec: np.ndarray):
+    self.spec = np.concatenate([self.spec, spec], axis=1)
+    self.num_frames += spec.shape[1]
+
+  def _process(self, final: bool) -> np.ndarray:
+    self.last_run = self.num_frames
+    beats = [np.empty((0, 2))]
+    while True:
+      # Frames whose activations become final with this run. When catching up with a large chunk,
+      # several runs are needed, each keeping at least `lookahead` frames of past context.
+      stop = self.num_frames if final else self.num_frames - self.lookahead
+      stop = min(stop, self.num_final + self.window - 2 * self.lookahead)
+      if stop <= self.num_final:
+        break
+      end = min(stop + self.lookahead, self.num_frames)
+      start = max(0, end - self.window)
+
+      spec = self.spec[:, start - self.spec_start:end - self.spec_start]
+      spec = torch.from_numpy(spec).unsqueeze(0).to(self.device)
+      with torch.no_grad():
+        logits = self.model(spec, heads=['beat', 'downbeat'], output_embeddings=False)
+      activations = compute_dbn_activations(logits.logits_beat[0], logits.logits_downbeat[0])
+
+      beats.append(self.decoder.process(activations[self.num_final - start:stop - start]))
+      self.num_final = stop
+
+    # The next window starts at the earliest `window` frames before the end of the next final frames.
+    keep = max(self.spec_start, self.num_final + self.lookahead - self.window)
+    self.spec = self.spec[:, keep - self.spec_start:]
+    self.spec_start = keep
+    return np.concatenate(beats)
+
+  def _result(self, beats: np.ndarray) -> Dict[str, List]:
+    result = {
+      'beats': beats[:, 0].tolist(),
+      'downbeats': beats[beats[:, 1] == 1., 0].tolist(),
+      'beat_positions': beats[:, 1].astype('int').tolist(),
+    }
+    self.beats += result['beats']
+    self.downbeats += result['downbeats']
+    self.beat_positions += result['beat_positions']
+    return result
+
+
+class StemFileTail:
+  """Reads the samples appended to growing stem files since the last read."""
+
+  def __init__(self, stems_dir: PathLike):
+    self.paths = [Path(stems_dir) / f'{name}.wav' for name in STEM_NAMES]
+    self.position = 0
+
+  def read(self) -> Optional[np.ndarray]:
+    """Returns the new samples of shape (stems, samples, channels) available in all stems, or None."""
+    if not all(path.is_file() for path in self.paths):
+      return None
+
+    infos = [sf.info(str(path)) for path in self.paths]
+    available = min(info.frames for info in infos)
+    if available <= self.position:
+      return None
+
+    stems = []
+    for path, info in zip(self.paths, infos):
+      # madmom reads 16-bit files as integers, which are scaled when computing the spectrogram.
+      dtype = 'int16' if info.subtype == 'PCM_16' else 'float32'
+      data, _ = sf.read(str(path), start=self.position, stop=available, dtype=dtype, always_2d=True)
+      stems.append(data)
+    self.position = available
+    return np.stack(stems)
+
+
+def to_mono(stems: StemsChunk) -> np.ndarray:
+  """Converts a chunk of stems to mono arrays of shape (stems, samples), averaging channels as madmom does."""
+  if isinstance(stems, Mapping):
+    stems = np.stack([np.asarray(stems[name]) for name in STEM_NAMES])
+  stems = np.asarray(stems)
+  if stems.ndim == 3:
+    stems = np.mean(stems, axis=-1).astype(stems.dtype)
+  if stems.ndim != 2 or len(stems) != len(STEM_NAMES):
+    raise ValueError(f'Expected {len(STEM_NAMES)} stems of shape (samples[, channels]), got {stems.shape}.')
+  return stems
@@ -22,6 +22,11 @@ def collate_fn(raw_batch):
         'widen_true_beat', 'widen_true_downbeat', 'widen_true_section',
       ]:
         data[key] = value[:max_T]
+      elif key in ['teacher_beat', 'teacher_downbeat', 'teacher_section', 'teacher_function']:
+        value = value[..., :max_T]
+        T = value.shape[-1]
+        pad_width = [(0, 0)] * (value.ndim - 1) + [(0, max_T - T)]
+        data[key] = np.pad(value, pad_width, 'constant')
       elif key in ['spec']:
         T = raw_data[key].shape[1]
         spec = raw_data[key]
@@ -1,7 +1,7 @@
 import numpy as np
 
 from abc import ABC, abstractmethod
-from typing import Literal, List, Union
+from typing import Literal, List, Dict, Union
 from numpy.typing import NDArray
 from torch.utils.data import Dataset
 from ..utils import widen_temporal_events
@@ -45,6 +45,9 @@ class DatasetBase(Dataset, ABC):
   ) -> DatasetConverter:
     pass
 
+  def load_teacher_logits(self, track_id: str) -> Dict[str, NDArray]:
+    raise NotImplementedError(f'{type(self).__name__} does not support distillation')
+
   def __len__(self):
     return len(self.track_ids)
 
@@ -100,7 +103,7 @@ class DatasetBase(Dataset, ABC):
       true_downbeat_times -= start
       true_section_times -= start
 
-    return dict(
+    data = dict(
       track_key=track_id,
       spec=spec,
 
@@ -118,3 +121,10 @@ class DatasetBase(Dataset, ABC):
       true_section_times=true_section_times.tolist(),
       true_function_list=true_function_list.tolist(),
     )
+
+    if getattr(self.cfg, 'distill', False):
+      teacher_logits = self.load_teacher_logits(track_id)
+      for key, logits in teacher_logits.items():
+        data[f'teacher_{key}'] = logits[..., start_frame:end_frame].astype('float32')
+
+    return data
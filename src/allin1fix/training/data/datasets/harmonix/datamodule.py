@@ -2,6 +2,7 @@ from lightning import LightningDataModule
 from torch.utils.data import DataLoader
 from .dataset import HarmonixDataset
 from ..collate import collate_fn
+from ....distill import check_teacher_logits
 from .....config import Config
 
 
@@ -17,6 +18,8 @@ class HarmonixDataModule(LightningDataModule):
   def setup(self, stage: str):
     if stage == 'fit':
       self.dataset_train = HarmonixDataset(self.cfg, split='train')
+      if getattr(self.cfg, 'distill', False):
+        check_teacher_logits(self.cfg)
       # if self.cfg.debug:
       #   self.dataset_train = Subset(self.dataset_train, range(1))
     
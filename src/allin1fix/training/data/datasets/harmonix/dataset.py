@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 
 from pathlib import Path
-from typing import Literal, Union
+from typing import Literal, Dict, Union
 from numpy.typing import NDArray
 from ..datasetbase import DatasetBase
 from ...utils import widen_temporal_events
@@ -43,6 +43,7 @@ class HarmonixDataset(DatasetBase):
       Path(cfg.data.path_feature_dir) if cfg.data.demixed
       else Path(cfg.data.path_no_demixed_feature_dir)
     )
+    self.teacher_dir = Path(cfg.data.path_teacher_dir) if cfg.data.path_teacher_dir else None
     self.df = df
   
   @property
@@ -52,6 +53,12 @@ class HarmonixDataset(DatasetBase):
   def load_features(self, track_id: str) -> NDArray:
     return np.load(self.feature_dir / f'{track_id}.npy')
   
+  def load_teacher_logits(self, track_id: str) -> Dict[str, NDArray]:
+    if self.teacher_dir is None:
+      raise ValueError('data.path_teacher_dir must be set for distillation')
+    with np.load(self.teacher_dir / f'{track_id}.npz') as teacher_logits:
+      return {key: teacher_logits[key] for key in teacher_logits.files}
+  
   def create_converter(
     self,
     index: int,
@@ -0,0 +1,109 @@
+import json
+import warnings
+import hydra
+import numpy as np
+import torch
+
+from pathlib import Path
+from typing import List, Optional
+from tqdm import tqdm
+from ..config import Config
+from ..models import load_pretrained_model
+from ..models.loaders import ENSEMBLE_MODELS
+from ..utils import mkpath
+
+# Teacher the logits of a teacher directory were computed with.
+TEACHER_INFO_NAME = 'teacher.json'
+
+
+@hydra.main(version_base=None, config_name='config')
+def main(cfg: Config):
+  device = 'cuda' if torch.cuda.is_available() else 'cpu'
+  feature_dir = mkpath(cfg.data.path_feature_dir if cfg.data.demixed else cfg.data.path_no_demixed_feature_dir)
+  teacher_dir = mkpath(cfg.data.path_teacher_dir)
+
+  teacher_model, held_out_fold = select_teacher_model(cfg)
+  model = load_pretrained_model(teacher_model, device=device)
+  feature_paths = sorted(feature_dir.glob('*.npy'))
+  cache_teacher_logits(model, feature_paths, teacher_dir, device, teacher_model, held_out_fold)
+
+  print(f'Caching teacher logits of {teacher_model} finished. {len(feature_paths)} tracks saved in {teacher_dir}.')
+
+
+def select_teacher_model(cfg: Config):
+  """
+  Returns the name of the teacher model for a student trained on ``cfg.fold``, and that fold if the teacher
+  was trained on neither its validation nor its test tracks (None otherwise).
+  The folds of a pretrained ensemble were trained with the same splits as the student, so every fold but the
+  student's own was trained on some of these tracks, whose teacher logits would leak their annotations.
+  The ensemble is therefore replaced by its member of the student's fold.
+  """
+  if cfg.teacher_model in ENSEMBLE_MODELS:
+    return ENSEMBLE_MODELS[cfg.teacher_model][cfg.fold], cfg.fold
+  return cfg.teacher_model, None
+
+
+def check_teacher_logits(cfg: Config):
+  """
+  Warns if the cached teacher logits of ``cfg.data.path_teacher_dir`` were not computed by a teacher held out
+  on the validation and test tracks of ``cfg.fold``, in which case the validation metrics are optimistic.
+  """
+  if cfg.data.path_teacher_dir is None:
+    return
+  info_path = mkpath(cfg.data.path_teacher_dir) / TEACHER_INFO_NAME
+  info = json.loads(info_path.read_text()) if info_path.is_file() else {}
+  if info.get('held_out_fold') != cfg.fold:
+    warnings.warn(
+      f'The teacher logits in {cfg.data.path_teacher_dir} come from {info.get("model", "an unknown model")}, '
+      f'which is not held out on the validation and test tracks of fold {cfg.fold}: they leak the annotations '
+      f'of these tracks into the distillation. Cache them again with allin1fix-distill fold={cfg.fold}.',
+      stacklevel=2,
+    )
+
+
+def cache_teacher_logits(
+  model: torch.nn.Module,
+  feature_paths: List[Path],
+  teacher_dir: Path,
+  device: str = 'cpu',
+  model_name: Optional[str] = None,
+  held_out_fold: Optional[int] = None,
+):
+  """
+  Runs the teacher model on each spectrogram and saves its logits to ``teacher_dir/{track_id}.npz``,
+  which are used as soft targets when training with ``distill=true``.
+  The name of the teacher and the student fold it is held out on (see ``select_teacher_model``) are saved
+  next to them. Logits cached by another teacher are computed again.
+  """
+  teacher_dir.mkdir(parents=True, exist_ok=True)
+  model.eval()
+
+  info = {'model': model_name, 'held_out_fold': held_out_fold}
+  info_path = teacher_dir / TEACHER_INFO_NAME
+  reuse = info_path.is_file() and json.loads(info_path.read_text()) == info
+
+  with torch.no_grad():
+    for feature_path in tqdm(feature_paths, desc='Caching teacher logits'):
+      dst = teacher_dir / f'{feature_path.stem}.npz'
+      if reuse and dst.is_file():
+        continue
+
+      spec = np.load(feature_path)
+      spec = torch.from_numpy(spec).unsqueeze(0).to(device)
+      logits = model(spec)
+
+      # float16 is precise enough for soft targets and halves the cache size.
+      np.savez(
+        str(dst),
+        beat=logits.logits_beat[0].cpu().numpy().astype('float16'),
+        downbeat=logits.logits_downbeat[0].cpu().numpy().astype('float16'),
+        section=logits.logits_section[0].cpu().numpy().astype('float16'),
+        function=logits.logits_function[0].cpu().numpy().astype('float16'),
+      )
+
+  # Written last, so that the logits of an interrupted run are all computed again by the next one.
+  info_path.write_text(json.dumps(info, indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,5 +1,4 @@
 import numpy as np
-import torch.nn.functional as F
 
 import ast
 import torch
@@ -11,6 +10,7 @@ from omegaconf import DictConfig
 from numpy.typing import NDArray
 from madmom.evaluation.beats import BeatEvaluation, BeatMeanEvaluation
 from ..config import Config
+from ..postprocessing.kernels import local_maxima
 from ..typings import AllInOnePrediction
 
 
@@ -72,37 +72,6 @@ def event_frames_to_time(
   return times
 
 
-def local_maxima(tensor, filter_size=41):
-  assert len(tensor.shape) in (1, 2), 'Input tensor should have 1 or 2 dimensions'
-  assert filter_size % 2 == 1, 'Filter size should be an odd number'
-
-  original_shape = tensor.shape
-  if len(original_shape) == 1:
-    tensor = tensor.unsqueeze(0)
-
-  # Pad the input array with the minimum value
-  padding = filter_size // 2
-  padded_arr = F.pad(tensor, (padding, padding), mode='constant', value=-torch.inf)
-
-  # Create a rolling window view of the padded array
-  rolling_view = padded_arr.unfold(1, filter_size, 1)
-
-  # Find the indices of the local maxima
-  center = filter_size // 2
-  local_maxima_mask = torch.eq(rolling_view[:, :, center], torch.max(rolling_view, dim=-1).values)
-  local_maxima_indices = local_maxima_mask.nonzero()
-
-  # Initialize a new PyTorch tensor with zeros and the same shape as the input tensor
-  output_arr = torch.zeros_like(tensor)
-
-  # Set the local maxima values in the output tensor
-  output_arr[local_maxima_mask] = tensor[local_maxima_mask]
-
-  output_arr = output_arr.reshape(original_shape)
-
-  return output_arr, local_maxima_indices
-
-
 def find_best_thresholds(predict_outputs, cfg: Config):
   probs_beat, trues_beat = [], []
   probs_downbeat, trues_downbeat = [], []
@@ -24,6 +24,9 @@ warnings.filterwarnings('ignore', category=UserWarning, message='Not enough beat
 warnings.filterwarnings('ignore', category=UserWarning, message='The epoch parameter')
 warnings.filterwarnings('ignore', category=UserWarning, message='no annotated tempo strengths given')
 
+# Soft targets of the teacher model, added to the batches by the datasets when distillation is enabled.
+TEACHER_KEYS = ['teacher_beat', 'teacher_downbeat', 'teacher_section', 'teacher_function']
+
 
 class AllInOneTrainer(LightningModule):
   scheduler: Scheduler
@@ -168,10 +171,69 @@ class AllInOneTrainer(LightningModule):
       loss_section=loss_section,
       loss_function=loss_function,
     )
+
+    if getattr(self.cfg, 'distill', False):
+      missing_keys = [key for key in TEACHER_KEYS if key not in batch]
+      if missing_keys:
+        raise ValueError(f'Distillation is enabled but the batch has no teacher logits: {missing_keys}')
+      distill_losses = self.compute_distillation_losses(outputs, batch)
+      loss_distill = 0.0
+      if self.cfg.learn_rhythm:
+        loss_distill += distill_losses['loss_distill_beat'] + distill_losses['loss_distill_downbeat']
+      if self.cfg.learn_structure:
+        if self.cfg.learn_label:
+          loss_distill += distill_losses['loss_distill_function']
+        if self.cfg.learn_segment:
+          loss_distill += distill_losses['loss_distill_section']
+      loss_distill *= self.cfg.loss_weight_distill
+
+      losses.update(
+        loss=loss + loss_distill,
+        loss_distill=loss_distill,
+        **distill_losses,
+      )
+
     if prefix:
       losses = prefix_dict(losses, prefix)
     return losses
 
+  def compute_distillation_losses(self, outputs: AllInOneOutput, batch: Dict):
+    """
+    Losses against the soft predictions of the teacher, softened by ``distill_temperature``.
+    Following Hinton et al. (2015), the losses are scaled by the squared temperature.
+    """
+    t = self.cfg.distill_temperature
+
+    loss_beat = F.binary_cross_entropy_with_logits(
+      outputs.logits_beat / t, torch.sigmoid(batch['teacher_beat'] / t),
+      reduction='none',
+    )
+    loss_downbeat = F.binary_cross_entropy_with_logits(
+      outputs.logits_downbeat / t, torch.sigmoid(batch['teacher_downbeat'] / t),
+      reduction='none',
+    )
+    loss_section = F.binary_cross_entropy_with_logits(
+      outputs.logits_section / t, torch.sigmoid(batch['teacher_section'] / t),
+      reduction='none',
+    )
+    loss_function = F.cross_entropy(
+      outputs.logits_function / t, torch.softmax(batch['teacher_function'] / t, dim=1),
+      reduction='none',
+    )
+
+    scale = t ** 2
+    loss_beat = torch.mean(batch['mask'] * loss_beat) * scale * self.cfg.loss_weight_beat
+    loss_downbeat = torch.mean(batch['mask'] * loss_downbeat) * scale * self.cfg.loss_weight_downbeat
+    loss_section = torch.mean(batch['mask'] * loss_section) * scale * self.cfg.loss_weight_section
+    loss_function = torch.mean(batch['mask'] * loss_function) * scale * self.cfg.loss_weight_function
+
+    return dict(
+      loss_distill_beat=loss_beat,
+      loss_distill_downbeat=loss_downbeat,
+      loss_distill_section=loss_section,
+      loss_distill_function=loss_function,
+    )
+
   def compute_predictions(self, outputs: AllInOneOutput, mask=None):
     raw_prob_beats = torch.sigmoid(outputs.logits_beat.detach())
     raw_prob_downbeats = torch.sigmoid(outputs.logits_downbeat.detach())
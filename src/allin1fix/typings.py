@@ -4,7 +4,7 @@ import json
 
 from os import PathLike
 from pathlib import Path
-from typing import List, Dict, Optional, Union
+from typing import List, Mapping, Optional, Tuple, Union
 from dataclasses import dataclass
 from numpy.typing import NDArray
 
@@ -18,6 +18,10 @@ class AllInOneOutput:
   logits_section: torch.FloatTensor = None
   logits_function: torch.FloatTensor = None
   embeddings: torch.FloatTensor = None
+  # Number of ensemble members that contributed to the logits (None for a single model).
+  num_models: Optional[int] = None
+  # Outputs of every encoder level, only returned with output_hidden_states=True.
+  hidden_states: Optional[List[torch.FloatTensor]] = None
 
 
 @dataclass
@@ -27,6 +31,100 @@ class Segment:
   label: str
 
 
+@dataclass
+class MetricalHint:
+  """
+  Prior knowledge about the tempo and meter of a track, e.g. from catalog metadata, used to narrow the DBN.
+  ``bpm`` is an exact tempo (allowing a small tolerance) or a (min, max) range, and ``beats_per_bar``
+  a number of beats per bar or a list of them. Fields left to None keep the default model.
+  """
+  bpm: Optional[Union[float, Tuple[float, float]]] = None
+  beats_per_bar: Optional[Union[int, List[int]]] = None
+
+
+class LazyActivations(Mapping):
+  """
+  Activations saved in a ``.activ.npz`` file, read key by key on first access. The file is only opened
+  when an activation or the list of keys is needed, and closed right after.
+  """
+
+  def __init__(self, path: PathLike):
+    self.path = Path(path)
+    self._keys = None
+    self._arrays = {}
+
+  def _files(self) -> List[str]:
+    if self._keys is None:
+      with np.load(self.path) as data:
+        self._keys = list(data.files)
+    return self._keys
+
+  def __getitem__(self, key: str) -> NDArray:
+    if key not in self._arrays:
+      if key not in self._files():
+        raise KeyError(key)
+      with np.load(self.path) as data:
+        self._arrays[key] = data[key]
+    return self._arrays[key]
+
+  def __iter__(self):
+    return iter(self._files())
+
+  def __len__(self) -> int:
+    return len(self._files())
+
+  def __repr__(self) -> str:
+    return f'{type(self).__name__}({str(self.path)!r})'
+
+
+class LazyEmbeddings:
+  """
+  Embeddings saved in a ``.embed.npy`` file, read on first access. The file is only opened to read the
+  shape and dtype from its header, or the whole array, and closed right after. Behaves as an array for NumPy.
+  """
+
+  def __init__(self, path: PathLike):
+    self.path = Path(path)
+    self._header = None
+    self._array = None
+
+  def _read_header(self):
+    if self._header is None:
+      with open(self.path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+          shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+          shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+      self._header = shape, dtype
+    return self._header
+
+  def load(self) -> NDArray:
+    if self._array is None:
+      self._array = np.load(self.path)
+    return self._array
+
+  @property
+  def shape(self) -> Tuple[int, ...]:
+    return self._array.shape if self._array is not None else self._read_header()[0]
+
+  @property
+  def dtype(self) -> np.dtype:
+    return self._array.dtype if self._array is not None else self._read_header()[1]
+
+  def __array__(self, dtype=None, copy=None):
+    return np.asarray(self.load(), dtype=dtype)
+
+  def __getitem__(self, key):
+    return self.load()[key]
+
+  def __len__(self) -> int:
+    return self.shape[0]
+
+  def __repr__(self) -> str:
+    return f'{type(self).__name__}({str(self.path)!r})'
+
+
 @dataclass
 class AnalysisResult:
   path: Path
@@ -35,8 +133,11 @@ class AnalysisResult:
   downbeats: List[float]
   beat_positions: List[int]
   segments: List[Segment]
-  activations: Optional[Dict[str, NDArray]] = None
-  embeddings: Optional[NDArray] = None
+  activations: Optional[Mapping[str, NDArray]] = None
+  embeddings: Optional[Union[NDArray, LazyEmbeddings]] = None
+  # Number of ensemble models evaluated for the track, e.g. fewer than all folds with ensemble_tolerance
+  # (None for a single model).
+  num_models: Optional[int] = None
 
   @staticmethod
   def from_json(
@@ -57,18 +158,20 @@ class AnalysisResult:
       downbeats=data['downbeats'],
       beat_positions=data['beat_positions'],
       segments=[Segment(**seg) for seg in data['segments']],
+      num_models=data.get('num_models'),
     )
 
+    # Nothing is read until accessed: activations are loaded key by key and embeddings as a whole, so that
+    # no file stays open however many results are loaded.
     if load_activations:
       activ_path = path.with_suffix('.activ.npz')
       if activ_path.is_file():
-        activs = np.load(activ_path)
-        result.activations = {key: activs[key] for key in activs.files}
+        result.activations = LazyActivations(activ_path)
 
     if load_embeddings:
       embed_path = path.with_suffix('.embed.npy')
       if embed_path.is_file():
-        result.embeddings = np.load(embed_path)
+        result.embeddings = LazyEmbeddings(embed_path)
 
     return result
 
@@ -1,8 +1,21 @@
+import hashlib
 import re
 
+from json.encoder import encode_basestring_ascii
 from pathlib import Path
 from .typings import PathLike, AnalysisResult
 
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# A number array as put on one line by compact_json_number_array: at least two non-negative numbers
+# written without exponent.
+COMPACT_NUMBER_ARRAY = re.compile(r'\[\d+(\.\d+)?(,\d+(\.\d+)?)+\]')
+# Unlike json, orjson writes the floats in [1e-5, 1e-4) without exponent.
+ORJSON_SMALL_FLOAT = re.compile(r'[\[,]0\.0000')
+
 
 def compact_json_number_array(json_str: str):
   """Compact numbers (including floats) in JSON arrays to be on the same line."""
@@ -13,10 +26,117 @@ def compact_json_number_array(json_str: str):
   )
 
 
+def dumps_json(obj, indent: int = 2) -> str:
+  """
+  Same as ``compact_json_number_array(json.dumps(obj, indent=indent))``, in a single pass: number arrays are
+  written on one line, and the other arrays and the objects are indented. Number arrays are encoded with orjson
+  if it is installed.
+  """
+  chunks = []
+  _encode_json(obj, chunks, ' ' * indent, '\n')
+  return ''.join(chunks)
+
+
+def _encode_json(obj, chunks: list, indent: str, newline: str):
+  # Follows json.encoder._make_iterencode for the types supported by json.dumps.
+  if isinstance(obj, str):
+    chunks.append(encode_basestring_ascii(obj))
+  elif obj is None:
+    chunks.append('null')
+  elif obj is True:
+    chunks.append('true')
+  elif obj is False:
+    chunks.append('false')
+  elif isinstance(obj, int):
+    chunks.append(int.__repr__(obj))
+  elif isinstance(obj, float):
+    chunks.append(_encode_float(obj))
+  elif isinstance(obj, (list, tuple)):
+    if not obj:
+      chunks.append('[]')
+      return
+    compact = _encode_number_array(obj)
+    if compact is not None:
+      chunks.append(compact)
+      return
+    inner = newline + indent
+    chunks.append('[')
+    for i, item in enumerate(obj):
+      chunks.append(inner if i == 0 else ',' + inner)
+      _encode_json(item, chunks, indent, inner)
+    chunks.append(newline + ']')
+  elif isinstance(obj, dict):
+    if not obj:
+      chunks.append('{}')
+      return
+    inner = newline + indent
+    chunks.append('{')
+    for i, (key, value) in enumerate(obj.items()):
+      chunks.append(inner if i == 0 else ',' + inner)
+      chunks.append(encode_basestring_ascii(_encode_key(key)))
+      chunks.append(': ')
+      _encode_json(value, chunks, indent, inner)
+    chunks.append(newline + '}')
+  else:
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+
+def _encode_float(value: float) -> str:
+  if value != value:
+    return 'NaN'
+  if value == float('inf'):
+    return 'Infinity'
+  if value == -float('inf'):
+    return '-Infinity'
+  return float.__repr__(value)
+
+
+def _encode_key(key) -> str:
+  if isinstance(key, str):
+    return key
+  if key is None:
+    return 'null'
+  if key is True or key is False:
+    return 'true' if key else 'false'
+  if isinstance(key, int):
+    return int.__repr__(key)
+  if isinstance(key, float):
+    return _encode_float(key)
+  raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+
+
+def _encode_number_array(values) -> str:
+  """Returns the one-line encoding of ``values`` if compact_json_number_array would compact it, else None."""
+  if len(values) < 2 or not isinstance(values[0], (int, float)):
+    return None
+  if orjson is not None:
+    try:
+      encoded = orjson.dumps(values).decode()
+    except TypeError:  # e.g. numpy scalars, or integers beyond 64 bits
+      encoded = None
+    if encoded is not None and COMPACT_NUMBER_ARRAY.fullmatch(encoded) and not ORJSON_SMALL_FLOAT.search(encoded):
+      return encoded
+
+  if not all(isinstance(value, (int, float)) and value is not True and value is not False for value in values):
+    return None
+  encoded = '[' + ','.join([
+    float.__repr__(value) if isinstance(value, float) else int.__repr__(value) for value in values
+  ]) + ']'
+  return encoded if COMPACT_NUMBER_ARRAY.fullmatch(encoded) else None
+
+
 def mkpath(path: PathLike):
   return Path(path).expanduser().resolve()
 
 
+def compute_sha256(path: PathLike) -> str:
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      sha256.update(chunk)
+  return sha256.hexdigest()
+
+
 def load_result(
   path: PathLike,
   load_activations: bool = True,
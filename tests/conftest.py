@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import torch
+
+from omegaconf import OmegaConf
+from allin1fix.config import Config, HarmonixConfig
+from allin1fix.models import AllInOne
+
+
+def _make_activations(num_frames=1500, fps=100, seed=0):
+  rng = np.random.default_rng(seed)
+  acts = rng.uniform(0., 0.05, size=(num_frames, 2))
+  beats = np.arange(25, num_frames, fps // 2)  # 120 BPM
+  acts[beats, 0] = 0.8
+  acts[beats[::4], 1] = 0.9
+  acts[beats[::4], 0] = 0.05
+  return acts
+
+
+def _tiny_cfg(depth=2, threshold=0.2):
+  cfg = OmegaConf.structured(Config(data=HarmonixConfig()))
+  cfg.depth = depth
+  # Ensembles average the thresholds of their models, so they must be set.
+  cfg.best_threshold_beat = cfg.best_threshold_downbeat = threshold
+  return cfg
+
+
+def _tiny_model(seed=0, **kwargs):
+  cfg = _tiny_cfg(**kwargs)
+  torch.manual_seed(seed)
+  return AllInOne(cfg).eval()
+
+
+@pytest.fixture
+def make_activations():
+  """Returns a function making (T, 2) DBN activations of a track at 120 BPM in 4/4, with some noise."""
+  return _make_activations
+
+
+@pytest.fixture
+def tiny_cfg():
+  """Returns a function making the Harmonix config of a small model, by default 2 levels and thresholds of 0.2."""
+  return _tiny_cfg
+
+
+@pytest.fixture
+def tiny_model():
+  """Returns a function making an untrained model in eval mode from ``tiny_cfg``, initialized from ``seed``."""
+  return _tiny_model
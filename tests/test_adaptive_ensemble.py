@@ -0,0 +1,70 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+from omegaconf import OmegaConf
+from allin1fix import load_result
+from allin1fix.helpers import postprocess_activations, run_model
+from allin1fix.models.ensemble import Ensemble
+from allin1fix.typings import AllInOneOutput
+
+
+class ConstantModel(nn.Module):
+  """A fold whose logits are all equal to ``value``, counting its calls."""
+
+  def __init__(self, value: float):
+    super().__init__()
+    self.cfg = OmegaConf.create({'best_threshold_beat': 0.2, 'best_threshold_downbeat': 0.2})
+    self.value = value
+    self.num_calls = 0
+
+  def forward(self, x, heads=None, output_embeddings=True):
+    self.num_calls += 1
+    T = x.shape[2]
+    return AllInOneOutput(
+      logits_beat=torch.full((1, T), self.value),
+      logits_downbeat=torch.full((1, T), self.value),
+      logits_section=torch.full((1, T), self.value),
+      logits_function=torch.full((1, 10, T), self.value),
+      embeddings=torch.full((1, 4, T, 24), self.value),
+    )
+
+
+def test_adaptive_ensemble():
+  x = torch.zeros(1, 4, 100, 81)
+
+  # Identical folds agree as soon as the minimum number of models is reached.
+  models = [ConstantModel(1.) for _ in range(5)]
+  assert Ensemble(models, tolerance=1e-3)(x).num_models == 2
+  assert [model.num_calls for model in models] == [1, 1, 0, 0, 0]
+  assert Ensemble(models, tolerance=1e-3, min_models=4)(x).num_models == 4
+
+  # The third fold brings the running mean back to where it was: the change is within the tolerance.
+  models = [ConstantModel(value) for value in [0., 4., 2., -8., -8.]]
+  output = Ensemble(models, tolerance=1e-3)(x)
+  assert output.num_models == 3
+  assert [model.num_calls for model in models] == [1, 1, 1, 0, 0]
+  torch.testing.assert_close(output.logits_beat, torch.full((1, 100), 2.))
+  assert output.embeddings.shape == (1, 4, 100, 24, 3)
+
+  # Folds that keep disagreeing are all evaluated, as without a tolerance.
+  models = [ConstantModel(value) for value in [0., 4., -4., 4., -4.]]
+  assert Ensemble(models, tolerance=1e-3)(x).num_models == 5
+  assert Ensemble(models)(x).num_models == 5
+
+
+def test_adaptive_ensemble_num_models(tmp_path, tiny_cfg):
+  spec_path = tmp_path / 'track.npy'
+  np.save(spec_path, np.zeros((4, 100, 81), dtype=np.float32))
+  ensemble = Ensemble([ConstantModel(value) for value in [0., 4., 2., 2.]], tolerance=1e-3)
+  for _ in range(3):
+    activations = run_model(spec_path, ensemble, 'cpu', include_embeddings=False)
+    assert activations['num_models'] == 3
+  assert sorted(activations) == ['beat', 'dbn', 'downbeat', 'label', 'num_models', 'segment']
+
+  # The result of each track records how many folds were evaluated for it.
+  result = postprocess_activations(
+    tmp_path / 'track.wav', activations, tiny_cfg(), False, False, ['structure'], tmp_path / 'out',
+  )
+  assert result.num_models == 3
+  assert load_result(tmp_path / 'out' / 'track.json').num_models == 3
@@ -0,0 +1,35 @@
+import json
+import numpy as np
+
+from allin1fix import analyze
+
+
+def test_async_postprocessing(tmp_path, tiny_model):
+  model = tiny_model()
+
+  # Cached spectrograms skip the separation and extraction steps.
+  paths = []
+  for i, frames in enumerate([900, 300, 600]):
+    path = tmp_path / f'track{i}.wav'
+    path.touch()
+    paths.append(path)
+    (tmp_path / 'spec').mkdir(exist_ok=True)
+    np.save(tmp_path / 'spec' / f'track{i}.npy', np.random.rand(4, frames, 81).astype('float32'))
+
+  kwargs = dict(
+    model=model,
+    device='cpu',
+    spec_dir=tmp_path / 'spec',
+    demix_dir=tmp_path / 'demix',
+    skip_separation=True,
+    keep_byproducts=True,
+    multiprocess=False,
+  )
+  expected = analyze(paths, out_dir=tmp_path / 'inline', **kwargs)
+  actual = analyze(paths, out_dir=tmp_path / 'async', postprocess_workers=2, **kwargs)
+
+  assert [result.path for result in actual] == paths
+  assert actual == expected
+  for path in paths:
+    name = path.with_suffix('.json').name
+    assert json.loads((tmp_path / 'async' / name).read_text()) == json.loads((tmp_path / 'inline' / name).read_text())
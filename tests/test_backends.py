@@ -0,0 +1,57 @@
+import copy
+import pytest
+import torch
+
+from allin1fix.models import quantize_model
+from allin1fix.models.dinat import DinatLayer1d
+
+OUTPUT_KEYS = ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function', 'embeddings']
+
+
+def fused(model):
+  return model.to_inference()
+
+
+def padded(model):
+  for module in model.modules():
+    if isinstance(module, DinatLayer1d):
+      module.short_path = False
+  return model
+
+
+def chunked(model):
+  model.embeddings.chunk_size = 64
+  return model
+
+
+def batched(model):
+  def run(spec):
+    output = model(torch.cat([spec, torch.randn_like(spec)]))
+    for key in OUTPUT_KEYS:
+      setattr(output, key, getattr(output, key)[:1])
+    return output
+  return run
+
+
+def all_levels(model):
+  return lambda spec: model(spec, output_hidden_states=True)
+
+
+@pytest.mark.parametrize('variant, atol', [
+  (fused, 1e-5),
+  (padded, 1e-5),
+  (chunked, 1e-5),
+  (batched, 1e-5),
+  (all_levels, 0.),
+  (quantize_model, 0.25),
+])
+def test_backend_equivalence(tiny_model, variant, atol):
+  model = tiny_model(depth=5)
+  run = variant(copy.deepcopy(model))
+  for frames in [30, 250]:
+    spec = torch.randn(1, 4, frames, 81)
+    with torch.no_grad():
+      expected = model(spec)
+      actual = run(spec)
+    for key in OUTPUT_KEYS:
+      torch.testing.assert_close(getattr(actual, key), getattr(expected, key), rtol=0., atol=atol)
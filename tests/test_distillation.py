@@ -0,0 +1,118 @@
+import warnings
+import numpy as np
+import pytest
+import torch
+
+from omegaconf import OmegaConf
+
+lightning = pytest.importorskip('lightning')
+
+from allin1fix.config import Config, HarmonixConfig
+from allin1fix.models import AllInOne
+from allin1fix.training.data import HarmonixDataModule
+from allin1fix.training.data.datasets.collate import collate_fn
+from allin1fix.training.distill import cache_teacher_logits, select_teacher_model
+from allin1fix.training.trainer import AllInOneTrainer
+
+NUM_TRACKS = 8
+DURATION = 12  # seconds
+
+
+def make_synthetic_harmonix(base_dir):
+  """Creates a tiny Harmonix-like dataset with random spectrograms and a 120 BPM beat grid."""
+  for name in ['tracks', 'beats', 'segments', 'features']:
+    (base_dir / name).mkdir(parents=True)
+
+  rows = ['File,BPM']
+  for i in range(NUM_TRACKS):
+    track_id = f'{i:04d}_synthetic'
+    (base_dir / 'tracks' / f'{track_id}.mp3').touch()
+    rows.append(f'{track_id},120')
+
+    beats = [f'{t:.2f}\t{j % 4 + 1}' for j, t in enumerate(np.arange(0.5, DURATION, 0.5))]
+    (base_dir / 'beats' / f'{track_id}.txt').write_text('\n'.join(beats))
+    segments = ['0.0\tintro', '4.0\tverse', '8.0\tchorus', f'{DURATION - 0.5}\tend']
+    (base_dir / 'segments' / f'{track_id}.txt').write_text('\n'.join(segments))
+
+    spec = np.random.rand(4, DURATION * 100, 81).astype('float32')
+    np.save(base_dir / 'features' / f'{track_id}.npy', spec)
+
+  (base_dir / 'metadata.csv').write_text('\n'.join(rows))
+
+
+def make_config(base_dir):
+  data = HarmonixConfig(
+    path_base_dir=str(base_dir),
+    path_track_dir=str(base_dir / 'tracks'),
+    path_feature_dir=str(base_dir / 'features'),
+    path_metadata=str(base_dir / 'metadata.csv'),
+    path_teacher_dir=str(base_dir / 'teacher'),
+  )
+  cfg = OmegaConf.structured(Config(data=data))
+  cfg.sanity_check = True
+  cfg.sched = None
+  cfg.depth = 2
+  cfg.segment_size = 10
+  cfg.distill = True
+  cfg.distill_temperature = 2.
+  return cfg
+
+
+def test_distillation(tmp_path, monkeypatch):
+  # Reloading the best checkpoint at the end of fitting is not needed here.
+  monkeypatch.setattr(AllInOneTrainer, 'on_fit_end', lambda self: None)
+
+  make_synthetic_harmonix(tmp_path)
+  cfg = make_config(tmp_path)
+
+  # The fold of the ensemble held out on the validation and test tracks of the student is the teacher.
+  assert select_teacher_model(cfg) == ('harmonix-fold2', 2)
+  feature_paths = sorted((tmp_path / 'features').glob('*.npy'))
+  teacher = AllInOne(cfg)
+
+  # Logits of a teacher trained on these tracks leak their annotations.
+  cache_teacher_logits(teacher, feature_paths, tmp_path / 'teacher', model_name='harmonix-all')
+  with pytest.warns(UserWarning, match='not held out'):
+    HarmonixDataModule(cfg).setup('fit')
+
+  cache_teacher_logits(teacher, feature_paths, tmp_path / 'teacher', model_name='harmonix-fold2', held_out_fold=2)
+  assert len(list((tmp_path / 'teacher').glob('*.npz'))) == NUM_TRACKS
+
+  dm = HarmonixDataModule(cfg)
+  with warnings.catch_warnings():
+    warnings.filterwarnings('error', message='.*not held out')
+    dm.setup('fit')
+  batch = next(iter(dm.train_dataloader()))
+  T = batch['spec'].shape[2]
+  assert batch['teacher_beat'].shape == (1, T)
+  assert batch['teacher_function'].shape == (1, cfg.data.num_labels, T)
+
+  student = AllInOneTrainer(cfg)
+  losses = student.compute_losses(student(batch['spec']), batch)
+  assert torch.isfinite(losses['loss_distill'])
+  assert losses['loss'] > losses['loss_distill']
+  with pytest.raises(ValueError, match='teacher_beat'):
+    student.compute_losses(student(batch['spec']), {k: v for k, v in batch.items() if k != 'teacher_beat'})
+
+  trainer = lightning.Trainer(
+    accelerator='cpu',
+    max_epochs=1,
+    limit_train_batches=2,
+    limit_val_batches=0,
+    logger=False,
+    enable_checkpointing=False,
+  )
+  trainer.fit(student, datamodule=dm)
+  assert torch.isfinite(trainer.callback_metrics['train/loss'])
+
+
+def test_collate_teacher_logits():
+  # Teacher logits are cropped and padded to the longest spectrogram of the batch, like the labels.
+  raw_batch = [
+    dict(spec=np.zeros((4, T, 81)), teacher_beat=np.ones(T_teacher), teacher_function=np.ones((10, T_teacher)))
+    for T, T_teacher in [(50, 55), (40, 40)]
+  ]
+  batch = collate_fn(raw_batch)
+  assert batch['teacher_beat'].shape == (2, 50)
+  assert batch['teacher_function'].shape == (2, 10, 50)
+  assert batch['teacher_beat'][1, 40:].sum() == 0
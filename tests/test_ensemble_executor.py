@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import torch
+
+from allin1fix import analyze
+from allin1fix.models.ensemble import Ensemble, LOGIT_KEYS
+
+
+def test_ensemble_executor(tiny_model):
+  models = [tiny_model(seed) for seed in range(3)]
+  x = torch.randn(1, 4, 300, 81)
+  with torch.no_grad():
+    expected = Ensemble(models)(x)
+
+  for executor in ['threads', 'processes']:
+    ensemble = Ensemble(models, executor=executor, num_workers=2)
+    try:
+      with torch.no_grad():
+        actual = ensemble(x)
+        actual_beats = ensemble(x, heads=['beat'], output_embeddings=False)
+    finally:
+      ensemble.close()
+
+    for key in LOGIT_KEYS + ['embeddings']:
+      torch.testing.assert_close(getattr(actual, key), getattr(expected, key))
+    torch.testing.assert_close(actual_beats.logits_beat, expected.logits_beat)
+    assert actual_beats.logits_downbeat is None and actual_beats.embeddings is None
+
+
+def test_ensemble_executor_adaptive(tiny_model):
+  with pytest.raises(ValueError):
+    Ensemble([tiny_model(seed) for seed in range(3)], tolerance=0.01, executor='threads')
+
+
+def test_process_executor_error(tiny_model):
+  models = [tiny_model(seed) for seed in range(3)]
+  x = torch.randn(1, 4, 300, 81)
+  with torch.no_grad():
+    expected = Ensemble(models)(x)
+
+  ensemble = Ensemble(models, executor='processes', num_workers=2)
+  try:
+    with torch.no_grad():
+      # Every worker fails on an input with the wrong number of stems.
+      with pytest.raises(Exception):
+        ensemble(torch.randn(1, 3, 300, 81))
+      # The failed replies are all consumed, so the next call gets its own outputs.
+      actual = ensemble(x)
+  finally:
+    ensemble.close()
+  torch.testing.assert_close(actual.logits_beat, expected.logits_beat)
+
+
+def test_analyze_ensemble_executor(tmp_path, tiny_model):
+  models = [tiny_model(seed) for seed in range(2)]
+  # The executor of a module cannot be set by analyze.
+  with pytest.raises(ValueError, match='ensemble_executor'):
+    analyze(tmp_path / 'track.wav', model=models[0], ensemble_executor='threads')
+
+  path = tmp_path / 'track.wav'
+  path.touch()
+  (tmp_path / 'spec').mkdir()
+  np.save(tmp_path / 'spec' / 'track.npy', np.random.rand(4, 300, 81).astype('float32'))
+  ensemble = Ensemble(models, executor='threads', num_workers=2)
+  try:
+    result = analyze(
+      path, model=ensemble, device='cpu', spec_dir=tmp_path / 'spec', demix_dir=tmp_path / 'demix',
+      skip_separation=True, keep_byproducts=True, multiprocess=False,
+    )
+    assert result.num_models == 2
+    # The executor of an ensemble given by the caller is left running.
+    assert ensemble.executor is not None
+  finally:
+    ensemble.close()
@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+
+from allin1fix.helpers import HostBuffer, run_model, postprocess_activations, transfer_to_host
+from allin1fix.postprocessing import (
+  postprocess_metrical_structure,
+  postprocess_functional_structure,
+  estimate_tempo_from_beats,
+)
+
+
+def test_transfer_to_host():
+  tensors = {
+    'a': torch.rand(10),
+    'b': torch.rand(3, 7).t(),
+    'c': torch.rand(2, 4, 5, dtype=torch.float64),
+  }
+  buffer = HostBuffer(pin_memory=False)
+  for arrays in [transfer_to_host(tensors), transfer_to_host(tensors, buffer)]:
+    assert list(arrays) == list(tensors)
+    for key, tensor in tensors.items():
+      assert arrays[key].dtype == np.float32
+      np.testing.assert_array_equal(arrays[key], tensor.float().numpy())
+    # The float32 tensors on the CPU are not copied.
+    assert np.shares_memory(arrays['a'], tensors['a'].numpy())
+    assert np.shares_memory(arrays['b'], tensors['b'].numpy())
+
+  # The buffer is reused and the arrays returned earlier stay valid.
+  first = buffer.copy_from(torch.ones(20))
+  buffer_tensor = buffer.tensor
+  second = buffer.copy_from(torch.zeros(10))
+  assert buffer.tensor is buffer_tensor
+  assert first.sum() == 20 and second.sum() == 0
+
+
+def test_postprocess_activations(tmp_path, tiny_model):
+  model = tiny_model()
+  cfg = model.cfg
+
+  spec_path = tmp_path / 'track.npy'
+  np.save(spec_path, np.random.rand(4, 800, 81).astype('float32'))
+
+  with torch.no_grad():
+    activations = run_model(spec_path, model, 'cpu', include_embeddings=True, buffer=HostBuffer())
+    result = postprocess_activations(tmp_path / 'track.wav', activations, cfg, True, True)
+    logits = model(torch.from_numpy(np.load(spec_path)).unsqueeze(0))
+
+  metrical_structure = postprocess_metrical_structure(logits, cfg)
+  assert result.beats == metrical_structure['beats']
+  assert result.downbeats == metrical_structure['downbeats']
+  assert result.beat_positions == metrical_structure['beat_positions']
+  assert result.bpm == estimate_tempo_from_beats(metrical_structure['beats'])
+  assert result.segments == postprocess_functional_structure(logits, cfg)
+
+  assert sorted(result.activations) == ['beat', 'downbeat', 'label', 'segment']
+  np.testing.assert_array_equal(result.activations['label'], torch.softmax(logits.logits_function[0], dim=0).numpy())
+  np.testing.assert_array_equal(result.embeddings, logits.embeddings[0].numpy())
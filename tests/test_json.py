@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import pytest
+
+from pathlib import Path
+from allin1fix import utils
+from allin1fix.helpers import save_results
+from allin1fix.typings import AnalysisResult, Segment
+from allin1fix.utils import compact_json_number_array, dumps_json
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def backend(request, monkeypatch):
+  if request.param == 'orjson':
+    pytest.importorskip('orjson')
+  else:
+    monkeypatch.setattr(utils, 'orjson', None)
+  return request.param
+
+
+def test_dumps_json(backend):
+  rng = np.random.default_rng(0)
+  objs = [
+    {
+      'path': '/music/track.wav',
+      'bpm': 120,
+      'beats': (np.arange(500) * 0.48).round(2).tolist(),
+      'downbeats': [],
+      'beat_positions': [i % 4 + 1 for i in range(500)],
+      'segments': [{'start': 0., 'end': 12.5, 'label': 'intro'}, {'start': 12.5, 'end': 30., 'label': 'verse'}],
+    },
+    {'path': 'café "live"\n.wav', 'bpm': None, 'beats': [0.5], 'downbeats': [3], 'nested': [[1, 2], [3., 4.5]]},
+    (10 ** rng.uniform(-7, 18, 1000)).tolist(),
+    rng.uniform(0, 1e-3, 1000).tolist(),
+    [1e-4, 2.5], [1e-05, 2.5], [0.00009, 1], [9999999999999998.0, 1.], [1e16, 1.], [12345678901234567890, 1],
+    [2 ** 70, 1], [0.5, -1], [-0.0, 1], [0., 1], [float('nan'), 1.], [float('inf'), 1.], [True, 1], [1, False],
+    [np.float64(0.25), np.float64(0.5)], (1, 2), [1, '2'], ['a', 1, 2], [None, 1], [1, [2, 3]], [[], {}], [],
+    {1: [1, 2], 2.5: True, None: 'x'}, 7, 0.1, 'x', None,
+  ]
+  for obj in objs:
+    assert dumps_json(obj) == compact_json_number_array(json.dumps(obj, indent=2))
+  with pytest.raises(TypeError):
+    dumps_json({'beats': np.arange(3)})
+
+
+def test_save_results_json(tmp_path, backend):
+  result = AnalysisResult(
+    path=Path('/music/track.wav'),
+    bpm=92,
+    beats=(np.arange(2000) * 0.65).round(2).tolist(),
+    downbeats=(np.arange(500) * 2.6).round(2).tolist(),
+    beat_positions=[i % 4 + 1 for i in range(2000)],
+    segments=[Segment(start=0., end=20.8, label='start'), Segment(start=20.8, end=1300., label='chorus')],
+  )
+  save_results(result, tmp_path)
+  text = (tmp_path / 'track.json').read_text()
+  assert '"beats": [0.0,0.65,1.3,' in text
+  assert AnalysisResult.from_json(tmp_path / 'track.json') == result
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from numpy.lib.stride_tricks import sliding_window_view
+from allin1fix.postprocessing import kernels
+from allin1fix.postprocessing.kernels import local_maxima, median_filter_1d, peak_picking
+
+
+# The unfold and sliding window formulations that the kernels replace.
+def unfold_local_maxima(tensor, filter_size):
+  padding = filter_size // 2
+  padded = F.pad(tensor.unsqueeze(0), (padding, padding), mode='constant', value=-torch.inf)
+  windows = padded.unfold(1, filter_size, 1)
+  mask = torch.eq(windows[:, :, padding], windows.max(dim=-1).values)
+  output = torch.zeros_like(tensor.unsqueeze(0))
+  output[mask] = tensor.unsqueeze(0)[mask]
+  return output[0], mask.nonzero()
+
+
+def unfold_median_filter_1d(tensor, filter_size):
+  padding = filter_size // 2
+  padded = F.pad(tensor.unsqueeze(0), (padding, padding), mode='reflect')
+  return padded.unfold(1, filter_size, 1).median(dim=-1).values[0]
+
+
+def sliding_window_peak_picking(activation, window_past, window_future):
+  padded = np.pad(activation, (window_past, window_future), mode='constant')
+  max_filter = sliding_window_view(padded, window_past + window_future + 1)
+  maxima = (activation == np.max(max_filter, axis=-1)) & (activation > 0)
+  past_mean = np.mean(sliding_window_view(padded[:-(window_future + 1)], window_past), axis=-1)
+  future_mean = np.mean(sliding_window_view(padded[window_past + 1:], window_future), axis=-1)
+  strength = activation - ((past_mean + future_mean) / 2)
+  output = np.zeros_like(activation)
+  output[maxima] = strength[maxima]
+  return output
+
+
+def make_activation(num_frames, seed=0):
+  rng = np.random.default_rng(seed)
+  activation = rng.uniform(0., 0.1, num_frames).astype(np.float32)
+  activation[rng.choice(num_frames, num_frames // 50, replace=False)] = rng.uniform(0.5, 1., num_frames // 50)
+  # Plateaus, whose frames are all maxima.
+  activation[100:110] = 0.7
+  activation[:5] = 0.
+  return activation
+
+
+@pytest.mark.parametrize('filter_size', [1, 17, 97])
+def test_local_maxima(filter_size):
+  activation = torch.from_numpy(make_activation(3000))
+  output, indices = local_maxima(activation, filter_size=filter_size)
+  expected_output, expected_indices = unfold_local_maxima(activation, filter_size)
+  assert torch.equal(output, expected_output)
+  assert torch.equal(indices, expected_indices)
+
+  batch = torch.stack([activation, activation.flip(0)])
+  output, indices = local_maxima(batch, filter_size=filter_size)
+  assert torch.equal(output[1], unfold_local_maxima(batch[1], filter_size)[0])
+  assert indices.shape == (2 * len(expected_indices), 2)
+
+
+@pytest.mark.parametrize('filter_size', [3, 401])
+def test_median_filter_1d(filter_size):
+  activation = torch.from_numpy(make_activation(3000))
+  assert torch.equal(median_filter_1d(activation, filter_size), unfold_median_filter_1d(activation, filter_size))
+
+  # float64 inputs are filtered in float64.
+  batch = torch.stack([activation, activation.flip(0)]).double() + torch.rand(2, 3000, dtype=torch.float64) * 1e-7
+  output = median_filter_1d(batch, filter_size)
+  assert output.dtype == torch.float64
+  assert torch.equal(output[1], unfold_median_filter_1d(batch[1], filter_size))
+
+  # The kernel of the tensors on a GPU, which stay on their device.
+  assert torch.equal(kernels._unfold_median_filter_1d(batch, filter_size), output)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='CUDA is not available')
+def test_median_filter_1d_cuda():
+  activation = torch.from_numpy(make_activation(3000))
+  output = median_filter_1d(activation.cuda(), 401)
+  assert output.is_cuda
+  assert torch.equal(output.cpu(), median_filter_1d(activation, 401))
+
+
+@pytest.mark.parametrize('window_past, window_future', [(12, 6), (6, 12), (1200, 1200)])
+def test_peak_picking(window_past, window_future):
+  activation = make_activation(6000)
+  output = peak_picking(activation, window_past, window_future)
+  expected = sliding_window_peak_picking(activation, window_past, window_future)
+  assert output.dtype == expected.dtype
+  np.testing.assert_array_equal(output, expected)
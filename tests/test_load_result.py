@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from pathlib import Path
+from allin1fix import analyze, load_result
+from allin1fix.helpers import save_results
+from allin1fix.typings import AnalysisResult, LazyActivations, LazyEmbeddings, Segment
+
+
+def test_lazy_load_result(tmp_path):
+  rng = np.random.default_rng(0)
+  activations = {key: rng.random(300).astype(np.float32) for key in ['beat', 'downbeat']}
+  embeddings = rng.random((4, 300, 24)).astype(np.float32)
+  result = AnalysisResult(
+    path=Path('/music/track.wav'),
+    bpm=120,
+    beats=[0.5, 1.],
+    downbeats=[0.5],
+    beat_positions=[1, 2],
+    segments=[Segment(start=0., end=3., label='intro')],
+    activations=activations,
+    embeddings=embeddings,
+  )
+  save_results(result, tmp_path)
+
+  loaded = load_result(tmp_path / 'track.json')
+  assert isinstance(loaded.activations, LazyActivations)
+  assert loaded.activations._keys is None and not loaded.activations._arrays
+  assert isinstance(loaded.embeddings, LazyEmbeddings) and loaded.embeddings._array is None
+  assert loaded.embeddings.shape == embeddings.shape and loaded.embeddings.dtype == np.float32
+  assert loaded.embeddings._array is None
+  np.testing.assert_array_equal(loaded.activations['beat'], activations['beat'])
+  assert list(loaded.activations._arrays) == ['beat']
+  assert sorted(loaded.activations) == ['beat', 'downbeat']
+  np.testing.assert_array_equal(loaded.embeddings, embeddings)
+
+  # Saving over the files the result was loaded from.
+  save_results(loaded, tmp_path)
+  reloaded = load_result(tmp_path / 'track.json')
+  np.testing.assert_array_equal(reloaded.embeddings, embeddings)
+  np.testing.assert_array_equal(reloaded.activations['downbeat'], activations['downbeat'])
+
+  skipped = load_result(tmp_path / 'track.json', load_activations=False, load_embeddings=False)
+  assert skipped.activations is None and skipped.embeddings is None
+
+
+def test_load_results_closes_files(tmp_path):
+  # Loading and reading many results leaves no file open.
+  fd_dir = Path('/proc/self/fd')
+  if not fd_dir.is_dir():
+    pytest.skip('needs /proc')
+  embeddings = np.zeros((4, 30, 24), dtype=np.float32)
+  for i in range(50):
+    result = AnalysisResult(
+      path=Path(f'/music/track{i}.wav'), bpm=120, beats=[], downbeats=[], beat_positions=[], segments=[],
+      activations={'beat': np.zeros(30, dtype=np.float32)}, embeddings=embeddings,
+    )
+    save_results(result, tmp_path)
+
+  num_fds = len(list(fd_dir.iterdir()))
+  results = [load_result(tmp_path / f'track{i}.json') for i in range(50)]
+  assert sum(result.embeddings[0, 0, 0] + result.activations['beat'][0] for result in results) == 0
+  assert len(list(fd_dir.iterdir())) == num_fds
+
+
+def test_analyze_resume(tmp_path, tiny_model):
+  model = tiny_model()
+
+  paths = []
+  (tmp_path / 'spec').mkdir()
+  for i in range(4):
+    path = tmp_path / f'track{i}.wav'
+    path.touch()
+    paths.append(path)
+    np.save(tmp_path / 'spec' / f'track{i}.npy', np.random.rand(4, 300, 81).astype('float32'))
+
+  kwargs = dict(
+    out_dir=tmp_path / 'out', model=model, device='cpu', spec_dir=tmp_path / 'spec', demix_dir=tmp_path / 'demix',
+    skip_separation=True, keep_byproducts=True, multiprocess=False,
+  )
+  first = analyze([paths[2], paths[0]], **kwargs)
+
+  # Existing results are loaded and returned along with the new ones, in the order of the paths.
+  results = analyze([paths[2], paths[1], paths[0]], load_workers=2, **kwargs)
+  assert [result.path for result in results] == paths[:3]
+  assert results[0] == first[0] and results[2] == first[1]
+
+  # Only the new results are returned.
+  results = analyze(paths, load_existing=False, **kwargs)
+  assert [result.path for result in results] == [paths[3]]
+  assert analyze(paths[0], load_existing=False, **kwargs) is None
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from madmom.features.downbeats import DBNDownBeatTrackingProcessor
+from allin1fix.postprocessing import get_downbeat_processor
+from allin1fix.postprocessing.metrical import decode_metrical_structure, hint_to_dbn_kwargs, pick_metrical_structure
+from allin1fix.typings import MetricalHint
+
+
+def test_get_downbeat_processor(make_activations):
+  processor = get_downbeat_processor([3, 4], threshold=0.2, fps=100)
+  assert get_downbeat_processor((3, 4), 0.2, 100.) is processor
+  assert get_downbeat_processor((3, 4), 0.2, 100, min_bpm=60.) is not processor
+
+  acts = make_activations()
+  expected = DBNDownBeatTrackingProcessor(beats_per_bar=[3, 4], threshold=0.2, fps=100)(acts)
+  np.testing.assert_array_equal(processor(acts), expected)
+  np.testing.assert_array_equal(processor(acts), expected)
+
+
+def test_pick_metrical_structure(tiny_cfg):
+  cfg = tiny_cfg(threshold=0.3)
+  rng = np.random.default_rng(0)
+  prob_beats = rng.uniform(0., 0.05, 2000).astype(np.float32)
+  prob_downbeats = rng.uniform(0., 0.05, 2000).astype(np.float32)
+  beats = np.arange(20, 2000, 50)  # 120 BPM in 3/4, starting on the second beat of a bar
+  prob_beats[beats] = 0.8
+  prob_downbeats[beats[2::3] + 3] = 0.9  # Slightly off, snapped to the beats
+  prob_downbeats[beats[14] + 3] = 0.  # A missed downbeat
+
+  result = pick_metrical_structure(prob_beats, prob_downbeats, cfg)
+  assert result['beats'] == (beats / 100).tolist()
+  assert result['beat_positions'] == [(i + 1) % 3 + 1 for i in range(len(beats))]
+  assert result['downbeats'] == (beats[2::3] / 100).tolist()
+
+  # A downbeat far from any beat becomes a beat.
+  prob_downbeats[1005] = 0.9
+  result = pick_metrical_structure(prob_beats, prob_downbeats, cfg)
+  assert 10.05 in result['beats'] and 10.05 in result['downbeats']
+
+  # Without any downbeat, the beats are counted in 4 from the first one.
+  result = pick_metrical_structure(prob_beats, np.zeros_like(prob_downbeats), cfg)
+  assert result['beat_positions'][:5] == [1, 2, 3, 4, 1]
+
+
+def test_metrical_hints(make_activations, tiny_cfg):
+  assert hint_to_dbn_kwargs(None) == dict(beats_per_bar=(3, 4), min_bpm=55., max_bpm=215.)
+  assert hint_to_dbn_kwargs(MetricalHint(beats_per_bar=4))['beats_per_bar'] == (4,)
+  kwargs = hint_to_dbn_kwargs(MetricalHint(bpm=120))
+  assert (kwargs['min_bpm'], kwargs['max_bpm']) == (6000 / 53, 6000 / 48)
+  # Hints covering the same beat intervals share a processor.
+  assert hint_to_dbn_kwargs(MetricalHint(bpm=120.2)) == kwargs
+  assert hint_to_dbn_kwargs(MetricalHint(bpm=(114, 125.5))) == kwargs
+  with pytest.raises(ValueError):
+    hint_to_dbn_kwargs(MetricalHint(bpm=(130, 110)))
+
+  cfg = tiny_cfg()
+  acts = make_activations(3000)
+  hint = MetricalHint(bpm=120, beats_per_bar=[4])
+  processor = get_downbeat_processor(threshold=0.2, fps=100, **hint_to_dbn_kwargs(hint))
+  default_processor = get_downbeat_processor(threshold=0.2, fps=100)
+  assert len(processor.hmms) == 1
+  assert processor.hmms[0].transition_model.num_states < default_processor.hmms[1].transition_model.num_states / 10
+
+  expected = decode_metrical_structure(acts, cfg)
+  assert decode_metrical_structure(acts, cfg, hint) == expected
+  assert decode_metrical_structure(acts, cfg, MetricalHint(bpm=(100, 140))) == expected
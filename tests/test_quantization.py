@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from allin1fix.models import quantize_model, compute_quantization_report
+from allin1fix.models import loaders
+from allin1fix.models.ensemble import Ensemble
+
+
+def test_quantize_model(tiny_model):
+  models = [tiny_model(seed) for seed in range(2)]
+  num_linears = [sum(type(m) is nn.Linear for m in model.modules()) for model in models]
+  ensemble = quantize_model(Ensemble(models))
+  for model, num_linear in zip(ensemble.models, num_linears):
+    assert num_linear > 0
+    assert not any(isinstance(m, nn.Linear) for m in model.modules())
+    assert sum(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in model.modules()) == num_linear
+
+  with pytest.raises(ValueError, match='only supported on CPU'):
+    quantize_model(tiny_model().to('meta'))
+
+
+def test_compute_quantization_report(tmp_path, monkeypatch, tiny_model):
+  monkeypatch.setattr(
+    loaders, 'load_pretrained_model',
+    lambda model_name, cache_dir=None, device='cpu', quantize=False: (
+      quantize_model(tiny_model()) if quantize else tiny_model()
+    ),
+  )
+  rng = np.random.default_rng(0)
+  spec_paths = []
+  for i in range(2):
+    spec_paths.append(tmp_path / f'track{i}.npy')
+    np.save(spec_paths[-1], rng.random((4, 500, 81), dtype=np.float32))
+
+  report = compute_quantization_report(spec_paths)
+  assert sorted(report) == sorted([
+    'beat_f1', 'downbeat_f1', 'section_f1', 'function_agreement', 'max_logit_diff', 'time_fp32', 'time_int8',
+    'speedup',
+  ])
+  assert 0 <= report['function_agreement'] <= 1
+  assert report['max_logit_diff'] > 0
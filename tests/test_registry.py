@@ -0,0 +1,41 @@
+import pytest
+import torch
+
+from omegaconf import OmegaConf
+from allin1fix.models import AllInOne, load_pretrained_model, populate_registry, verify_registry
+from allin1fix.models import loaders
+
+
+def make_hf_cache(cache_dir, model_names, cfg):
+  """Creates a Hugging Face cache holding fold checkpoints with random weights, as hf_hub_download would."""
+  repo_dir = cache_dir / f'models--{loaders.HF_REPO_ID.replace("/", "--")}'
+  snapshot_dir = repo_dir / 'snapshots' / 'abc123'
+  snapshot_dir.mkdir(parents=True)
+  (repo_dir / 'refs').mkdir()
+  (repo_dir / 'refs' / 'main').write_text('abc123')
+  for name in model_names:
+    checkpoint = {'config': OmegaConf.to_container(cfg), 'state_dict': AllInOne(cfg).state_dict()}
+    torch.save(checkpoint, snapshot_dir / loaders.NAME_TO_FILE[name])
+
+
+def test_registry(tmp_path, monkeypatch, tiny_cfg):
+  make_hf_cache(tmp_path / 'hf', ['harmonix-fold0', 'harmonix-fold1'], tiny_cfg())
+  model_dir = tmp_path / 'registry'
+  populate_registry(model_dir, 'harmonix-fold0', cache_dir=tmp_path / 'hf')
+  populate_registry(model_dir, 'harmonix-fold1', cache_dir=tmp_path / 'hf')
+  assert verify_registry(model_dir) == {'harmonix-fold0': 'ok', 'harmonix-fold1': 'ok'}
+
+  def hf_hub_download(*args, **kwargs):
+    raise AssertionError('The registry must not access the Hugging Face Hub.')
+
+  monkeypatch.setattr(loaders, 'hf_hub_download', hf_hub_download)
+  monkeypatch.setenv('ALLIN1FIX_MODEL_DIR', str(model_dir))
+  model = load_pretrained_model('harmonix-fold1', cache_dir=tmp_path / 'cache', device='cpu')
+  assert model.cfg.depth == 2
+
+  with pytest.raises(FileNotFoundError):
+    load_pretrained_model('harmonix-fold2', cache_dir=tmp_path / 'cache', device='cpu')
+
+  with open(model_dir / loaders.NAME_TO_FILE['harmonix-fold0'], 'r+b') as f:
+    f.write(b'corrupted')
+  assert verify_registry() == {'harmonix-fold0': 'corrupted', 'harmonix-fold1': 'ok'}
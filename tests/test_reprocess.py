@@ -0,0 +1,133 @@
+import json
+import numpy as np
+import pytest
+
+from scipy.special import logit
+from allin1fix import analyze, reprocess
+from allin1fix.reprocess import cache_settings_name, load_cached_activations, save_cached_activations
+from allin1fix.utils import compute_sha256
+
+
+def test_reprocess(tmp_path, tiny_model):
+  # The probabilities of the untrained model are around 0.02, so that it still finds beats.
+  model = tiny_model(threshold=0.01)
+
+  # Cached spectrograms skip the separation and extraction steps.
+  paths = []
+  (tmp_path / 'spec').mkdir()
+  for i, frames in enumerate([900, 300, 600]):
+    path = tmp_path / f'track{i}.wav'
+    path.touch()
+    paths.append(path)
+    np.save(tmp_path / 'spec' / f'track{i}.npy', np.random.rand(4, frames, 81).astype('float32'))
+
+  expected = analyze(
+    paths,
+    out_dir=tmp_path / 'analyze',
+    model=model,
+    device='cpu',
+    spec_dir=tmp_path / 'spec',
+    demix_dir=tmp_path / 'demix',
+    skip_separation=True,
+    keep_byproducts=True,
+    multiprocess=False,
+    include_activations=True,
+    activations_dir=tmp_path / 'activations',
+    model_name='tiny',
+  )
+
+  assert all(result.beats and result.segments for result in expected)
+  cache_paths = sorted((tmp_path / 'activations' / 'tiny' / 'default').glob('*.npz'))
+  assert len(cache_paths) == 3
+  with np.load(cache_paths[0]) as data:
+    assert sorted(data.files) == ['logits_beat', 'logits_downbeat', 'logits_function', 'logits_section', 'path']
+    assert data['logits_function'].dtype == np.float32
+  cached_path, activations = load_cached_activations(cache_paths[0])
+  assert cached_path in paths
+  assert sorted(activations) == ['beat', 'dbn', 'downbeat', 'label', 'segment']
+
+  kwargs = dict(activations_dir=tmp_path / 'activations', model='tiny')
+  results = reprocess(out_dir=tmp_path / 'reprocess', include_activations=True, num_workers=0, **kwargs)
+  assert [result.path for result in results] == paths
+  for result, expected_result in zip(results, expected):
+    # The same settings give the results of analyze.
+    assert result.beats == expected_result.beats
+    assert result.downbeats == expected_result.downbeats
+    assert result.beat_positions == expected_result.beat_positions
+    assert result.segments == expected_result.segments
+    for key, value in expected_result.activations.items():
+      np.testing.assert_array_equal(result.activations[key], value)
+    assert json.loads((tmp_path / 'reprocess' / f'{result.path.stem}.json').read_text())['path'] == str(result.path)
+
+  # The workers give the same results as the inline reprocessing.
+  assert reprocess(num_workers=2, **kwargs) == reprocess(num_workers=0, **kwargs)
+
+  # Other postprocessing settings, for some of the tracks only.
+  results = reprocess(
+    paths=['track1.wav'], metrical_postprocessor='peaks',
+    cfg_overrides={'best_threshold_beat': 0.9, 'best_threshold_downbeat': 0.9}, include_activations=True,
+    num_workers=0, **kwargs,
+  )
+  assert [result.path for result in results] == [paths[1]]
+  activations = results[0].activations
+  assert len(results[0].beats) <= np.sum(activations['beat'] > 0.9) + np.sum(activations['downbeat'] > 0.9)
+
+  # The logits of other settings are kept next to those of the first run instead of replacing them.
+  analyze(
+    paths[:1], out_dir=tmp_path / 'beats', model=model, device='cpu', spec_dir=tmp_path / 'spec',
+    demix_dir=tmp_path / 'demix', skip_separation=True, keep_byproducts=True, multiprocess=False,
+    tasks=['beats'], activations_dir=tmp_path / 'activations', model_name='tiny',
+  )
+  assert sorted((tmp_path / 'activations' / 'tiny' / 'default').glob('*.npz')) == cache_paths
+  with np.load(cache_paths[0]) as data:
+    assert 'logits_section' in data.files
+  results = reprocess(num_workers=0, settings={'tasks': ['beats']}, **kwargs)
+  assert [result.path for result in results] == paths[:1]
+  assert results[0].beats == expected[0].beats and not results[0].segments
+  with pytest.raises(FileNotFoundError, match=r"tasks-beats'"):
+    reprocess(num_workers=0, settings={'fuse': True}, **kwargs)
+
+
+def test_cache_settings_name():
+  assert cache_settings_name() == 'default'
+  assert cache_settings_name({'tasks': ['structure', 'beats', 'embeddings']}) == 'default'
+  assert cache_settings_name({'tasks': ['embeddings', 'beats']}) == 'tasks-beats'
+  assert cache_settings_name({'fuse': True, 'quantize': True, 'ensemble_tolerance': 0.01}) == (
+    'fuse-quantize-tolerance0.01'
+  )
+  with pytest.raises(ValueError, match='Unknown settings'):
+    cache_settings_name({'device': 'cpu'})
+
+
+def test_activations_dir_requires_model_name(tmp_path, tiny_model):
+  # Modules have no name of their own to key the kept probabilities.
+  with pytest.raises(ValueError, match='model_name'):
+    analyze(tmp_path / 'track.wav', model=tiny_model(), activations_dir=tmp_path / 'activations')
+
+
+def test_reprocess_small_probabilities(tmp_path, make_activations, tiny_cfg):
+  cfg = tiny_cfg()
+  paths = []
+  for i, frames in enumerate([1200, 300, 900, 40, 600]):
+    acts = make_activations(frames, seed=i)
+    acts[-1] = 1e-9
+    path = tmp_path / f'track{i}.wav'
+    spec_path = tmp_path / f'track{i}.npy'
+    np.save(spec_path, acts)
+    logits = {'logits_beat': logit(acts.max(axis=1)), 'logits_downbeat': logit(acts[:, 1])}
+    save_cached_activations(tmp_path / 'activations', 'tiny', cfg, path, spec_path, logits)
+    paths.append(path)
+
+  # Probabilities far below the float16 resolution are not rounded to 0, so the DBN never takes the log of 0.
+  cache_path = tmp_path / 'activations' / 'tiny' / 'default' / f'{compute_sha256(spec_path)}.npz'
+  _, activations = load_cached_activations(cache_path)
+  assert activations['beat'].min() > 0 and activations['dbn'].min() > 0
+
+  kwargs = dict(
+    activations_dir=tmp_path / 'activations', model='tiny', num_workers=0,
+    metrical_hints={'track2.wav': {'bpm': 120, 'beats_per_bar': [4]}},
+  )
+  results = reprocess(**kwargs)
+  assert [result.path for result in results] == paths
+  assert all(result.beats for result in results[:3])
+  assert set(results[2].beat_positions) == {1, 2, 3, 4}
@@ -0,0 +1,29 @@
+import torch
+
+from omegaconf import OmegaConf
+from allin1fix.models import load_pretrained_model, convert_to_safetensors
+from allin1fix.models import loaders
+
+
+def test_safetensors(tmp_path, monkeypatch, tiny_model):
+  checkpoint_paths = {}
+  for i, name in enumerate(loaders.ENSEMBLE_MODELS['harmonix-all']):
+    model = tiny_model(seed=i)
+    checkpoint_paths[loaders.NAME_TO_FILE[name]] = path = tmp_path / f'{name}.pth'
+    torch.save({'config': OmegaConf.to_container(model.cfg), 'state_dict': model.state_dict()}, path)
+
+  monkeypatch.setattr(loaders, 'hf_hub_download', lambda repo_id, filename, cache_dir: checkpoint_paths[filename])
+  expected = load_pretrained_model('harmonix-all', tmp_path, device='cpu')
+
+  paths = convert_to_safetensors('harmonix-all', tmp_path)
+  assert len(paths) == 8 and all(path.is_file() for path in paths)
+
+  # The converted models must not touch the original checkpoints anymore.
+  monkeypatch.setattr(loaders, 'hf_hub_download', None)
+  actual = load_pretrained_model('harmonix-all', tmp_path, device='cpu')
+
+  assert actual.models[0].cfg == expected.models[0].cfg
+  for model_actual, model_expected in zip(actual.models, expected.models):
+    state_dict = model_expected.state_dict()
+    for key, value in model_actual.state_dict().items():
+      assert torch.equal(value, state_dict[key])
@@ -0,0 +1,40 @@
+import torch
+import torch.multiprocessing as mp
+
+from allin1fix.models import share_model_memory
+from allin1fix.models.ensemble import Ensemble
+
+
+def run_worker(model, x, queue):
+  shared = all(param.is_shared() for param in model.parameters())
+  with torch.no_grad():
+    queue.put((shared, model(x).logits_beat.clone()))
+
+
+def test_share_model_memory(tiny_model):
+  model = share_model_memory(tiny_model())
+  assert all(tensor.is_shared() for tensor in list(model.parameters()) + list(model.buffers()))
+
+  x = torch.randn(1, 4, 200, 81)
+  with torch.no_grad():
+    expected = model(x).logits_beat
+
+  ctx = mp.get_context('spawn')
+  queue = ctx.Queue()
+  process = ctx.Process(target=run_worker, args=(model, x, queue))
+  process.start()
+  shared, actual = queue.get(timeout=120)
+  process.join()
+
+  assert shared
+  torch.testing.assert_close(actual, expected)
+
+
+def test_share_ensemble_memory(tiny_model):
+  ensemble = share_model_memory(Ensemble([tiny_model(0), tiny_model(1)]))
+  assert all(param.is_shared() for model in ensemble.models for param in model.parameters())
+
+  # The method of nn.Module reaches the models of the list as well.
+  ensemble = Ensemble([tiny_model(0), tiny_model(1)])
+  assert ensemble.share_memory() is ensemble
+  assert all(param.is_shared() for model in ensemble.models for param in model.parameters())
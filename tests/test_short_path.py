@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from allin1fix.models.dinat import DinatLayer1d
+
+
+def set_short_path(model, enabled):
+  for module in model.modules():
+    if isinstance(module, DinatLayer1d):
+      module.short_path = enabled
+
+
+@pytest.mark.parametrize('frames', [3, 50, 260])
+def test_short_path(tiny_model, frames):
+  model = tiny_model(depth=6)  # windows of up to 320 frames
+  for param in model.parameters():
+    torch.nn.init.normal_(param, std=0.2)
+
+  x = torch.randn(1, 4, frames, 81)
+  with torch.no_grad():
+    set_short_path(model, False)
+    expected = model(x)
+    set_short_path(model, True)
+    actual = model(x)
+    model.to_inference()
+    fused = model(x)
+
+  for key in ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function', 'embeddings']:
+    torch.testing.assert_close(getattr(actual, key), getattr(expected, key), rtol=1e-5, atol=1e-5)
+  torch.testing.assert_close(fused.logits_beat, expected.logits_beat, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,99 @@
+import json
+import sys
+import numpy as np
+import pytest
+
+from pathlib import Path
+from allin1fix import analyze
+from allin1fix.helpers import save_results
+from allin1fix.typings import AnalysisResult, Segment
+from allin1fix.utils import compute_sha256
+
+pa = pytest.importorskip('pyarrow')
+
+from allin1fix.store import ResultStore  # noqa: E402
+
+
+def make_result(i: int, bpm: int = 120) -> AnalysisResult:
+  return AnalysisResult(
+    path=Path(f'/music/track{i}.wav'),
+    bpm=bpm,
+    beats=[0.5 * j for j in range(i + 1)],
+    downbeats=[2. * j for j in range(i // 4 + 1)],
+    beat_positions=[j % 4 + 1 for j in range(i + 1)],
+    segments=[Segment(start=0., end=1.5, label='intro'), Segment(start=1.5, end=3., label='verse')],
+  )
+
+
+def test_result_store(tmp_path):
+  results = [make_result(i, bpm=100 + i) for i in range(50)]
+  with ResultStore(tmp_path / 'store', num_partitions=4, batch_size=20) as store:
+    store.append(results[:30], content_hashes=[f'hash{i}' for i in range(30)])
+    store.append(results[30:])
+  assert len(list((tmp_path / 'store').glob('part=*/*.parquet'))) > 4
+
+  store = ResultStore(tmp_path / 'store', num_partitions=8)
+  assert store.num_partitions == 4
+  assert store.keys() == sorted(str(result.path) for result in results)
+  assert store.load_result('/music/track7.wav') == results[7]
+  with pytest.raises(KeyError):
+    store.load_result('/music/missing.wav')
+
+  # Vectorized scans over the list columns.
+  table = store.scan(columns=['key', 'beats', 'content_hash'], filter=pa.dataset.field('bpm') >= 140)
+  assert sorted(table['key'].to_pylist()) == sorted(str(result.path) for result in results[40:])
+  assert sum(pa.compute.list_value_length(table['beats']).to_pylist()) == sum(i + 1 for i in range(40, 50))
+  assert store.scan(columns=['content_hash'], filter=pa.dataset.field('key') == '/music/track3.wav')[0][0].as_py() \
+    == 'hash3'
+
+  # The latest result of a key wins, and compaction drops the others.
+  updated = make_result(7, bpm=90)
+  store.append(updated)
+  assert store.load_result('/music/track7.wav') == updated
+  assert store.scan().num_rows == 51
+  store.compact()
+  assert store.scan().num_rows == 50
+  assert len(list((tmp_path / 'store').glob('part=*/*.parquet'))) == 4
+  assert store.load_result('/music/track7.wav') == updated
+
+  # The JSON export matches the files of save_results.
+  store.export_json(tmp_path / 'export')
+  save_results(results[:7] + [updated] + results[8:], tmp_path / 'json')
+  for result in results:
+    name = result.path.with_suffix('.json').name
+    assert json.loads((tmp_path / 'export' / name).read_text()) == json.loads((tmp_path / 'json' / name).read_text())
+
+
+def test_analyze_store(tmp_path, monkeypatch, tiny_model):
+  model = tiny_model()
+
+  paths = []
+  (tmp_path / 'spec').mkdir()
+  for i in range(4):
+    paths.append(tmp_path / f'track{i}.wav')
+    paths[-1].touch()
+    np.save(tmp_path / 'spec' / f'track{i}.npy', np.random.rand(4, 300, 81).astype('float32'))
+
+  # The run fails on the third track.
+  analyze_module = sys.modules['allin1fix.analyze']
+  postprocess_activations = analyze_module.postprocess_activations
+  def failing_postprocess_activations(path, *args):
+    if path == paths[2]:
+      raise RuntimeError('interrupted')
+    return postprocess_activations(path, *args)
+  monkeypatch.setattr(analyze_module, 'postprocess_activations', failing_postprocess_activations)
+
+  kwargs = dict(
+    model=model, device='cpu', spec_dir=tmp_path / 'spec', demix_dir=tmp_path / 'demix', skip_separation=True,
+    keep_byproducts=True, multiprocess=False, store_dir=tmp_path / 'store',
+  )
+  with pytest.raises(RuntimeError, match='interrupted'):
+    analyze(paths, **kwargs)
+
+  # The results done before the failure are in the store, with the hashes of their spectrograms.
+  store = ResultStore(tmp_path / 'store')
+  assert store.keys() == [str(path) for path in paths[:2]]
+  table = store.scan(columns=['key', 'content_hash'])
+  assert sorted(table['content_hash'].to_pylist()) == sorted(
+    compute_sha256(tmp_path / 'spec' / f'track{i}.npy') for i in range(2)
+  )
@@ -0,0 +1,99 @@
+import numpy as np
+import soundfile as sf
+import torch
+
+from madmom.audio.signal import Signal
+from madmom.features.downbeats import DBNDownBeatTrackingProcessor
+from allin1fix.postprocessing import IncrementalDBNDecoder
+from allin1fix.postprocessing.metrical import compute_dbn_activations
+from allin1fix.spectrogram import STEM_NAMES, make_spectrogram_processor
+from allin1fix.streaming import StreamingAnalyzer, StreamingSpectrogram, StemFileTail
+
+
+def test_incremental_dbn_matches_madmom(make_activations):
+  activations = make_activations()
+  for threshold in [None, 0.05]:
+    expected = DBNDownBeatTrackingProcessor(beats_per_bar=[3, 4], threshold=threshold, fps=100)(activations)
+
+    for lag in [len(activations), 100]:
+      decoder = IncrementalDBNDecoder(beats_per_bar=[3, 4], threshold=threshold, fps=100, lag=lag)
+      chunks = [decoder.process(activations[i:i + 37]) for i in range(0, len(activations), 37)]
+      actual = np.concatenate(chunks + [decoder.finalize()])
+      np.testing.assert_array_equal(actual, expected)
+
+
+def test_streaming_spectrogram(tmp_path):
+  rng = np.random.default_rng(0)
+  audio = (rng.standard_normal((4, 44100 * 3 + 123, 2)) * 3000).astype(np.int16)
+  for name, stem in zip(STEM_NAMES, audio):
+    sf.write(tmp_path / f'{name}.wav', stem, 44100, subtype='PCM_16')
+
+  processor = make_spectrogram_processor()
+  expected = np.stack([processor(Signal(str(tmp_path / f'{name}.wav'), num_channels=1)) for name in STEM_NAMES])
+
+  spectrogram = StreamingSpectrogram()
+  tail = StemFileTail(tmp_path)
+  specs = [spectrogram.push(tail.read()), spectrogram.finish()]
+  assert tail.read() is None
+
+  spectrogram.reset()
+  for start in range(0, audio.shape[1], 5000):
+    specs.append(spectrogram.push(audio[:, start:start + 5000]))
+  specs.append(spectrogram.finish())
+
+  assert np.concatenate(specs[:2], axis=1).shape == expected.shape
+  np.testing.assert_allclose(np.concatenate(specs[:2], axis=1), expected, atol=1e-5)
+  np.testing.assert_allclose(np.concatenate(specs[2:], axis=1), expected, atol=1e-5)
+
+
+def test_stem_file_tail(tmp_path):
+  files = [sf.SoundFile(str(tmp_path / f'{name}.wav'), 'w', 44100, 1, 'PCM_16') for name in STEM_NAMES]
+  tail = StemFileTail(tmp_path)
+  for _ in range(3):
+    for f in files:
+      f.write(np.zeros(1000, dtype=np.int16))
+      f.flush()
+    assert tail.read().shape == (4, 1000, 1)
+  assert tail.read() is None
+
+
+def test_streaming_analyzer(tiny_model):
+  # Without a threshold, the DBN decodes the whole stream of the untrained model.
+  model = tiny_model(threshold=None)
+  for param in model.parameters():
+    torch.nn.init.normal_(param, std=0.2)
+  rng = np.random.default_rng(0)
+  audio = (rng.standard_normal((4, 44100 * 10, 2)) * 3000).astype(np.int16)
+
+  # Offline: the model on the spectrogram of the whole stream, then the DBN.
+  spectrogram = StreamingSpectrogram()
+  spec = np.concatenate([spectrogram.push(audio), spectrogram.finish()], axis=1)
+  with torch.no_grad():
+    logits = model(torch.from_numpy(spec).unsqueeze(0))
+  activations = compute_dbn_activations(logits.logits_beat[0], logits.logits_downbeat[0])
+  expected = DBNDownBeatTrackingProcessor(beats_per_bar=[3, 4], fps=100)(activations)
+
+  for dbn_lag in [30., 1.]:
+    analyzer = StreamingAnalyzer(model, window=6., hop=1., lookahead=2., dbn_lag=dbn_lag)
+    decoded = []
+    process = analyzer.decoder.process
+    analyzer.decoder.process = lambda acts: decoded.append(acts) or process(acts)
+    pushed = [analyzer.push(audio[:, start:start + 22050]) for start in range(0, audio.shape[1], 22050)]
+    finished = analyzer.finish()
+
+    # The windows of the model give the activations of the whole stream, frame by frame.
+    np.testing.assert_allclose(np.concatenate(decoded), activations, atol=1e-5)
+    # The stream holds every beat emitted by push and flushed by finish.
+    assert [beat for result in pushed + [finished] for beat in result['beats']] == analyzer.beats
+    assert [beat for result in pushed + [finished] for beat in result['downbeats']] == analyzer.downbeats
+
+    if dbn_lag == 30.:
+      # A lag covering the whole stream defers every beat to finish, which gives the offline result.
+      assert not any(result['beats'] for result in pushed)
+      assert analyzer.beats == expected[:, 0].tolist()
+      assert analyzer.downbeats == expected[expected[:, 1] == 1, 0].tolist()
+      assert analyzer.beat_positions == expected[:, 1].astype(int).tolist()
+    else:
+      # A short lag commits beats while the stream goes on, and finish flushes the last ones.
+      assert any(result['beats'] for result in pushed) and finished['beats']
+      assert analyzer.beats == sorted(analyzer.beats)
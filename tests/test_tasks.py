@@ -0,0 +1,73 @@
+import copy
+import numpy as np
+import pytest
+import torch
+
+from allin1fix import helpers
+from allin1fix.helpers import run_inference
+from allin1fix.models import quantize_model
+
+HEAD_LOGITS = {
+  'beat': 'logits_beat',
+  'downbeat': 'logits_downbeat',
+  'section': 'logits_section',
+  'function': 'logits_function',
+}
+
+
+def test_selected_heads(tiny_model):
+  model = tiny_model()
+  fused = copy.deepcopy(model).to_inference()
+  quantized = quantize_model(copy.deepcopy(fused))
+  calls = []
+  fused.classifier.classifier.register_forward_hook(lambda *args: calls.append(1))
+  variants = [(model, 1e-6), (fused, 1e-5), (quantized, 1e-6)]
+
+  x = torch.randn(1, 4, 300, 81)
+  with torch.no_grad():
+    for variant, atol in variants:
+      expected = variant(x)
+      for heads in [['beat'], ['beat', 'downbeat'], ['section', 'function'], ['function'], []]:
+        calls.clear()
+        output = variant(x, heads=heads, output_embeddings=False)
+        assert output.embeddings is None
+        for head, key in HEAD_LOGITS.items():
+          if head in heads:
+            torch.testing.assert_close(getattr(output, key), getattr(expected, key), rtol=1e-5, atol=atol)
+          else:
+            assert getattr(output, key) is None
+        # The fused classifier only computes the rows of the requested heads.
+        assert not calls
+
+
+@pytest.mark.parametrize('tasks', [['beats'], ['structure'], ['embeddings']])
+def test_selected_tasks(tmp_path, monkeypatch, tiny_model, tasks):
+  decoded = []
+  for name in ['decode_metrical_structure', 'decode_functional_structure']:
+    decode = getattr(helpers, name)
+    monkeypatch.setattr(helpers, name, lambda *args, name=name, decode=decode: decoded.append(name) or decode(*args))
+
+  spec_path = tmp_path / 'track.npy'
+  np.save(spec_path, np.random.rand(4, 500, 81).astype('float32'))
+  with torch.no_grad():
+    result = run_inference(
+      tmp_path / 'track.wav', spec_path, tiny_model(), 'cpu', include_activations=True,
+      include_embeddings='embeddings' in tasks, tasks=tasks,
+    )
+
+  assert decoded == (['decode_metrical_structure'] if 'beats' in tasks else []) + (
+    ['decode_functional_structure'] if 'structure' in tasks else []
+  )
+  if 'beats' not in tasks:
+    assert result.bpm is None and result.beats == result.downbeats == result.beat_positions == []
+  if 'structure' in tasks:
+    assert result.segments
+  else:
+    assert result.segments == []
+  assert sorted(result.activations) == sorted(
+    {'beats': ['beat', 'downbeat'], 'structure': ['segment', 'label'], 'embeddings': []}[tasks[0]]
+  )
+  if 'embeddings' in tasks:
+    assert result.embeddings.shape == (4, 500, 24)
+  else:
+    assert result.embeddings is None
@@ -0,0 +1,23 @@
+import copy
+import torch
+
+
+def test_to_inference(tiny_model):
+  model = tiny_model(depth=4)
+  for param in model.parameters():
+    param.data.normal_(0, 0.2)
+  fused = copy.deepcopy(model).to_inference()
+
+  assert fused.classifier is not None
+  assert not any(isinstance(m, torch.nn.Dropout) for m in fused.modules())
+
+  x = torch.randn(1, 4, 500, 81)
+  with torch.no_grad():
+    expected = model(x)
+    actual = fused(x)
+    actual_beats = fused(x, heads=['beat', 'downbeat'])
+
+  for key in ['logits_beat', 'logits_downbeat', 'logits_section', 'logits_function', 'embeddings']:
+    torch.testing.assert_close(getattr(actual, key), getattr(expected, key), rtol=1e-5, atol=1e-5)
+  torch.testing.assert_close(actual_beats.logits_beat, expected.logits_beat, rtol=1e-5, atol=1e-5)
+  assert actual_beats.logits_section is None